@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import duckdb
+
+from load_pond import load_pond
+from mock_xrpc import MockXrpcServer, SyntheticGraph
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ROOT = SyntheticGraph.handle(0)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Ingestion paths: the script to run and the environment it runs with
+PATHS = {
+    "follows": ("follows.py", {"bsky_crawl_mode": "processes"}),
+    "follows_async": ("follows.py", {"bsky_crawl_mode": "async"}),
+    "follows_dlt": ("follows_dlt.py", {}),
+}
+
+# follows.py only writes the pond, so its load time is that of load_pond.py bulk loading it into bluesky.duckdb
+# follows_dlt.py loads as it crawls; each load's time is from its load_id until dlt recorded it
+DLT_LOAD_SQL = "SELECT COALESCE(SUM(epoch(inserted_at) - load_id::DOUBLE), 0), COUNT(*) FROM raw_http._dlt_loads"
+ROWS_SQL = "SELECT (SELECT COUNT(*) FROM raw_http.follows) + (SELECT COUNT(*) FROM raw_http.followers)"
+
+def run_path(name: str, server: MockXrpcServer, workdir: str, extra_env: Dict[str, str]) -> Dict:
+    """Crawl the mock graph with one ingestion path in a fresh directory and measure it"""
+    script, path_env = PATHS[name]
+    # dlt keeps pipeline state in its data dir, which must not be the user's real one. bsky_actors
+    # wins over bsky_actor, so both are set to keep real handles in the environment off the mock
+    env = dict(os.environ, bsky_actors=ROOT, bsky_actor=ROOT, bsky_api_url=server.url,
+               DLT_DATA_DIR=os.path.join(workdir, ".dlt"), **path_env, **extra_env)
+    server.reset_counters()
+
+    start_time = time.monotonic()
+    with open(os.path.join(workdir, "crawl.log"), "w") as log:
+        process = subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=workdir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the largest RSS of the crawler and the workers it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    crawl_time = time.monotonic() - start_time
+    counters = dict(server.counters)
+
+    load_time, loads, rows = None, None, None
+    con = duckdb.connect(os.path.join(workdir, "bluesky.duckdb"))
+    try:
+        if name == "follows_dlt":
+            load_time, loads = con.execute(DLT_LOAD_SQL).fetchone()
+        else:
+            load_start = time.monotonic()
+            load_pond(con, os.path.join(workdir, "pond"))
+            load_time, loads = time.monotonic() - load_start, 1
+        rows = con.execute(ROWS_SQL).fetchone()[0]
+    except duckdb.Error as e:
+        logger.error(f"{name} left nothing to load, rerun with --keep and see {workdir}/crawl.log: {str(e)}")
+    finally:
+        con.close()
+
+    return {
+        "path": name,
+        "exit_code": process.returncode,
+        "crawl_seconds": round(crawl_time, 2),
+        "load_seconds": round(load_time, 2) if load_time is not None else None,
+        "loads": loads,
+        "pages": counters["pages"],
+        "pages_per_second": round(counters["pages"] / crawl_time, 1),
+        "records_per_second": round(counters["records"] / crawl_time, 1),
+        "records_served": counters["records"],
+        "rows_stored": rows,
+        "throttled": counters["throttled"],
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+def print_table(results: List[Dict]):
+    columns = list(results[0])
+    widths = {column: max(len(column), *(len(str(result[column])) for result in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(widths[column]) for column in columns))
+
+def main():
+    """Crawl a synthetic graph served by mock_xrpc.py with each ingestion path and compare them"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--paths", default=",".join(PATHS), help="comma separated paths to run")
+    parser.add_argument("--accounts", type=int, default=2000)
+    parser.add_argument("--mean-follows", type=int, default=50)
+    parser.add_argument("--root-follows", type=int, default=200)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE passed to every crawler")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(args.accounts, args.mean_follows, args.skew,
+                           root_follows=args.root_follows, seed=args.seed)
+    server = MockXrpcServer(graph, latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving {graph.accounts} accounts and {graph.num_edges} follows on {server.url}")
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    results = []
+    for name in args.paths.split(","):
+        workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+        logger.info(f"Running {name} in {workdir}")
+        try:
+            results.append(run_path(name, server, workdir, extra_env))
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        logger.info(json.dumps(results[-1]))
+
+    server.shutdown()
+    server.server_close()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    # A path that crashed or stored nothing has no meaningful numbers
+    failed = [result["path"] for result in results if result["exit_code"] != 0 or not result["rows_stored"]]
+    if failed:
+        logger.error(f"{', '.join(failed)} exited non-zero or stored no rows")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
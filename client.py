@@ -1,7 +1,19 @@
-from atproto import Client, models
+import aiohttp
+import asyncio
+import json
 import logging
+import os
+import re
+import time
+import pyarrow as pa
+import requests
 from datetime import datetime
-from typing import Iterator, Dict, Any, Optional
+from typing import AsyncIterator, Iterator, Dict, Any, List, Optional, Tuple
+
+from metrics import Metrics
+from page_cache import PageCache, open_cache
+from pond import columns_from_json, columns_from_views, to_batch
+from rate_limit import PAGE_TIMEOUT, RETRYABLE_STATUSES, RateLimiter, read_page
 
 # Configure logging - silence all HTTP-related logs
 for logger_name in ['atproto', 'urllib3', 'requests', 'httpx', 'httpcore']:
@@ -10,93 +22,379 @@ for logger_name in ['atproto', 'urllib3', 'requests', 'httpx', 'httpcore']:
 
 logger = logging.getLogger(__name__)
 
+# Service the XRPC calls go to; point it at mock_xrpc.py to crawl without the network
+API_URL = os.getenv("bsky_api_url", "https://api.bsky.app").rstrip("/")
+# Call the XRPC endpoints directly instead of through the atproto SDK's pydantic models
+RAW_JSON = os.getenv("bsky_raw_json", "true").lower() in ("1", "true", "yes")
+
+# The atproto SDK namespace and method of each endpoint, used when RAW_JSON is off
+SDK_METHODS = {
+    "app.bsky.graph.getFollows": ("graph", "get_follows"),
+    "app.bsky.graph.getFollowers": ("graph", "get_followers"),
+    "app.bsky.actor.getProfiles": ("actor", "get_profiles"),
+}
+
+_CAMEL_CASE = re.compile(r'(?<!^)(?=[A-Z])')
+
+def _snake_case_keys(value: Any) -> Any:
+    """Convert camelCase JSON keys to the snake_case names model_dump() produces"""
+    if isinstance(value, dict):
+        return {_CAMEL_CASE.sub('_', key).lower(): _snake_case_keys(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_snake_case_keys(item) for item in value]
+    return value
+
+class XrpcError(Exception):
+    """An XRPC request that failed for good, after any retries"""
+
+    def __init__(self, status: Optional[int], message: str):
+        super().__init__(f"HTTP {status}: {message}" if status else message)
+        self.status = status
+
 class BlueskyClient:
-    def __init__(self):
+    """Synchronous client for the graph endpoints, shared by every worker process
+
+    In raw mode, the default, pages are plain XRPC GETs on a keep-alive
+    session: one json.loads per page and only the needed fields are read,
+    with no pydantic models. The atproto SDK is then never imported, which
+    keeps worker startup fast. Otherwise pages go through the SDK.
+    """
+
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None, max_retries: int = 8, base_url: str = API_URL,
+                 cache: Optional[PageCache] = None, raw: bool = RAW_JSON):
         # Use the public API endpoint
-        self.client = Client(base_url="https://api.bsky.app")
-    
-    def get_followers(self, actor: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
-        """Get all followers for an actor using pagination"""
-        cursor = None
+        self.base_url = base_url
+        self.raw = raw
+        self._client = None
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        # Share one limiter between all workers so they back off together
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        # With a cache, SDK pages are handled as their JSON instead of atproto models so they can be stored
+        self.cache = cache
+        # Set by the crawlers to record request latencies and outcomes
+        self.metrics: Optional[Metrics] = None
+
+    @property
+    def client(self):
+        """The atproto SDK client, imported on first use"""
+        if self._client is None:
+            from atproto import Client
+            self._client = Client(base_url=self.base_url)
+        return self._client
+
+    @property
+    def json_items(self) -> bool:
+        """Whether pages hold profile JSON rather than atproto models"""
+        return self.raw or self.cache is not None
+
+    def _get_session(self) -> requests.Session:
+        # The client is created before the workers fork, and pooled connections must not be shared
+        if self._session is None or self._session_pid != os.getpid():
+            self._session = requests.Session()
+            self._session_pid = os.getpid()
+        return self._session
+
+    def _call(self, endpoint: str, params: Dict[str, Any]):
+        if self.raw:
+            start_time = time.monotonic()
+            response = self._get_session().get(f"{self.base_url}/xrpc/{endpoint}", params=params,
+                                               timeout=PAGE_TIMEOUT, stream=True)
+            read_page(response, start_time + PAGE_TIMEOUT)
+            # HTTPError carries the response, like the SDK's request errors
+            response.raise_for_status()
+            return response
+        namespace, name = SDK_METHODS[endpoint]
+        return getattr(getattr(self.client.app.bsky, namespace), name)(params)
+
+    def _request(self, endpoint: str, params: Dict[str, Any]):
+        """Make one rate limited API call, retrying throttled and failed requests"""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            start_time = time.monotonic()
+            try:
+                response = self._call(endpoint, params)
+            except Exception as e:
+                # Request errors carry the HTTP response, network errors do not
+                error_response = getattr(e, 'response', None)
+                status = getattr(error_response, 'status_code', None)
+                self.rate_limiter.release(status, getattr(error_response, 'headers', None))
+                if self.metrics:
+                    self.metrics.observe_request(endpoint, time.monotonic() - start_time, status)
+                if (status is not None and status not in RETRYABLE_STATUSES) or attempt == self.max_retries:
+                    raise
+                if self.metrics:
+                    self.metrics.increment("retries")
+                logger.debug(f"Retrying {params.get('actor', 'request')} after {status or 'network error'}: {str(e)}")
+                if status != 429:
+                    # 429s already hold everyone back for the Retry-After period
+                    time.sleep(min(30.0, 0.5 * 2 ** attempt))
+                continue
+            self.rate_limiter.release(200)
+            if self.metrics:
+                self.metrics.observe_request(endpoint, time.monotonic() - start_time, 200)
+            return response
+
+    def _pages(self, endpoint: str, key: str, actor: str, limit: int, cursor: Optional[str] = None) -> Iterator[Tuple[List[Any], Optional[str]]]:
+        """Yield (profile views, next_cursor) for each page of a graph endpoint, starting at cursor
+
+        The profile views are JSON dicts if json_items is set, and are served
+        from the cache when it holds the page.
+        """
         total_fetched = 0
-        
+
         while True:
+            # Build params dict for the API call
+            params = {
+                "actor": actor,
+                "limit": limit
+            }
+            if cursor:
+                params["cursor"] = cursor
+
+            if self.cache:
+                cached = self.cache.get(endpoint, actor, cursor, limit)
+                if cached is not None:
+                    if self.metrics:
+                        self.metrics.increment("cache_hits")
+                    data = json.loads(cached)
+                    items, cursor = data.get(key, []), data.get("cursor")
+                    total_fetched += len(items)
+                    yield items, cursor
+                    if not cursor:
+                        break
+                    continue
+
             try:
-                # Build params dict for the API call
-                params = {
-                    "actor": actor,
-                    "limit": limit
-                }
-                if cursor:
-                    params["cursor"] = cursor
-                
-                # Use the official client to get followers
-                response = self.client.app.bsky.graph.get_followers(params)
-                
-                followers = response.followers
-                total_fetched += len(followers)
-                logger.debug(f"Fetched {len(followers)} followers for {actor} (total: {total_fetched})")
-                
-                for follower in followers:
-                    # Just add actor and timestamp to raw record
-                    record = follower.model_dump()
-                    record["actor"] = actor
-                    record["indexed_at"] = datetime.utcnow().isoformat()
-                    yield record
-                
-                # Get cursor for next page
-                cursor = response.cursor
-                if not cursor:
-                    logger.debug(f"No more followers to fetch for {actor}")
-                    break
-                    
+                response = self._request(endpoint, params)
             except Exception as e:
-                logger.error(f"Error getting followers for {actor}: {str(e)}")
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if cursor or status is None or status in RETRYABLE_STATUSES:
+                    # Never hand back a silently truncated list
+                    raise
+                # Unknown, deleted or suspended actors have nothing to fetch
+                logger.error(f"Error getting {key} for {actor}: {str(e)}")
                 break
-    
+
+            if self.raw:
+                if self.cache:
+                    self.cache.put(endpoint, actor, cursor, limit, response.content)
+                data = response.json()
+                items, next_cursor = data.get(key, []), data.get("cursor")
+            else:
+                items, next_cursor = getattr(response, key), response.cursor
+                if self.cache:
+                    # The wire format, as raw mode, the async client and follows_dlt.py cache it
+                    items = [item.model_dump(mode="json", by_alias=True, exclude_none=True) for item in items]
+                    self.cache.put(endpoint, actor, cursor, limit, json.dumps({key: items, "cursor": next_cursor}).encode())
+            total_fetched += len(items)
+            logger.debug(f"Fetched {len(items)} {key} for {actor} (total: {total_fetched})")
+
+            # Get cursor for next page
+            cursor = next_cursor
+            yield items, cursor
+            if not cursor:
+                logger.debug(f"No more {key} to fetch for {actor}")
+                break
+
+    def _paginate(self, endpoint: str, key: str, actor: str, limit: int) -> Iterator[Dict[str, Any]]:
+        """Yield every record of a paginated graph endpoint for an actor"""
+        for items, _ in self._pages(endpoint, key, actor, limit):
+            for item in items:
+                # Just add actor and timestamp to raw record
+                record = _snake_case_keys(item) if self.json_items else item.model_dump()
+                record["actor"] = actor
+                record["indexed_at"] = datetime.utcnow().isoformat()
+                yield record
+
+    def _batches(self, endpoint: str, key: str, actor: str, limit: int, cursor: Optional[str]) -> Iterator[Tuple[pa.RecordBatch, Optional[str]]]:
+        """Yield (record batch, next_cursor) pages projected straight into the pond schema"""
+        columns_from = columns_from_json if self.json_items else columns_from_views
+        for items, cursor in self._pages(endpoint, key, actor, limit, cursor):
+            yield to_batch(columns_from(items, actor, datetime.utcnow().isoformat())), cursor
+
+    def get_followers(self, actor: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
+        """Get all followers for an actor using pagination"""
+        return self._paginate("app.bsky.graph.getFollowers", "followers", actor, limit)
+
     def get_follows(self, actor: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
         """Get all accounts that an actor follows using pagination"""
-        cursor = None
+        return self._paginate("app.bsky.graph.getFollows", "follows", actor, limit)
+
+    def get_followers_batches(self, actor: str, cursor: Optional[str] = None, limit: int = 100):
+        """Get pages of followers as record batches, resuming from cursor if given"""
+        return self._batches("app.bsky.graph.getFollowers", "followers", actor, limit, cursor)
+
+    def get_follows_batches(self, actor: str, cursor: Optional[str] = None, limit: int = 100):
+        """Get pages of follows as record batches, resuming from cursor if given"""
+        return self._batches("app.bsky.graph.getFollows", "follows", actor, limit, cursor)
+
+    def get_profiles(self, actors: List[str], batch_size: int = 25) -> Iterator[Dict[str, Any]]:
+        """Get detailed profiles, including follower and follow counts, 25 actors per request"""
+        for start in range(0, len(actors), batch_size):
+            params = {"actors": actors[start:start + batch_size]}
+            response = self._request("app.bsky.actor.getProfiles", params)
+            if not self.raw:
+                for profile in response.profiles:
+                    yield profile.model_dump()
+                continue
+            for profile in response.json().get("profiles", []):
+                profile = _snake_case_keys(profile)
+                # model_dump() always has the counts, the JSON leaves out unknown ones
+                profile.setdefault("followers_count", 0)
+                profile.setdefault("follows_count", 0)
+                yield profile
+
+    def close(self):
+        """Close the session"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+class AsyncBlueskyClient:
+    """Asyncio client that shares one keep-alive HTTP session between all requests"""
+
+    def __init__(self, max_in_flight: int = 50, base_url: str = API_URL + "/xrpc/",
+                 rate_limiter: Optional[RateLimiter] = None, max_retries: int = 8,
+                 cache: Optional[PageCache] = None):
+        self.base_url = base_url
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        # Caps the number of requests on the wire, however many actors are being crawled
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.rate_limiter = rate_limiter or RateLimiter(max_concurrency=max_in_flight)
+        self.max_retries = max_retries
+        self.metrics: Optional[Metrics] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=PAGE_TIMEOUT),
+            )
+        return self._session
+
+    async def _request(self, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Make one rate limited API call, retrying throttled and failed requests"""
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            async with self._in_flight:
+                await self.rate_limiter.acquire_async()
+                status, headers = None, None
+                start_time = time.monotonic()
+                try:
+                    async with session.get(self.base_url + endpoint, params=params) as response:
+                        status, headers = response.status, response.headers
+                        if status < 400:
+                            return await response.json()
+                        body = await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    body = str(e)
+                finally:
+                    self.rate_limiter.release(status, headers)
+                    if self.metrics:
+                        self.metrics.observe_request(endpoint, time.monotonic() - start_time, status)
+
+            if (status is not None and status not in RETRYABLE_STATUSES) or attempt == self.max_retries:
+                raise XrpcError(status, body)
+            if self.metrics:
+                self.metrics.increment("retries")
+            logger.debug(f"Retrying {params['actor']} after {status or 'network error'}: {body}")
+            if status != 429:
+                # 429s already hold everyone back for the Retry-After period
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** attempt))
+
+    async def _pages(self, endpoint: str, key: str, actor: str, limit: int, cursor: Optional[str] = None) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """Yield (profile JSON, next_cursor) for each page of a graph endpoint, starting at cursor"""
         total_fetched = 0
-        
+
         while True:
-            try:
-                # Build params dict for the API call
-                params = {
-                    "actor": actor,
-                    "limit": limit
-                }
-                if cursor:
-                    params["cursor"] = cursor
-                
-                # Use the official client to get follows
-                response = self.client.app.bsky.graph.get_follows(params)
-                
-                follows = response.follows
-                total_fetched += len(follows)
-                logger.debug(f"Fetched {len(follows)} follows for {actor} (total: {total_fetched})")
-                
-                for follow in follows:
-                    # Just add actor and timestamp to raw record
-                    record = follow.model_dump()
-                    record["actor"] = actor
-                    record["indexed_at"] = datetime.utcnow().isoformat()
-                    yield record
-                
-                # Get cursor for next page
-                cursor = response.cursor
+            params = {
+                "actor": actor,
+                "limit": limit
+            }
+            if cursor:
+                params["cursor"] = cursor
+
+            cached = self.cache.get(endpoint, actor, cursor, limit) if self.cache else None
+            if cached is not None:
+                if self.metrics:
+                    self.metrics.increment("cache_hits")
+                data = json.loads(cached)
+                items, cursor = data.get(key, []), data.get("cursor")
+                total_fetched += len(items)
+                yield items, cursor
                 if not cursor:
-                    logger.debug(f"No more follows to fetch for {actor}")
                     break
-                    
-            except Exception as e:
-                logger.error(f"Error getting follows for {actor}: {str(e)}")
+                continue
+
+            try:
+                data = await self._request(endpoint, params)
+            except XrpcError as e:
+                if cursor or e.status is None or e.status in RETRYABLE_STATUSES:
+                    # Never hand back a silently truncated list
+                    raise
+                # Unknown, deleted or suspended actors have nothing to fetch
+                logger.error(f"Error getting {key} for {actor}: {str(e)}")
                 break
 
-    def close(self):
-        """Close the session"""
-        pass  # No need to close the session as atproto client does not have a session
+            if self.cache:
+                self.cache.put(endpoint, actor, cursor, limit, json.dumps(data).encode())
+            items = data.get(key, [])
+            total_fetched += len(items)
+            logger.debug(f"Fetched {len(items)} {key} for {actor} (total: {total_fetched})")
+
+            cursor = data.get("cursor")
+            yield items, cursor
+            if not cursor:
+                logger.debug(f"No more {key} to fetch for {actor}")
+                break
+
+    async def _paginate(self, endpoint: str, key: str, actor: str, limit: int) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every record of a paginated graph endpoint for an actor"""
+        async for items, _ in self._pages(endpoint, key, actor, limit):
+            indexed_at = datetime.utcnow().isoformat()
+            for item in items:
+                # Match the record shape of the synchronous client
+                record = _snake_case_keys(item)
+                record["actor"] = actor
+                record["indexed_at"] = indexed_at
+                yield record
+
+    async def _batches(self, endpoint: str, key: str, actor: str, limit: int, cursor: Optional[str]) -> AsyncIterator[Tuple[pa.RecordBatch, Optional[str]]]:
+        """Yield (record batch, next_cursor) pages projected straight into the pond schema"""
+        async for items, cursor in self._pages(endpoint, key, actor, limit, cursor):
+            yield to_batch(columns_from_json(items, actor, datetime.utcnow().isoformat())), cursor
+
+    def get_followers(self, actor: str, limit: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Get all followers for an actor using pagination"""
+        return self._paginate("app.bsky.graph.getFollowers", "followers", actor, limit)
+
+    def get_follows(self, actor: str, limit: int = 100) -> AsyncIterator[Dict[str, Any]]:
+        """Get all accounts that an actor follows using pagination"""
+        return self._paginate("app.bsky.graph.getFollows", "follows", actor, limit)
+
+    def get_followers_batches(self, actor: str, cursor: Optional[str] = None, limit: int = 100):
+        """Get pages of followers as record batches, resuming from cursor if given"""
+        return self._batches("app.bsky.graph.getFollowers", "followers", actor, limit, cursor)
+
+    def get_follows_batches(self, actor: str, cursor: Optional[str] = None, limit: int = 100):
+        """Get pages of follows as record batches, resuming from cursor if given"""
+        return self._batches("app.bsky.graph.getFollows", "follows", actor, limit, cursor)
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+def create_client(rate_limiter: Optional[RateLimiter] = None) -> BlueskyClient:
+    """Create a new Bluesky client instance, caching pages if bsky_page_cache is set"""
+    return BlueskyClient(rate_limiter=rate_limiter, cache=open_cache())
 
-def create_client() -> BlueskyClient:
-    """Create a new Bluesky client instance"""
-    return BlueskyClient()
+def create_async_client(max_in_flight: int = 50, rate_limiter: Optional[RateLimiter] = None) -> AsyncBlueskyClient:
+    """Create a new asyncio Bluesky client instance, caching pages if bsky_page_cache is set"""
+    return AsyncBlueskyClient(max_in_flight=max_in_flight, rate_limiter=rate_limiter, cache=open_cache())
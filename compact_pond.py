@@ -0,0 +1,69 @@
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import duckdb
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+POND = "pond"
+SIDES = ("follows", "followers")
+
+def compact_side(con, side):
+    """Rewrite one side of the pond into large sorted files holding each actor's latest snapshot"""
+    source = os.path.join(POND, side)
+    if not os.path.isdir(source):
+        logger.info(f"Nothing to compact in {source}")
+        return
+    target = source + ".compacting"
+    previous = source + ".previous"
+    shutil.rmtree(target, ignore_errors=True)
+
+    before = con.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT filename) FROM read_parquet('{source}/*/*/*.parquet', hive_partitioning = true, filename = true)"
+    ).fetchone()
+
+    # An actor's rows from older crawl runs are superseded by its latest run; within that
+    # run pages refetched after a crash can appear twice, so keep one row per follow
+    con.execute(f"""
+        COPY (
+            SELECT * EXCLUDE (filename)
+            FROM read_parquet('{source}/*/*/*.parquet', hive_partitioning = true, filename = true)
+            QUALIFY crawl_run = MAX(crawl_run) OVER (PARTITION BY actor)
+                AND ROW_NUMBER() OVER (PARTITION BY actor, did ORDER BY crawl_run DESC, indexed_at DESC, filename DESC) = 1
+            ORDER BY crawl_date, actor_bucket, actor
+        ) TO '{target}' (
+            FORMAT PARQUET,
+            PARTITION_BY (crawl_date, actor_bucket),
+            FILENAME_PATTERN 'compacted-{datetime.utcnow():%Y%m%dT%H%M%S}-{{i}}',
+            ROW_GROUP_SIZE 122880
+        )
+    """)
+
+    after = con.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT filename) FROM read_parquet('{target}/*/*/*.parquet', hive_partitioning = true, filename = true)"
+    ).fetchone()
+
+    # Swap the compacted copy in, keeping the original until the swap has succeeded
+    shutil.rmtree(previous, ignore_errors=True)
+    os.rename(source, previous)
+    os.rename(target, source)
+    shutil.rmtree(previous)
+    logger.info(f"Compacted {source}: {before[0]} rows in {before[1]} files -> {after[0]} rows in {after[1]} files")
+
+def main():
+    """Compact the pond; run it while no crawl is writing to pond/"""
+    sides = sys.argv[1:] or SIDES
+    con = duckdb.connect()
+    for side in sides:
+        compact_side(con, side)
+    con.close()
+
+if __name__ == '__main__':
+    main()
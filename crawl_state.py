@@ -0,0 +1,293 @@
+import functools
+import logging
+import math
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lives next to bluesky.duckdb, but in SQLite so it never contends with the dlt pipeline's lock
+DEFAULT_PATH = "crawl_state.sqlite"
+
+SIDES = ("follows", "followers")
+# Records per getFollows/getFollowers page
+PAGE_SIZE = 100
+
+def locked(method):
+    """Hold the state's lock while a method uses its connection"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class CrawlState:
+    """Durable record of a crawl's frontier and per-actor pagination cursors
+
+    A run is identified by the crawler and its root actor. Until finish_run()
+    is called, starting the same crawler for the same root resumes that run:
+    the frontier is read back instead of refetched, finished actors are
+    skipped and unfinished ones restart from their last checkpointed cursor.
+
+    Checkpoints must only be written once the data up to that cursor is
+    durably stored, so a crash refetches at most the pages after it.
+
+    The async crawler writes checkpoints from its writer thread, so the
+    connection may be used from any thread, one call at a time.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.con = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.executescript("""
+            CREATE TABLE IF NOT EXISTS crawl_runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                crawler TEXT NOT NULL,
+                root TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS crawl_frontier (
+                run_id INTEGER NOT NULL,
+                actor TEXT NOT NULL,
+                side TEXT NOT NULL,
+                cursor TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                max_pages INTEGER,
+                did TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (run_id, actor, side)
+            );
+            CREATE TABLE IF NOT EXISTS crawl_profiles (
+                run_id INTEGER NOT NULL,
+                actor TEXT NOT NULL,
+                did TEXT,
+                followers_count INTEGER,
+                follows_count INTEGER,
+                PRIMARY KEY (run_id, actor)
+            );
+            CREATE TABLE IF NOT EXISTS actor_snapshots (
+                crawler TEXT NOT NULL,
+                did TEXT NOT NULL,
+                followers_count INTEGER,
+                follows_count INTEGER,
+                crawled_at TEXT NOT NULL,
+                PRIMARY KEY (crawler, did)
+            );
+        """)
+        # Snapshots used to be keyed by handle alone, without the crawler whose destination holds the lists,
+        # so they can't tell which crawler's lists are current; dropping them recrawls everyone once
+        if self.con.execute("SELECT 1 FROM sqlite_master WHERE name = 'profile_snapshots'").fetchone():
+            logger.info("Dropping handle-keyed profile snapshots, the next incremental crawl recrawls every actor")
+            with self.con:
+                self.con.execute("DROP TABLE profile_snapshots")
+        # Frontiers written before page limits and DIDs were kept lack those columns
+        columns = [row[1] for row in self.con.execute("PRAGMA table_info(crawl_frontier)")]
+        for column, type_ in (("max_pages", "INTEGER"), ("did", "TEXT")):
+            if column not in columns:
+                with self.con:
+                    self.con.execute(f"ALTER TABLE crawl_frontier ADD COLUMN {column} {type_}")
+        self.run_id: Optional[int] = None
+        self.crawler: Optional[str] = None
+
+    @locked
+    def start_run(self, crawler: str, root: str) -> bool:
+        """Resume the unfinished run for this crawler and root, or start a new one
+
+        Returns True when an earlier run is being resumed.
+        """
+        row = self.con.execute(
+            "SELECT run_id FROM crawl_runs WHERE crawler = ? AND root = ? AND finished_at IS NULL "
+            "ORDER BY run_id DESC LIMIT 1",
+            (crawler, root),
+        ).fetchone()
+        self.crawler = crawler
+        if row:
+            self.run_id = row[0]
+            logger.info(f"Resuming crawl run {self.run_id} for {root}")
+            return True
+
+        with self.con:
+            cursor = self.con.execute(
+                "INSERT INTO crawl_runs (crawler, root, started_at) VALUES (?, ?, ?)",
+                (crawler, root, datetime.utcnow().isoformat()),
+            )
+        self.run_id = cursor.lastrowid
+        logger.info(f"Started crawl run {self.run_id} for {root}")
+        return False
+
+    @locked
+    def resumable(self, crawler: str, root: str) -> bool:
+        """Whether start_run() would resume an unfinished run"""
+        row = self.con.execute(
+            "SELECT 1 FROM crawl_runs WHERE crawler = ? AND root = ? AND finished_at IS NULL",
+            (crawler, root),
+        ).fetchone()
+        return row is not None
+
+    @locked
+    def add_actors(self, actors: Iterable[str], sides: Tuple[str, ...] = SIDES,
+                   max_pages: Optional[Dict[str, int]] = None, dids: Optional[Dict[str, str]] = None):
+        """Persist the frontier for the current run
+
+        Only the given sides are fetched for these actors, and an actor in
+        max_pages stops after that many pages of each side. DIDs not given
+        here are taken from the run's recorded profiles.
+        """
+        now = datetime.utcnow().isoformat()
+        max_pages = max_pages or {}
+        dids = dids or {}
+        with self.con:
+            self.con.executemany(
+                "INSERT OR IGNORE INTO crawl_frontier (run_id, actor, side, max_pages, did, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((self.run_id, actor, side, max_pages.get(actor), dids.get(actor), now) for actor in actors for side in sides),
+            )
+
+    @locked
+    def pending_actors(self) -> List[Tuple[str, Dict[str, Tuple[Optional[str], bool]], Optional[int]]]:
+        """Actors with a side still to fetch, with the (cursor, done) to resume each side from and their page limit
+
+        Actors come largest first, by the pages their unfinished sides are
+        expected to take, so the few huge accounts start right away instead of
+        becoming the tail of the crawl (longest processing time first).
+        Without recorded counts a side is assumed to take its page limit, or
+        a single page.
+        """
+        rows = self.con.execute(
+            "SELECT f.actor, f.side, f.cursor, f.done, f.max_pages, p.followers_count, p.follows_count "
+            "FROM crawl_frontier f LEFT JOIN crawl_profiles p ON p.run_id = f.run_id AND p.actor = f.actor "
+            "WHERE f.run_id = ? AND f.actor IN ("
+            "  SELECT actor FROM crawl_frontier WHERE run_id = ? AND done = 0"
+            ") ORDER BY f.actor",
+            (self.run_id, self.run_id),
+        ).fetchall()
+        pending: Dict[str, Dict[str, Tuple[Optional[str], bool]]] = {}
+        limits: Dict[str, Optional[int]] = {}
+        costs: Dict[str, int] = {}
+        for actor, side, cursor, done, max_pages, followers_count, follows_count in rows:
+            pending.setdefault(actor, {})[side] = (cursor, bool(done))
+            limits[actor] = max_pages
+            count = followers_count if side == "followers" else follows_count
+            pages = max(1, math.ceil(count / PAGE_SIZE)) if count is not None else (max_pages or 1)
+            if max_pages:
+                pages = min(pages, max_pages)
+            costs[actor] = costs.get(actor, 0) + (0 if done else pages)
+        order = sorted(pending, key=lambda actor: -costs[actor])
+        return [(actor, pending[actor], limits[actor]) for actor in order]
+
+    @locked
+    def actor_dids(self) -> Dict[str, str]:
+        """handle -> DID of every actor in the current run whose DID is known"""
+        rows = self.con.execute(
+            "SELECT DISTINCT f.actor, COALESCE(f.did, p.did) FROM crawl_frontier f "
+            "LEFT JOIN crawl_profiles p ON p.run_id = f.run_id AND p.actor = f.actor "
+            "WHERE f.run_id = ? AND COALESCE(f.did, p.did) IS NOT NULL",
+            (self.run_id,),
+        )
+        return dict(rows)
+
+    @locked
+    def run_profiles(self) -> Dict[str, Tuple[Optional[str], int, int]]:
+        """(did, followers_count, follows_count) recorded for the actors of the current run"""
+        rows = self.con.execute(
+            "SELECT actor, did, followers_count, follows_count FROM crawl_profiles WHERE run_id = ?",
+            (self.run_id,),
+        )
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    @locked
+    def checkpoint(self, checkpoints: Iterable[Tuple[str, str, Optional[str], bool]]):
+        """Record (actor, side, cursor, done) once the pages before cursor are stored"""
+        checkpoints = list(checkpoints)
+        now = datetime.utcnow().isoformat()
+        with self.con:
+            self.con.executemany(
+                "UPDATE crawl_frontier SET cursor = ?, done = ?, updated_at = ? "
+                "WHERE run_id = ? AND actor = ? AND side = ?",
+                ((cursor, int(done), now, self.run_id, actor, side) for actor, side, cursor, done in checkpoints),
+            )
+            # Actors with every side stored now have a snapshot this crawler's next run can compare against
+            self.con.executemany(
+                "INSERT OR REPLACE INTO actor_snapshots (crawler, did, followers_count, follows_count, crawled_at) "
+                "SELECT ?, did, followers_count, follows_count, ? FROM crawl_profiles "
+                "WHERE run_id = ? AND actor = ? AND did IS NOT NULL AND NOT EXISTS ("
+                "  SELECT 1 FROM crawl_frontier f WHERE f.run_id = ? AND f.actor = ? AND f.done = 0"
+                ")",
+                ((self.crawler, now, self.run_id, actor, self.run_id, actor)
+                 for actor in {c[0] for c in checkpoints if c[3]}),
+            )
+
+    @locked
+    def record_profiles(self, profiles: Dict[str, Tuple[Optional[str], int, int]]):
+        """Keep actors' current (did, followers_count, follows_count) with the run
+
+        The counts size each actor's crawl in pending_actors() and become the
+        actor's snapshot once both of its sides have been stored.
+        """
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO crawl_profiles (run_id, actor, did, followers_count, follows_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((self.run_id, actor, *counts) for actor, counts in profiles.items()),
+            )
+
+    @locked
+    def select_changed(self, profiles: Dict[str, Tuple[Optional[str], int, int]], ttl_hours: float) -> List[str]:
+        """Actors to recrawl given their current (did, followers_count, follows_count)
+
+        An actor is recrawled when it has no snapshot, when either count differs
+        from its snapshot or when the snapshot is older than ttl_hours.
+        Snapshots are looked up by DID, so a renamed actor keeps its snapshot,
+        and only those stored by the current run's crawler count: another
+        crawler's snapshot says nothing about what this one's destination holds.
+        """
+        cutoff = (datetime.utcnow() - timedelta(hours=ttl_hours)).isoformat()
+        snapshots = {
+            row[0]: row[1:]
+            for row in self.con.execute(
+                "SELECT did, followers_count, follows_count, crawled_at FROM actor_snapshots WHERE crawler = ?",
+                (self.crawler,),
+            )
+        }
+
+        changed = []
+        for actor, (did, followers_count, follows_count) in profiles.items():
+            snapshot = snapshots.get(did)
+            if (
+                snapshot is None
+                or snapshot[0] != followers_count
+                or snapshot[1] != follows_count
+                or snapshot[2] < cutoff
+            ):
+                changed.append(actor)
+
+        logger.info(f"{len(changed)} of {len(profiles)} actors changed or are due a recrawl")
+        return changed
+
+    @locked
+    def remaining(self) -> int:
+        """Number of actors in the current run that are not finished"""
+        row = self.con.execute(
+            "SELECT COUNT(DISTINCT actor) FROM crawl_frontier WHERE run_id = ? AND done = 0",
+            (self.run_id,),
+        ).fetchone()
+        return row[0]
+
+    @locked
+    def finish_run(self):
+        """Close the current run so the next start begins a fresh crawl"""
+        with self.con:
+            self.con.execute(
+                "UPDATE crawl_runs SET finished_at = ? WHERE run_id = ?",
+                (datetime.utcnow().isoformat(), self.run_id),
+            )
+        logger.info(f"Finished crawl run {self.run_id}")
+
+    @locked
+    def close(self):
+        self.con.close()
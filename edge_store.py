@@ -0,0 +1,398 @@
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+# Database holding the graph schema; leave bsky_edge_store empty to not write edges
+EDGE_STORE_PATH = os.getenv("bsky_edge_store", "bluesky.duckdb")
+
+SETUP_SQL = """
+CREATE SCHEMA IF NOT EXISTS graph;
+CREATE TABLE IF NOT EXISTS graph.edges (
+    src_did VARCHAR NOT NULL,
+    dst_did VARCHAR NOT NULL,
+    first_seen TIMESTAMP NOT NULL,
+    last_seen TIMESTAMP NOT NULL,
+    PRIMARY KEY (src_did, dst_did)
+);
+CREATE TABLE IF NOT EXISTS graph.profiles (
+    did VARCHAR PRIMARY KEY,
+    handle VARCHAR,
+    display_name VARCHAR,
+    avatar VARCHAR,
+    description VARCHAR,
+    created_at TIMESTAMPTZ,
+    associated__chat__allow_incoming VARCHAR,
+    associated__labeler BOOLEAN,
+    last_seen TIMESTAMP NOT NULL
+);
+-- When each actor's follows or followers list was last fetched in full
+CREATE TABLE IF NOT EXISTS graph.side_crawls (
+    did VARCHAR NOT NULL,
+    side VARCHAR NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (did, side)
+);
+-- Each actor's list as of its last snapshot, and a hash of its sorted DIDs
+CREATE TABLE IF NOT EXISTS graph.snapshots (
+    actor VARCHAR NOT NULL,
+    side VARCHAR NOT NULL,
+    did_hash VARCHAR NOT NULL,
+    members BIGINT NOT NULL,
+    taken_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (actor, side)
+);
+CREATE TABLE IF NOT EXISTS graph.snapshot_members (
+    actor VARCHAR NOT NULL,
+    side VARCHAR NOT NULL,
+    did VARCHAR NOT NULL,
+    handle VARCHAR,
+    PRIMARY KEY (actor, side, did)
+);
+-- Pages of lists that are still being fetched, kept until the whole list can be diffed
+CREATE TABLE IF NOT EXISTS graph.snapshot_staging (
+    run_id BIGINT NOT NULL,
+    actor VARCHAR NOT NULL,
+    side VARCHAR NOT NULL,
+    did VARCHAR NOT NULL,
+    handle VARCHAR,
+    display_name VARCHAR,
+    avatar VARCHAR,
+    description VARCHAR,
+    created_at TIMESTAMPTZ,
+    indexed_at TIMESTAMPTZ,
+    associated__chat__allow_incoming VARCHAR,
+    associated__labeler BOOLEAN,
+    PRIMARY KEY (actor, side, did)
+);
+"""
+
+# A follows row is actor -> did, a followers row did -> actor
+EDGES_SQL = """
+INSERT INTO graph.edges
+SELECT DISTINCT {src}, {dst}, $seen_at, $seen_at
+FROM edge_batch AS b
+INNER JOIN crawl_actors AS a ON a.actor = b.actor
+WHERE b.did IS NOT NULL
+ON CONFLICT (src_did, dst_did) DO UPDATE SET last_seen = excluded.last_seen
+"""
+
+PROFILES_SQL = """
+INSERT INTO graph.profiles
+SELECT
+    did,
+    ANY_VALUE(handle),
+    ANY_VALUE(display_name),
+    ANY_VALUE(avatar),
+    ANY_VALUE(description),
+    ANY_VALUE(TRY_CAST(created_at AS TIMESTAMPTZ)),
+    ANY_VALUE(associated__chat__allow_incoming),
+    ANY_VALUE(associated__labeler),
+    $seen_at
+FROM edge_batch
+WHERE did IS NOT NULL
+GROUP BY did
+ON CONFLICT (did) DO UPDATE SET
+    handle = excluded.handle,
+    display_name = excluded.display_name,
+    avatar = excluded.avatar,
+    description = excluded.description,
+    created_at = excluded.created_at,
+    associated__chat__allow_incoming = excluded.associated__chat__allow_incoming,
+    associated__labeler = excluded.associated__labeler,
+    last_seen = excluded.last_seen
+"""
+
+# Followers of an actor that were seen in the latest, fresh follows crawl of an account in the crawl set
+COVERED_FOLLOWERS_SQL = """
+SELECT c.actor
+FROM crawl_set AS c
+INNER JOIN (
+    SELECT e.dst_did, COUNT(*) AS fresh_followers
+    FROM graph.edges AS e
+    INNER JOIN graph.side_crawls AS s
+        ON s.did = e.src_did AND s.side = 'follows' AND s.finished_at >= $cutoff AND e.last_seen >= s.started_at
+    WHERE e.src_did IN (SELECT did FROM crawl_set)
+    GROUP BY e.dst_did
+) AS f ON f.dst_did = c.did
+WHERE f.fresh_followers >= c.followers_count
+"""
+
+STAGE_SQL = """
+INSERT OR REPLACE INTO graph.snapshot_staging
+SELECT
+    $run_id,
+    actor,
+    $side,
+    did,
+    handle,
+    display_name,
+    avatar,
+    description,
+    TRY_CAST(created_at AS TIMESTAMPTZ),
+    TRY_CAST(indexed_at AS TIMESTAMPTZ),
+    associated__chat__allow_incoming,
+    associated__labeler
+FROM edge_batch
+WHERE did IS NOT NULL
+QUALIFY ROW_NUMBER() OVER (PARTITION BY actor, did) = 1
+"""
+
+# Hash of each finished list's sorted DIDs next to the previous snapshot's; rows staged by
+# an earlier, abandoned run are ignored
+SNAPSHOT_HASHES_SQL = """
+SELECT
+    d.actor,
+    d.side,
+    d.complete,
+    MD5(COALESCE(STRING_AGG(s.did, ',' ORDER BY s.did), '')) AS did_hash,
+    COUNT(s.did) AS members,
+    ANY_VALUE(p.did_hash) AS previous_hash
+FROM finished_sides AS d
+LEFT JOIN graph.snapshot_staging AS s
+    ON s.actor = d.actor AND s.side = d.side AND s.run_id = $run_id
+LEFT JOIN graph.snapshots AS p
+    ON p.actor = d.actor AND p.side = d.side
+GROUP BY d.actor, d.side, d.complete
+"""
+
+# Only lists whose hash changed are compared member by member. Nothing is removed from a list
+# that was cut short, since its missing members may just not have been fetched.
+CHANGES_SQL = """
+SELECT s.* EXCLUDE (run_id, side), 'added' AS change_type
+FROM graph.snapshot_staging AS s
+INNER JOIN changed_sides AS c ON c.actor = s.actor AND c.side = s.side
+WHERE s.side = $side AND s.run_id = $run_id
+  AND NOT EXISTS (
+    SELECT 1 FROM graph.snapshot_members AS m
+    WHERE m.actor = s.actor AND m.side = s.side AND m.did = s.did
+  )
+UNION ALL BY NAME
+SELECT m.actor, m.did, m.handle, 'removed' AS change_type
+FROM graph.snapshot_members AS m
+INNER JOIN changed_sides AS c ON c.actor = m.actor AND c.side = m.side AND c.complete
+WHERE m.side = $side
+  AND NOT EXISTS (
+    SELECT 1 FROM graph.snapshot_staging AS s
+    WHERE s.actor = m.actor AND s.side = m.side AND s.did = m.did AND s.run_id = $run_id
+  )
+"""
+
+# Run in one transaction, one statement at a time since only a query's last statement takes parameters
+COMMIT_SNAPSHOTS_SQL = (
+    """
+    DELETE FROM graph.snapshot_members AS m
+    USING changed_sides AS c
+    WHERE m.actor = c.actor AND m.side = c.side AND c.complete
+      AND NOT EXISTS (
+        SELECT 1 FROM graph.snapshot_staging AS s
+        WHERE s.actor = m.actor AND s.side = m.side AND s.did = m.did AND s.run_id = $run_id
+      )
+    """,
+    """
+    INSERT OR REPLACE INTO graph.snapshot_members
+    SELECT s.actor, s.side, s.did, s.handle
+    FROM graph.snapshot_staging AS s
+    INNER JOIN changed_sides AS c ON c.actor = s.actor AND c.side = s.side
+    WHERE s.run_id = $run_id
+    """,
+    """
+    INSERT OR REPLACE INTO graph.snapshots
+    SELECT actor, side, did_hash, members, $taken_at FROM snapshot_hashes WHERE complete
+    """,
+    """
+    DELETE FROM graph.snapshot_staging AS s
+    USING snapshot_hashes AS h
+    WHERE s.actor = h.actor AND s.side = h.side
+    """,
+)
+
+def arrow_table(result) -> pa.Table:
+    """A query's result as an Arrow table; .arrow() returns a RecordBatchReader on newer DuckDB and a table before"""
+    table = result.arrow()
+    return table.read_all() if isinstance(table, pa.RecordBatchReader) else table
+
+class EdgeStore:
+    """DID-keyed follow graph in bluesky.duckdb that both crawlers write through
+
+    Every follow is stored once in graph.edges as src_did -> dst_did, whether
+    it was seen in the follower's follows or the followee's followers, with
+    when it was first and last seen. Profile attributes live once per DID in
+    graph.profiles instead of on every row that mentions the account.
+
+    Crawled pages name their actor by handle, so the store is given the
+    handle -> DID mapping of the crawl set; rows of actors without a known
+    DID are skipped.
+    """
+
+    def __init__(self, path: str = EDGE_STORE_PATH, actor_dids: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.actor_dids = actor_dids or {}
+        self.edges_written = 0
+        self._con: Optional[duckdb.DuckDBPyConnection] = None
+        self._side_started: Dict[Tuple[str, str], datetime] = {}
+        self._snapshot_hashes: Optional[Tuple[pa.Table, pa.Table, int]] = None
+
+    def _connection(self) -> duckdb.DuckDBPyConnection:
+        if self._con is None:
+            self._con = duckdb.connect(self.path)
+            self._con.execute(SETUP_SQL)
+            self._con.register("crawl_actors", pa.table({
+                "actor": list(self.actor_dids),
+                "actor_did": list(self.actor_dids.values()),
+            }))
+        return self._con
+
+    def write(self, side: str, table: pa.Table):
+        """Upsert the edges and profiles in a table of pond columns fetched from one side"""
+        if not table.num_rows:
+            return
+        now = datetime.utcnow()
+        for actor_name in set(table.column("actor").to_pylist()):
+            self._side_started.setdefault((actor_name, side), now)
+        src, dst = ("a.actor_did", "b.did") if side == "follows" else ("b.did", "a.actor_did")
+        start_time = time.monotonic()
+        con = self._connection()
+        con.register("edge_batch", table)
+        try:
+            con.execute("BEGIN TRANSACTION")
+            con.execute(EDGES_SQL.format(src=src, dst=dst), {"seen_at": now})
+            con.execute(PROFILES_SQL, {"seen_at": now})
+            con.execute("COMMIT")
+        except duckdb.Error:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.unregister("edge_batch")
+        self.edges_written += table.num_rows
+        logger.debug(f"Wrote {table.num_rows} {side} edges in {time.monotonic() - start_time:.2f}s")
+
+    def finish_side(self, actor_name: str, side: str):
+        """Record that an actor's side has been fetched in full"""
+        did = self.actor_dids.get(actor_name)
+        if did is None:
+            return
+        now = datetime.utcnow()
+        started_at = self._side_started.pop((actor_name, side), now)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO graph.side_crawls VALUES (?, ?, ?, ?)", [did, side, started_at, now]
+        )
+
+    def covered_followers(self, profiles: Dict[str, Tuple[Optional[str], int, int]], fresh_hours: float) -> List[str]:
+        """Actors whose every follower was seen in a fresh follows crawl of another actor in the crawl set
+
+        profiles maps each actor in the crawl set to its (did, followers_count,
+        follows_count). Fetching these actors' followers would only return
+        edges the store already holds.
+        """
+        profiles = {actor: counts for actor, counts in profiles.items() if counts[0]}
+        if not profiles:
+            return []
+        con = self._connection()
+        con.register("crawl_set", pa.table({
+            "actor": list(profiles),
+            "did": [counts[0] for counts in profiles.values()],
+            "followers_count": [counts[1] for counts in profiles.values()],
+        }))
+        try:
+            cutoff = datetime.utcnow() - timedelta(hours=fresh_hours)
+            rows = con.execute(COVERED_FOLLOWERS_SQL, {"cutoff": cutoff}).fetchall()
+        finally:
+            con.unregister("crawl_set")
+        return [row[0] for row in rows]
+
+    def stage(self, side: str, table: pa.Table, run_id: int):
+        """Keep a table of pond columns fetched from one side until its lists can be diffed"""
+        if not table.num_rows:
+            return
+        con = self._connection()
+        con.register("edge_batch", table)
+        try:
+            con.execute(STAGE_SQL, {"run_id": run_id, "side": side})
+        finally:
+            con.unregister("edge_batch")
+
+    def snapshot_changes(self, finished: List[Tuple[str, str, bool]], run_id: int) -> Dict[str, pa.Table]:
+        """Rows added to and removed from each finished (actor, side, complete) list since its last snapshot
+
+        A complete list is compared member by member only if the hash of its
+        sorted DIDs differs from the last snapshot's. A list cut short at a
+        page limit only adds members. Returns a table per side with the
+        staged columns and change_type 'added', or just actor, did and handle
+        with change_type 'removed'. The snapshots only move on with
+        commit_snapshots(), so changes that fail to load are found again.
+        """
+        self._snapshot_hashes = None
+        if not finished:
+            return {}
+        con = self._connection()
+        con.register("finished_sides", pa.table({
+            "actor": [actor_name for actor_name, _, _ in finished],
+            "side": [side for _, side, _ in finished],
+            "complete": [complete for _, _, complete in finished],
+        }))
+        try:
+            hashes = arrow_table(con.execute(SNAPSHOT_HASHES_SQL, {"run_id": run_id}))
+        finally:
+            con.unregister("finished_sides")
+        changed = hashes.filter(pc.or_(
+            pc.invert(hashes.column("complete")),
+            pc.not_equal(hashes.column("did_hash"), pc.fill_null(hashes.column("previous_hash"), "")),
+        ))
+        self._snapshot_hashes = (hashes.drop(["previous_hash"]), changed.select(["actor", "side", "complete"]), run_id)
+        logger.debug(f"{changed.num_rows} of {hashes.num_rows} finished lists changed since their last snapshot")
+        changes = {}
+        con.register("changed_sides", changed.select(["actor", "side", "complete"]))
+        try:
+            for side in set(changed.column("side").to_pylist()):
+                changes[side] = arrow_table(con.execute(CHANGES_SQL, {"side": side, "run_id": run_id}))
+        finally:
+            con.unregister("changed_sides")
+        return changes
+
+    def commit_snapshots(self):
+        """Make the lists diffed by the last snapshot_changes() the snapshots the next crawl is diffed against"""
+        if self._snapshot_hashes is None:
+            return
+        hashes, changed, run_id = self._snapshot_hashes
+        con = self._connection()
+        con.register("snapshot_hashes", hashes)
+        con.register("changed_sides", changed)
+        try:
+            con.execute("BEGIN TRANSACTION")
+            params = {"run_id": run_id, "taken_at": datetime.utcnow()}
+            for sql in COMMIT_SNAPSHOTS_SQL:
+                con.execute(sql, {name: value for name, value in params.items() if f"${name}" in sql})
+            con.execute("COMMIT")
+        except duckdb.Error:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.unregister("snapshot_hashes")
+            con.unregister("changed_sides")
+        self._snapshot_hashes = None
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+def open_edge_store(actor_dids: Dict[str, str]) -> Optional[EdgeStore]:
+    """The edge store configured by bsky_edge_store, or None if it is disabled or locked by another process"""
+    if not EDGE_STORE_PATH:
+        return None
+    store = EdgeStore(EDGE_STORE_PATH, actor_dids)
+    try:
+        store._connection()
+    except duckdb.Error as e:
+        logger.warning(f"Not writing edges, {EDGE_STORE_PATH} could not be opened: {str(e)}")
+        return None
+    return store
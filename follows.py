@@ -1,16 +1,46 @@
+import asyncio
 import logging
 import multiprocessing as mp
+import queue
 from multiprocessing import Queue, Process
 from queue import Empty
 import os
-import pyarrow as pa
-import pyarrow.json as pj
-import pyarrow.parquet as pq
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime
-from client import create_client
+from client import create_async_client, create_client
+from crawl_state import CrawlState
+from edge_store import open_edge_store
+from expand import BloomFilter, plan_expansion, rank_roots
+from graph import FollowGraph
+from metrics import Metrics, MetricsExporter
+from pond import PartitionedPondWriter, actor_bucket, deserialize_batches, serialize_batches
+from rate_limit import RateLimiter
 
 # Configuration
-actor = os.getenv("bsky_actor")
+# Base actors to crawl around, comma separated; bsky_actor still names a single one
+roots = [name.strip() for name in os.getenv("bsky_actors", os.getenv("bsky_actor", "")).split(",") if name.strip()]
+# Runs are keyed by the set of roots, so reordering them still resumes the same crawl
+root_key = ",".join(sorted(roots))
+# "processes" runs a pool of worker processes, "async" crawls from a single event loop
+crawl_mode = os.getenv("bsky_crawl_mode", "processes")
+# Number of requests the async crawler keeps on the wire at once
+max_in_flight = int(os.getenv("bsky_max_in_flight", "50"))
+# Pages per chunk sent to the writer; each chunk ends at a cursor the crawl can resume from
+checkpoint_pages = int(os.getenv("bsky_checkpoint_pages", "20"))
+# Only recrawl actors whose follower/follow counts changed or whose snapshot is older than the TTL
+incremental = os.getenv("bsky_incremental", "false").lower() in ("1", "true", "yes")
+snapshot_ttl_hours = float(os.getenv("bsky_snapshot_ttl_hours", "168"))
+# Requests a second-hop crawl of the best candidates' follows may spend after the first hop; 0 disables it
+expand_budget = int(os.getenv("bsky_expand_budget", "0"))
+# Second-hop actors following more than this many pages of accounts are skipped
+expand_max_pages = int(os.getenv("bsky_expand_max_pages", "20"))
+# Don't fetch the followers of actors whose followers all showed up in fresh follows lists of the crawl set
+skip_covered = os.getenv("bsky_skip_covered", "false").lower() in ("1", "true", "yes")
+edge_fresh_hours = float(os.getenv("bsky_edge_fresh_hours", "48"))
+# Also write every chunk through to the edge store, which takes bluesky.duckdb's write lock for each write
+write_edges = os.getenv("bsky_write_edges", "false").lower() in ("1", "true", "yes")
 
 # Create a global client instance
 client = create_client()
@@ -35,56 +65,140 @@ def format_progress(current, total):
     percent = (current / total) * 100
     return f"[{current}/{total} {percent:.1f}%]"
 
-def fetch_actors():
+def lookup_profiles(actors, state):
+    """Record every actor's profile counts, keeping only the changed actors when crawling incrementally
+
+    The counts also size each actor's crawl, so the largest accounts are dispatched first.
+    """
+    profiles = {
+        profile['handle']: (profile['did'], profile['followers_count'], profile['follows_count'])
+        for profile in client.get_profiles(actors)
+    }
+    state.record_profiles(profiles)
+    if not incremental:
+        return actors
+    missing = len(actors) - len(profiles)
+    if missing:
+        logger.info(f"{missing} actors have no profile (deleted or suspended) and are skipped")
+    return state.select_changed(profiles, snapshot_ttl_hours)
+
+def fetch_actors(state):
     """Fetch list of actors to process"""
-    # Set to store unique handles
-    unique_handles = set()
-    
-    # Get followers
-    for follower in get_followers(actor):
-        if follower['handle'] != 'handle.invalid':
-            unique_handles.add(follower['handle'])
+    # Accounts are unique by DID; handles can change, but are what the crawl is keyed by.
+    # An account in several roots' neighbourhoods is crawled once.
+    handles_by_did = {}
     
-    # Get follows
-    for follow in get_follows(actor):
-        if follow['handle'] != 'handle.invalid':
-            unique_handles.add(follow['handle'])
-    
-    logger.info(f"Collected follows and followers for root actor: {actor}")
-    logger.info(f"Found {len(unique_handles)} actors to process")
+    for root in roots:
+        # Get followers
+        for follower in get_followers(root):
+            if follower['handle'] != 'handle.invalid':
+                handles_by_did[follower['did']] = follower['handle']
+        
+        # Get follows
+        for follow in get_follows(root):
+            if follow['handle'] != 'handle.invalid':
+                handles_by_did[follow['did']] = follow['handle']
+        
+        logger.info(f"Collected follows and followers for root actor: {root}")
+    logger.info(f"Found {len(handles_by_did)} actors to process")
     
-    # Add root actor
-    unique_handles.add(actor)
-    return list(unique_handles)
+    # Add root actors
+    actors = list(set(handles_by_did.values()) | set(roots))
+    return lookup_profiles(actors, state)
+
+def plan_first_hop(state):
+    """Persist the first hop's frontier, leaving out followers lists the edge store already holds"""
+    actors = fetch_actors(state)
+    covered = set()
+    if skip_covered:
+        edges = open_edge_store({})
+        if edges:
+            crawl_set = set(actors)
+            profiles = {name: counts for name, counts in state.run_profiles().items() if name in crawl_set}
+            covered = set(edges.covered_followers(profiles, edge_fresh_hours))
+            edges.close()
+            logger.info(f"Skipping the followers of {len(covered)} actors, the edge store already holds them")
+    state.add_actors([name for name in actors if name not in covered])
+    state.add_actors(covered, sides=("follows",))
 
-def collect_data(current_actor):
-    """Collect data for a single actor and return it"""
+def collect_data(current_actor, resume, max_pages, result_queue, worker=None):
+    """Stream a single actor's data to the writer in resumable chunks"""
     start_time = datetime.now()
     try:
-        logger.debug(f"Collecting follows for {current_actor}")
-        follows_data = list(get_follows(current_actor))
-        
-        logger.debug(f"Collecting followers for {current_actor}")
-        followers_data = list(get_followers(current_actor))
-        
+        for side, get_batches in (("follows", client.get_follows_batches), ("followers", client.get_followers_batches)):
+            # Sides missing from the frontier are not part of this crawl
+            cursor, done = resume.get(side, (None, True))
+            if done:
+                continue
+            logger.debug(f"Collecting {side} for {current_actor}")
+            chunk = []
+            pages = 0
+            for batch, cursor in get_batches(current_actor, cursor=cursor):
+                chunk.append(batch)
+                pages += 1
+                if client.metrics:
+                    client.metrics.record_page(batch.num_rows, worker)
+                if max_pages and pages >= max_pages:
+                    break
+                if cursor and pages % checkpoint_pages == 0:
+                    result_queue.put(("chunk", current_actor, side, serialize_batches(chunk), cursor, False))
+                    chunk = []
+            result_queue.put(("chunk", current_actor, side, serialize_batches(chunk), None, True))
+
         duration = (datetime.now() - start_time).total_seconds()
-        return current_actor, True, (follows_data, followers_data), None, duration
+        return "done", current_actor, True, None, duration
     except Exception as e:
         duration = (datetime.now() - start_time).total_seconds()
         logger.error(f"Error collecting data for {current_actor}: {str(e)}")
-        return current_actor, False, None, str(e), duration
+        return "done", current_actor, False, str(e), duration
+
+async def collect_data_async(async_client, current_actor, resume, max_pages, result_queue, worker=None):
+    """Stream a single actor's data to the writer in resumable chunks from the event loop"""
+    start_time = datetime.now()
+    try:
+        for side, get_batches in (("follows", async_client.get_follows_batches), ("followers", async_client.get_followers_batches)):
+            # Sides missing from the frontier are not part of this crawl
+            cursor, done = resume.get(side, (None, True))
+            if done:
+                continue
+            logger.debug(f"Collecting {side} for {current_actor}")
+            chunk = []
+            pages = 0
+            async for batch, cursor in get_batches(current_actor, cursor=cursor):
+                chunk.append(batch)
+                pages += 1
+                if async_client.metrics:
+                    async_client.metrics.record_page(batch.num_rows, worker)
+                if max_pages and pages >= max_pages:
+                    break
+                if cursor and pages % checkpoint_pages == 0:
+                    result_queue.put(("chunk", current_actor, side, serialize_batches(chunk), cursor, False))
+                    chunk = []
+            result_queue.put(("chunk", current_actor, side, serialize_batches(chunk), None, True))
 
-def worker(task_queue, result_queue, worker_id, total_actors):
+        duration = (datetime.now() - start_time).total_seconds()
+        return "done", current_actor, True, None, duration
+    except Exception as e:
+        duration = (datetime.now() - start_time).total_seconds()
+        logger.error(f"Error collecting data for {current_actor}: {str(e)}")
+        return "done", current_actor, False, str(e), duration
+
+def worker(task_queue, result_queue, worker_id, total_actors, rate_limiter, metrics):
     """Worker process to collect data"""
+    # Throttle against the limiter shared by every worker and report into the shared metrics
+    client.rate_limiter = rate_limiter
+    client.metrics = metrics
     while True:
         try:
-            actor = task_queue.get()
-            if actor is None:  # Poison pill
+            task = task_queue.get()
+            if task is None:  # Poison pill
                 logger.info(f"Worker {worker_id} received shutdown signal")
                 break
-                
+
+            actor, resume, max_pages = task
             logger.info(f"Worker {worker_id} processing {actor}")
-            result = collect_data(actor)
+            metrics.heartbeat(worker_id - 1)
+            result = collect_data(actor, resume, max_pages, result_queue, worker_id - 1)
             result_queue.put(result)
             
         except Exception as e:
@@ -92,59 +206,58 @@ def worker(task_queue, result_queue, worker_id, total_actors):
             break
     logger.info(f"Worker {worker_id} shutting down")
 
-def ensure_pond_directories():
-    """Ensure pond directories exist for storing parquet files"""
-    os.makedirs("pond/follows", exist_ok=True)
-    os.makedirs("pond/followers", exist_ok=True)
-
-def save_results(result_queue, num_actors):
-    """Save results to parquet files and track progress"""
+def save_results(result_queue, num_actors, state, is_alive):
+    """Save results to parquet files, checkpoint the crawl state and track progress"""
     processed = 0
     successful = 0
     failed = 0
     total_duration = 0
     
-    # Lists to store data
-    follows_data = []
-    followers_data = []
-    follows_size = 0
-    followers_size = 0
-    follows_file_count = 0
-    followers_file_count = 0
-    
-    # Ensure pond directories exist
-    ensure_pond_directories()
+    # Cursors reached by written data, committed once the file holding it is closed
+    pending_checkpoints = defaultdict(dict)
+    # Edges can also be written through to the DID-keyed graph schema
+    edges = open_edge_store(state.actor_dids()) if write_edges else None
+
+    def commit_checkpoints(side, bucket):
+        checkpoints = pending_checkpoints.pop((side, bucket), None)
+        if checkpoints:
+            state.checkpoint((actor_name, side, cursor, done) for actor_name, (cursor, done) in checkpoints.items())
+
+    writers = {
+        side: PartitionedPondWriter(
+            f"pond/{side}",
+            state.run_id,
+            on_file_closed=lambda bucket, side=side: commit_checkpoints(side, bucket),
+        )
+        for side in ("follows", "followers")
+    }
     
     logger.info(f"Starting to collect results for {num_actors} actors")
     start_time = datetime.now()
     
-    def write_follows_batch():
-        nonlocal follows_data, follows_size, follows_file_count
-        if follows_data:
-            follows_file_count += 1
-            filename = f"pond/follows/follows_{follows_file_count:04d}.parquet"
-            # Convert JSON records directly to Arrow table and write to parquet
-            table = pa.Table.from_pylist(follows_data)
-            pq.write_table(table, filename)
-            logger.info(f"Wrote follows batch {follows_file_count} ({len(follows_data)} records, {follows_size/1024/1024:.1f}MB)")
-            follows_data = []
-            follows_size = 0
-            
-    def write_followers_batch():
-        nonlocal followers_data, followers_size, followers_file_count
-        if followers_data:
-            followers_file_count += 1
-            filename = f"pond/followers/followers_{followers_file_count:04d}.parquet"
-            # Convert JSON records directly to Arrow table and write to parquet
-            table = pa.Table.from_pylist(followers_data)
-            pq.write_table(table, filename)
-            logger.info(f"Wrote followers batch {followers_file_count} ({len(followers_data)} records, {followers_size/1024/1024:.1f}MB)")
-            followers_data = []
-            followers_size = 0
-    
     while processed < num_actors:
         try:
-            actor_name, success, data, error, duration = result_queue.get(timeout=60)
+            message = result_queue.get(timeout=60)
+
+            if message[0] == "chunk":
+                _, actor_name, side, payload, cursor, done = message
+                table = deserialize_batches(payload)
+                writers[side].write_table(actor_name, table)
+                if edges:
+                    try:
+                        edges.write(side, table)
+                        if done:
+                            edges.finish_side(actor_name, side)
+                    except Exception as e:
+                        logger.error(f"Error writing {side} edges of {actor_name}: {str(e)}")
+                    finally:
+                        # Only hold the lock while writing, so load_pond.py and SQLMesh can run during the crawl
+                        edges.close()
+                # Only files closed after this point contain the whole chunk
+                pending_checkpoints[(side, actor_bucket(actor_name))][actor_name] = (cursor, done)
+                continue
+
+            _, actor_name, success, error, duration = message
             processed += 1
             total_duration += duration
             avg_duration = total_duration / processed
@@ -154,20 +267,6 @@ def save_results(result_queue, num_actors):
             eta_minutes = eta_seconds / 60
             
             if success:
-                actor_follows, actor_followers = data
-                
-                # Estimate size increase for follows
-                follows_size += sum(len(str(item)) for item in actor_follows)  # Rough estimate
-                follows_data.extend(actor_follows)
-                if follows_size >= 300 * 1024 * 1024:  # 100MB
-                    write_follows_batch()
-                
-                # Estimate size increase for followers
-                followers_size += sum(len(str(item)) for item in actor_followers)  # Rough estimate
-                followers_data.extend(actor_followers)
-                if followers_size >= 300 * 1024 * 1024:  # 100MB
-                    write_followers_batch()
-                
                 successful += 1
                 logger.info(f"{progress} Collected data for {actor_name} (took {duration:.1f}s, avg {avg_duration:.1f}s, ETA {eta_minutes:.1f}min)")
             else:
@@ -175,56 +274,62 @@ def save_results(result_queue, num_actors):
                 logger.error(f"{progress} Failed to process {actor_name}: {error}")
                 
         except Empty:
-            logger.error("Timeout waiting for results")
+            if is_alive():
+                logger.warning("No results for 60s, workers are still running so waiting on")
+                continue
+            logger.error("Timeout waiting for results and no workers are left")
             break
         except Exception as e:
             logger.error(f"Error in save_results: {str(e)}")
             break
     
     # Write any remaining data
-    write_follows_batch()
-    write_followers_batch()
+    for writer in writers.values():
+        writer.close()
+    if edges:
+        edges.close()
     
     total_time = (datetime.now() - start_time).total_seconds()
     logger.info(f"Total processing time: {total_time/60:.1f} minutes")
     return successful, failed
 
-def main():
-    actors = fetch_actors()
-    num_actors = len(actors)
-    
-    if num_actors == 0:
-        logger.info("No actors to process")
-        return
-    
-    logger.info(f"Starting processing of {num_actors} actors")
-    start_time = datetime.now()
-    
+def crawl_processes(tasks, state):
+    """Crawl actors with a pool of worker processes"""
+    num_actors = len(tasks)
+
     # Create queues for tasks and results
     task_queue = Queue()
     result_queue = Queue()
     
     # Add tasks to queue
-    for actor in actors:
-        task_queue.put(actor)
+    for task in tasks:
+        task_queue.put(task)
     
     # Add poison pills for workers
-    num_processes = min(99, num_actors)  # Don't create more processes than actors, tried 200 and it got too many requests errors from API
+    num_processes = min(99, num_actors)  # Don't create more processes than actors
     for _ in range(num_processes):
         task_queue.put(None)
+
+    # The request rate is set by one limiter shared by all workers, not by the number of processes
+    rate_limiter = RateLimiter(max_concurrency=num_processes)
+    # Workers heartbeat in their slot whenever they start an actor or fetch a page
+    metrics = Metrics(num_processes)
+    exporter = MetricsExporter(metrics, gauges={
+        "task_queue_depth": task_queue.qsize,
+        "result_queue_depth": result_queue.qsize,
+    }).start()
     
     # Start worker processes
     processes = []
-    process_last_active = {}  # Track when each process last produced output
     for i in range(num_processes):
-        p = Process(target=worker, args=(task_queue, result_queue, i+1, num_actors))
+        p = Process(target=worker, args=(task_queue, result_queue, i+1, num_actors, rate_limiter, metrics))
         p.daemon = True  # Make workers daemon processes so they exit when main process exits
         p.start()
-        process_last_active[p.pid] = datetime.now()
         processes.append(p)
     
     # Collect results and save to parquet
-    successful, failed = save_results(result_queue, num_actors)
+    successful, failed = save_results(result_queue, num_actors, state, lambda: any(p.is_alive() for p in processes))
+    exporter.stop()
     
     # Wait for processes to complete with timeout
     logger.info("Waiting for worker processes to complete...")
@@ -233,10 +338,10 @@ def main():
     MAX_INACTIVE_TIME = 60  # 1 minutes without any activity
     GRACEFUL_SHUTDOWN_TIME = 30  # 30 seconds for graceful shutdown
     
-    for p in processes:
+    for i, p in enumerate(processes):
         try:
             # Check if process has been inactive for too long
-            inactive_time = (datetime.now() - process_last_active[p.pid]).total_seconds()
+            inactive_time = time.time() - metrics.last_heartbeat(i)
             
             if inactive_time > MAX_INACTIVE_TIME:
                 logger.warning(f"Process {p.pid} has been inactive for {inactive_time:.1f} seconds, terminating...")
@@ -257,16 +362,117 @@ def main():
                         os.kill(p.pid, 9)
         except Exception as e:
             logger.error(f"Error while joining process {p.pid}: {str(e)}")
+
+    return successful, failed
+
+async def crawl_async(tasks, state):
+    """Crawl actors from one event loop sharing a pooled HTTP session"""
+    num_actors = len(tasks)
+    # save_results blocks on its queue, so it runs in a thread fed by the crawl tasks
+    result_queue = queue.Queue()
+    actor_queue = asyncio.Queue()
+    for task in tasks:
+        actor_queue.put_nowait(task)
+    crawling = threading.Event()
+    crawling.set()
+
+    num_tasks = min(max_in_flight, num_actors)
+    async_client = create_async_client(max_in_flight=max_in_flight, rate_limiter=RateLimiter(max_concurrency=max_in_flight))
+    async_client.metrics = Metrics(num_tasks)
+    exporter = MetricsExporter(async_client.metrics, gauges={
+        "task_queue_depth": actor_queue.qsize,
+        "result_queue_depth": result_queue.qsize,
+    }).start()
+
+    async def crawl_task(task_id):
+        while True:
+            try:
+                current_actor, resume, max_pages = actor_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            logger.debug(f"Task {task_id} processing {current_actor}")
+            async_client.metrics.heartbeat(task_id - 1)
+            result_queue.put(await collect_data_async(async_client, current_actor, resume, max_pages, result_queue, task_id - 1))
+
+    saver = asyncio.create_task(asyncio.to_thread(save_results, result_queue, num_actors, state, crawling.is_set))
+    logger.info(f"Crawling with {num_tasks} async tasks and at most {max_in_flight} requests in flight")
+    try:
+        await asyncio.gather(*(crawl_task(i+1) for i in range(num_tasks)))
+    finally:
+        crawling.clear()
+        await async_client.close()
+
+    results = await saver
+    exporter.stop()
+    return results
+
+def run_crawl(state):
+    """Crawl the pending actors of the current run, returning True once it is finished"""
+    tasks = state.pending_actors()
+    num_actors = len(tasks)
+    
+    if num_actors == 0:
+        logger.info("No actors to process")
+        state.finish_run()
+        return True
+    
+    logger.info(f"Starting processing of {num_actors} actors")
+    start_time = datetime.now()
+
+    if crawl_mode == "async":
+        successful, failed = asyncio.run(crawl_async(tasks, state))
+    else:
+        successful, failed = crawl_processes(tasks, state)
+
+    remaining = state.remaining()
+    if remaining == 0:
+        state.finish_run()
+    else:
+        logger.warning(f"{remaining} actors are unfinished, rerun to resume the crawl")
     
     total_time = (datetime.now() - start_time).total_seconds()
     logger.info(f"Processing complete in {total_time/60:.1f} minutes:")
     logger.info(f"- Successful: {successful}")
     logger.info(f"- Failed: {failed}")
     logger.info(f"- Total: {num_actors}")
-    logger.info(f"Data written to pond/follows/*.parquet and pond/followers/*.parquet")
+    logger.info(f"Data written to pond/follows/**/*.parquet and pond/followers/**/*.parquet")
+    return remaining == 0
+
+def profile_follows_counts(dids):
+    """(did, handle, follows_count) for each actor that still exists"""
+    for profile in client.get_profiles(dids):
+        yield profile['did'], profile['handle'], profile['follows_count']
+
+def expand_second_hop(state):
+    """Crawl the follows of the accounts that follow most of the roots' follows, within the request budget"""
+    if not state.start_run("follows_expand", root_key):
+        seen = BloomFilter.load("follows_expand.bloom")
+        graph = FollowGraph.load_pond()
+        dids = {}
+
+        def lookup(batch):
+            for did, handle, follows_count in profile_follows_counts(batch):
+                dids[handle] = did
+                yield did, handle, follows_count
+
+        plan = plan_expansion(rank_roots(graph, roots), lookup, seen, expand_budget, expand_max_pages)
+        state.add_actors(plan, sides=("follows",), max_pages=plan, dids=dids)
+        seen.save("follows_expand.bloom")
+    return run_crawl(state)
+
+def main():
+    state = CrawlState()
+    # An unfinished second hop is resumed before starting a fresh first hop
+    if not (expand_budget and state.resumable("follows_expand", root_key)):
+        # A crawl that died part way keeps its frontier, so only a fresh run asks the API for it
+        if not state.start_run("follows", root_key):
+            plan_first_hop(state)
+        if not run_crawl(state):
+            state.close()
+            return
+    if expand_budget:
+        expand_second_hop(state)
+    state.close()
 
 if __name__ == '__main__':
     main()
-
-# TODO: it would be good to find who the followers of people I follow are also following
-# and add that data to the follows table, but it is likely to be a lot of data and a huge number of API calls
\ No newline at end of file
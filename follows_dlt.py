@@ -6,18 +6,66 @@ from queue import Empty
 from datetime import datetime
 import dlt
 import os
+import time
 from dlt.sources.helpers.rest_client import RESTClient
 from dlt.sources.helpers.rest_client.paginators import JSONResponseCursorPaginator
+import pyarrow as pa
+from crawl_state import CrawlState
+from edge_store import EDGE_STORE_PATH, EdgeStore, open_edge_store
+from expand import BloomFilter, plan_expansion, rank_roots
+from graph import FollowGraph
+from metrics import Metrics, MetricsExporter
+from page_cache import open_cache
+from pond import POND_SCHEMA, columns_from_json, deserialize_batches, serialize_batches, to_batch
+from rate_limit import RETRYABLE_STATUSES, RateLimitedSession, RateLimiter
 
 # Shared constants
 pipeline_name = "bluesky"
 dataset_name = "raw_http"
-actor = os.environ.get("bsky_actor")
+# Base actors to crawl around, comma separated; bsky_actor still names a single one
+roots = [name.strip() for name in os.environ.get("bsky_actors", os.environ.get("bsky_actor", "")).split(",")
+         if name.strip()]
+# Runs are keyed by the set of roots, so reordering them still resumes the same crawl
+root_key = ",".join(sorted(roots))
+# Pages per chunk loaded at once; each chunk ends at a cursor the crawl can resume from
+checkpoint_pages = int(os.environ.get("bsky_checkpoint_pages", "20"))
+# Only recrawl actors whose follower/follow counts changed or whose snapshot is older than the TTL
+incremental = os.environ.get("bsky_incremental", "false").lower() in ("1", "true", "yes")
+snapshot_ttl_hours = float(os.environ.get("bsky_snapshot_ttl_hours", "168"))
+# Requests a second-hop crawl of the best candidates' follows may spend after the first hop; 0 disables it
+expand_budget = int(os.environ.get("bsky_expand_budget", "0"))
+# Second-hop actors following more than this many pages of accounts are skipped
+expand_max_pages = int(os.environ.get("bsky_expand_max_pages", "20"))
+# Don't fetch the followers of actors whose followers all showed up in fresh follows lists of the crawl set
+skip_covered = os.environ.get("bsky_skip_covered", "false").lower() in ("1", "true", "yes")
+edge_fresh_hours = float(os.environ.get("bsky_edge_fresh_hours", "48"))
+# Chunks are loaded together in one pipeline.run once this many actors or seconds have been buffered
+load_batch_actors = int(os.environ.get("bsky_load_batch_actors", "200"))
+load_batch_seconds = float(os.environ.get("bsky_load_batch_seconds", "60"))
+# Send pages to the loader as Arrow tables instead of dicts dlt has to normalize row by row
+arrow_loads = os.environ.get("bsky_arrow_loads", "true").lower() in ("1", "true", "yes")
+# Load only the follows added and removed since each actor's last snapshot instead of its whole lists; needs the edge store
+delta_snapshots = os.environ.get("bsky_delta_snapshots", "false").lower() in ("1", "true", "yes")
 
-# Shared client
+# Arrow tables skip dlt's normalizer, so ask it to add the columns the models read
+os.environ.setdefault("NORMALIZE__PARQUET_NORMALIZER__ADD_DLT_LOAD_ID", "true")
+os.environ.setdefault("NORMALIZE__PARQUET_NORMALIZER__ADD_DLT_ID", "true")
+
+# The pond columns, with the timestamps typed as dlt infers them from the JSON, and whether a row
+# belongs to a whole list ('snapshot') or was 'added' or 'removed' since the actor's last snapshot
+LOAD_SCHEMA = pa.schema([
+    pa.field(field.name, pa.timestamp("us", tz="UTC")) if field.name in ("created_at", "indexed_at") else field
+    for field in POND_SCHEMA
+]).append(pa.field("change_type", pa.string()))
+
+# With delta snapshots the raw tables only hold changes, and the current lists live in the edge store
+SNAPSHOT_LISTS = tuple(f"(SELECT * FROM graph.snapshot_members WHERE side = '{side}')" for side in ("follows", "followers"))
+
+# Shared client, every request goes through the session's rate limiter and, if enabled, page cache
 bluesky_client = RESTClient(
-    base_url="https://public.api.bsky.app/xrpc/",
+    base_url=os.environ.get("bsky_api_url", "https://public.api.bsky.app").rstrip("/") + "/xrpc/",
     paginator=JSONResponseCursorPaginator(cursor_path="cursor", cursor_param="cursor"),
+    session=RateLimitedSession(cache=open_cache()),
 )
 
 @dlt.resource
@@ -42,9 +90,57 @@ def get_follows(actor: str):
     ):
         yield page
 
+# The key each paginated endpoint returns its records under
+RECORDS_KEY = {
+    "app.bsky.graph.getFollows": "follows",
+    "app.bsky.graph.getFollowers": "followers",
+}
+
+def get_pages(endpoint: str, actor: str, cursor=None):
+    """Yield (records, next_cursor) for each page of an endpoint, starting at cursor
+
+    Each response's JSON is parsed once for both its records and its cursor.
+    An actor the API refuses outright, e.g. a deleted, suspended or renamed
+    handle, yields no pages, so its side is finished as an empty list.
+    """
+    params = {
+        "actor": actor,
+        "limit": 100,
+    }
+    while True:
+        if cursor:
+            params["cursor"] = cursor
+        response = bluesky_client.get(endpoint, params=params)
+        if not cursor and 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUSES:
+            # Unknown, deleted or suspended actors have nothing to fetch; a later page failing still raises
+            logger.error(f"Error getting {RECORDS_KEY[endpoint]} for {actor}: HTTP {response.status_code} {response.text}")
+            return
+        response.raise_for_status()
+        data = response.json()
+        records = data.get(RECORDS_KEY[endpoint], [])
+        cursor = data.get("cursor")
+        yield records, cursor
+        if not cursor or not records:
+            break
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+def page_to_batch(records, actor_str):
+    """Project a page of profile JSON into an Arrow batch with the raw_http columns"""
+    columns = columns_from_json(records, actor_str, None)
+    columns["indexed_at"] = [parse_timestamp(record.get("indexedAt")) for record in records]
+    columns["created_at"] = [parse_timestamp(value) for value in columns["created_at"]]
+    columns["change_type"] = ["snapshot"] * len(records)
+    return pa.RecordBatch.from_pydict(columns, schema=LOAD_SCHEMA)
+
 def create_actor_field(actor_str):
     def actor_field(data):
         data["actor"] = actor_str
+        data["change_type"] = "snapshot"
         return data
     return actor_field 
 
@@ -64,60 +160,152 @@ def format_progress(current, total):
     percentage = (current / total) * 100
     return f"[{current}/{total} - {percentage:.1f}%]"
 
-def fetch_actors():
-    logger.info(f"Starting data collection for root actor: {actor}")
-    pipeline.run(get_followers(actor).add_map(create_actor_field(actor)),
-                table_name="followers",
-                write_disposition="append",
-                )
-    pipeline.run(get_follows(actor).add_map(create_actor_field(actor)),
-                table_name="follows",
-                write_disposition="append",
-                )
-    logger.info(f"Collected follows and followers for root actor: {actor}")
+def get_profiles(actors, batch_size=25):
+    """Get detailed profiles, including follower and follow counts, 25 actors per request"""
+    for start in range(0, len(actors), batch_size):
+        response = bluesky_client.get(
+            "app.bsky.actor.getProfiles",
+            params={"actors": actors[start:start + batch_size]},
+        )
+        response.raise_for_status()
+        yield from response.json().get("profiles", [])
+
+def lookup_profiles(actors, state):
+    """Record every actor's profile counts, keeping only the changed actors when crawling incrementally
+
+    The counts also size each actor's crawl, so the largest accounts are dispatched first.
+    """
+    profiles = {
+        profile["handle"]: (profile["did"], profile.get("followersCount", 0), profile.get("followsCount", 0))
+        for profile in get_profiles(actors)
+    }
+    state.record_profiles(profiles)
+    if not incremental:
+        return actors
+    missing = len(actors) - len(profiles)
+    if missing:
+        logger.info(f"{missing} actors have no profile (deleted or suspended) and are skipped")
+    return state.select_changed(profiles, snapshot_ttl_hours)
+
+def fetch_actors(state):
+    if delta_snapshots:
+        return fetch_actors_from_api(state)
+    for root in roots:
+        logger.info(f"Starting data collection for root actor: {root}")
+        pipeline.run(get_followers(root).add_map(create_actor_field(root)),
+                    table_name="followers",
+                    write_disposition="append",
+                    )
+        pipeline.run(get_follows(root).add_map(create_actor_field(root)),
+                    table_name="follows",
+                    write_disposition="append",
+                    )
+        logger.info(f"Collected follows and followers for root actor: {root}")
 
     con = duckdb.connect(database=pipeline_name + ".duckdb", read_only=False)
+    # Accounts are unique by DID; earlier loads can hold an account under an old handle, so take the latest.
+    # An account in several roots' neighbourhoods is crawled once.
     sql = f"""
-    SELECT handle FROM {dataset_name}.followers WHERE actor = '{actor}' and actor != 'handle.invalid'
-    UNION
-    SELECT handle FROM {dataset_name}.follows WHERE actor = '{actor}' and actor != 'handle.invalid'
+    SELECT arg_max(handle, _dlt_load_id) FROM (
+        SELECT did, handle, _dlt_load_id FROM {dataset_name}.followers WHERE list_contains($roots, actor)
+        UNION ALL
+        SELECT did, handle, _dlt_load_id FROM {dataset_name}.follows WHERE list_contains($roots, actor)
+    )
+    GROUP BY did
+    HAVING arg_max(handle, _dlt_load_id) != 'handle.invalid'
     """
-    con.execute(sql)
+    con.execute(sql, {"roots": roots})
     actors = con.fetchall()
     con.close()
     logger.info(f"Found {len(actors)} actors to process")
-    return actors
+    actors = [row[0] for row in actors]
+    return lookup_profiles(actors, state)
+
+def fetch_actors_from_api(state):
+    """Fetch list of actors to process without loading the roots' lists, which are diffed with the crawl set's"""
+    handles_by_did = {}
+    for root in roots:
+        for endpoint in ("app.bsky.graph.getFollowers", "app.bsky.graph.getFollows"):
+            for records, _ in get_pages(endpoint, root):
+                handles_by_did.update(
+                    (record["did"], record["handle"]) for record in records if record["handle"] != "handle.invalid"
+                )
+        logger.info(f"Collected follows and followers for root actor: {root}")
+    logger.info(f"Found {len(handles_by_did)} actors to process")
+    actors = list(set(handles_by_did.values()) | set(roots))
+    return lookup_profiles(actors, state)
+
+def plan_first_hop(state):
+    """Persist the first hop's frontier, leaving out followers lists the edge store already holds"""
+    actors = fetch_actors(state)
+    covered = set()
+    if skip_covered:
+        edges = open_edge_store({})
+        if edges:
+            crawl_set = set(actors)
+            profiles = {name: counts for name, counts in state.run_profiles().items() if name in crawl_set}
+            covered = set(edges.covered_followers(profiles, edge_fresh_hours))
+            edges.close()
+            logger.info(f"Skipping the followers of {len(covered)} actors, the edge store already holds them")
+    state.add_actors([name for name in actors if name not in covered])
+    state.add_actors(covered, sides=("follows",))
+
+def pack_chunk(chunk):
+    return serialize_batches(chunk, LOAD_SCHEMA) if arrow_loads else chunk
 
-def collect_data(current_actor):
-    """Collect data for a single actor and return it"""
+def collect_data(current_actor, resume, max_pages, result_queue, worker=None):
+    """Stream a single actor's data to the loader in resumable chunks"""
     start_time = datetime.now()
     try:
-        logger.debug(f"Collecting follows for {current_actor}")
-        follows_data = list(get_follows(current_actor).add_map(create_actor_field(current_actor)))
-        
-        logger.debug(f"Collecting followers for {current_actor}")
-        followers_data = list(get_followers(current_actor).add_map(create_actor_field(current_actor)))
-        
+        add_actor = create_actor_field(current_actor)
+        for side, endpoint in (("follows", "app.bsky.graph.getFollows"), ("followers", "app.bsky.graph.getFollowers")):
+            # Sides missing from the frontier are not part of this crawl
+            cursor, done = resume.get(side, (None, True))
+            if done:
+                continue
+            logger.debug(f"Collecting {side} for {current_actor}")
+            chunk = []
+            pages = 0
+            for records, cursor in get_pages(endpoint, current_actor, cursor):
+                if arrow_loads:
+                    chunk.append(page_to_batch(records, current_actor))
+                else:
+                    chunk.extend(add_actor(record) for record in records)
+                pages += 1
+                if bluesky_client.session.metrics:
+                    bluesky_client.session.metrics.record_page(len(records), worker)
+                if max_pages and pages >= max_pages:
+                    break
+                if cursor and pages % checkpoint_pages == 0:
+                    result_queue.put(("chunk", current_actor, side, pack_chunk(chunk), cursor, False))
+                    chunk = []
+            # The cursor is only left set when max_pages cut the list short
+            result_queue.put(("chunk", current_actor, side, pack_chunk(chunk), cursor, True))
+
         duration = (datetime.now() - start_time).total_seconds()
-        return current_actor, True, (follows_data, followers_data), None, duration
+        return "done", current_actor, True, None, duration
     except Exception as e:
         duration = (datetime.now() - start_time).total_seconds()
         logger.error(f"Error collecting data for {current_actor}: {str(e)}")
-        return current_actor, False, None, str(e), duration
+        return "done", current_actor, False, str(e), duration
 
-def worker(task_queue, result_queue, worker_id, total_actors):
+def worker(task_queue, result_queue, worker_id, total_actors, rate_limiter, metrics):
     """Worker process to collect data"""
+    # Throttle against the limiter shared by every worker and report into the shared metrics
+    bluesky_client.session.rate_limiter = rate_limiter
+    bluesky_client.session.metrics = metrics
     processed = 0
     while True:
         try:
-            actor_tuple = task_queue.get(timeout=1)
-            if actor_tuple is None:  # Poison pill
+            task = task_queue.get(timeout=1)
+            if task is None:  # Poison pill
                 break
             
-            current_actor = actor_tuple[0]
+            current_actor, resume, max_pages = task
             processed += 1
             logger.info(f"Worker {worker_id} {format_progress(processed, total_actors//5)}: Processing {current_actor}")
-            result = collect_data(current_actor)
+            metrics.heartbeat(worker_id - 1)
+            result = collect_data(current_actor, resume, max_pages, result_queue, worker_id - 1)
             result_queue.put(result)
             
         except Empty:
@@ -126,19 +314,183 @@ def worker(task_queue, result_queue, worker_id, total_actors):
             logger.error(f"Worker {worker_id} error: {str(e)}")
             break
 
-def save_results(result_queue, num_actors):
-    """Save results to database from a single process"""
+class BatchLoader:
+    """Buffers chunks from many actors and loads them with one pipeline.run
+
+    A load is triggered once chunks from max_actors actors are buffered or
+    the oldest buffered chunk is max_seconds old. Both tables go into the same
+    load package, and the crawl state is checkpointed after the load, so a
+    crash loses at most the unloaded batch, which the next run refetches.
+
+    With delta snapshots, pages are staged in the edge store instead, and
+    only the changes of the lists finished in the batch are loaded.
+    """
+
+    def __init__(self, state, max_actors: int = 200, max_seconds: float = 60.0):
+        self.state = state
+        # Edges are written through to the graph schema after each load
+        self.edges = EdgeStore(EDGE_STORE_PATH, state.actor_dids()) if EDGE_STORE_PATH else None
+        self.delta = delta_snapshots and self.edges is not None
+        if delta_snapshots and not self.delta:
+            logger.warning("bsky_delta_snapshots needs the edge store, loading whole lists instead")
+        self.max_actors = max_actors
+        self.max_seconds = max_seconds
+        self.loads = 0
+        self.rows_loaded = 0
+        self._data = {"follows": [], "followers": []}
+        self._checkpoints = {}
+        self._actors = set()
+        self._started_at = None
+        # Sides whose data failed to load must not be checkpointed past it in this run
+        self._failed = set()
+
+    def add(self, actor_name, side, data, cursor, done):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        if isinstance(data, bytes):
+            data = deserialize_batches(data)
+            if data.num_rows:
+                self._data[side].append(data)
+        elif data:
+            self._data[side].extend(data)
+        self._checkpoints[(actor_name, side)] = (cursor, done)
+        self._actors.add(actor_name)
+        if len(self._actors) >= self.max_actors:
+            self.flush()
+
+    def tables(self):
+        """The buffered pages of each side as one Arrow table"""
+        tables = {}
+        for side, data in self._data.items():
+            if not data:
+                continue
+            if isinstance(data[0], pa.Table):
+                tables[side] = pa.concat_tables(data)
+            else:
+                columns = columns_from_json(data, None, None)
+                columns["actor"] = [record["actor"] for record in data]
+                tables[side] = pa.Table.from_batches([to_batch(columns)])
+        return tables
+
+    def resources(self):
+        """The buffered pages as dlt resources, and how many rows they hold"""
+        resources = []
+        rows = 0
+        for side, data in self._data.items():
+            if not data:
+                continue
+            if isinstance(data[0], pa.Table):
+                data = pa.concat_tables(data)
+                rows += data.num_rows
+            else:
+                rows += len(data)
+            resources.append(dlt.resource(data, name=side, table_name=side, write_disposition="append"))
+        return resources, rows
+
+    def snapshot_resources(self, checkpoints):
+        """Stage the buffered pages and diff the lists finished in this batch, as dlt resources of the changes"""
+        edges = self.edges
+        try:
+            for side, table in self.tables().items():
+                edges.stage(side, table, self.state.run_id)
+            changes = edges.snapshot_changes(
+                [(actor_name, side, cursor is None) for actor_name, side, cursor, done in checkpoints if done],
+                self.state.run_id,
+            )
+        finally:
+            # dlt opens the same database while it loads
+            edges.close()
+        resources = []
+        rows = 0
+        for side, table in changes.items():
+            if not table.num_rows:
+                continue
+            table = table.select(LOAD_SCHEMA.names).cast(LOAD_SCHEMA)
+            resources.append(dlt.resource(table, name=side, table_name=side, write_disposition="append"))
+            rows += table.num_rows
+        return resources, rows
+
+    def write_edges(self, checkpoints):
+        """Write the buffered pages through to the edge store, holding its connection only meanwhile"""
+        edges = self.edges
+        if edges is None:
+            return
+        try:
+            for side, table in self.tables().items():
+                edges.write(side, table)
+            for actor_name, side, _, done in checkpoints:
+                if done:
+                    edges.finish_side(actor_name, side)
+        except Exception as e:
+            logger.error(f"Error writing edges for {len(self._actors)} actors: {str(e)}")
+        finally:
+            edges.close()
+
+    def due(self) -> bool:
+        return self._started_at is not None and time.monotonic() - self._started_at >= self.max_seconds
+
+    def flush(self):
+        if self._started_at is None:
+            return
+        checkpoints = [
+            (actor_name, side, cursor, done)
+            for (actor_name, side), (cursor, done) in self._checkpoints.items()
+            if (actor_name, side) not in self._failed
+        ]
+        rows = 0
+        try:
+            resources, rows = self.snapshot_resources(checkpoints) if self.delta else self.resources()
+            if resources:
+                pipeline.run(resources)
+                self.loads += 1
+                self.rows_loaded += rows
+                logger.info(f"Loaded {rows} records for {len(self._actors)} actors")
+            if self.delta:
+                # The changes are loaded, so the next crawl is diffed against these lists. If this fails
+                # the sides are not checkpointed either, and the rerun that diffs them again loads the
+                # same changes, which the incremental models' unique key collapses
+                try:
+                    self.edges.commit_snapshots()
+                finally:
+                    self.edges.close()
+            # The batch is loaded, so the crawl can resume after it
+            self.state.checkpoint(checkpoints)
+        except Exception as e:
+            logger.error(f"Error loading {rows} records for {len(self._actors)} actors: {str(e)}")
+            self._failed.update(self._checkpoints)
+        else:
+            self.write_edges(checkpoints)
+        self._data = {"follows": [], "followers": []}
+        self._checkpoints = {}
+        self._actors = set()
+        self._started_at = None
+
+def save_results(result_queue, num_actors, state, is_alive):
+    """Load results into the database in batches from a single process and checkpoint the crawl state"""
     processed = 0
     successful = 0
     failed = 0
     total_duration = 0
+    loader = BatchLoader(state, load_batch_actors, load_batch_seconds)
+    timeout = min(60, load_batch_seconds)
+    waited = 0
     
     logger.info(f"Starting to save results for {num_actors} actors")
     start_time = datetime.now()
     
     while processed < num_actors:
         try:
-            actor_name, success, data, error, duration = result_queue.get(timeout=60)
+            message = result_queue.get(timeout=timeout)
+            waited = 0
+
+            if message[0] == "chunk":
+                _, actor_name, side, data, cursor, done = message
+                loader.add(actor_name, side, data, cursor, done)
+                if loader.due():
+                    loader.flush()
+                continue
+
+            _, actor_name, success, error, duration = message
             processed += 1
             total_duration += duration
             avg_duration = total_duration / processed
@@ -148,47 +500,43 @@ def save_results(result_queue, num_actors):
             eta_minutes = eta_seconds / 60
             
             if success:
-                follows_data, followers_data = data
-                try:
-                    # Save follows
-                    pipeline.run(
-                        follows_data,
-                        table_name="follows",
-                        write_disposition="append",
-                    )
-                    # Save followers
-                    pipeline.run(
-                        followers_data,
-                        table_name="followers",
-                        write_disposition="append",
-                    )
-                    successful += 1
-                    logger.info(f"{progress} Saved data for {actor_name} (took {duration:.1f}s, avg {avg_duration:.1f}s, ETA {eta_minutes:.1f}min)")
-                except Exception as e:
-                    failed += 1
-                    logger.error(f"{progress} Error saving data for {actor_name}: {str(e)}")
+                successful += 1
+                logger.info(f"{progress} Collected data for {actor_name} (took {duration:.1f}s, avg {avg_duration:.1f}s, ETA {eta_minutes:.1f}min)")
             else:
                 failed += 1
                 logger.error(f"{progress} Failed to process {actor_name}: {error}")
                 
         except Empty:
-            logger.error("Timeout waiting for results")
+            if loader.due():
+                loader.flush()
+            waited += timeout
+            if waited < 60:
+                continue
+            if is_alive():
+                logger.warning(f"No results for {waited:.0f}s, workers are still running so waiting on")
+                continue
+            logger.error("Timeout waiting for results and no workers are left")
             break
         except Exception as e:
             logger.error(f"Error in save_results: {str(e)}")
             break
     
+    # Load whatever is still buffered
+    loader.flush()
+    
     total_time = (datetime.now() - start_time).total_seconds()
-    logger.info(f"Total processing time: {total_time/60:.1f} minutes")
+    logger.info(f"Total processing time: {total_time/60:.1f} minutes, {loader.rows_loaded} records in {loader.loads} loads")
     return successful, failed
 
-def main():
-    actors = fetch_actors()
-    num_actors = len(actors)
+def run_crawl(state):
+    """Crawl the pending actors of the current run, returning True once it is finished"""
+    tasks = state.pending_actors()
+    num_actors = len(tasks)
     
     if num_actors == 0:
         logger.info("No actors to process")
-        return
+        state.finish_run()
+        return True
     
     logger.info(f"Starting processing of {num_actors} actors")
     start_time = datetime.now()
@@ -198,27 +546,42 @@ def main():
     result_queue = Queue()
     
     # Add tasks to queue
-    for actor_tuple in actors:
-        task_queue.put(actor_tuple)
+    for task in tasks:
+        task_queue.put(task)
     
     # Add poison pills for workers
     num_processes = min(50, num_actors)  # Don't create more processes than actors
     for _ in range(num_processes):
         task_queue.put(None)
     
+    # One limiter shared by all workers sets the request rate
+    rate_limiter = RateLimiter(max_concurrency=num_processes)
+    metrics = Metrics(num_processes)
+    exporter = MetricsExporter(metrics, gauges={
+        "task_queue_depth": task_queue.qsize,
+        "result_queue_depth": result_queue.qsize,
+    }).start()
+
     # Start worker processes
     processes = []
     for i in range(num_processes):
-        p = Process(target=worker, args=(task_queue, result_queue, i+1, num_actors))
+        p = Process(target=worker, args=(task_queue, result_queue, i+1, num_actors, rate_limiter, metrics))
         p.start()
         processes.append(p)
     
     # Save results in the main process
-    successful, failed = save_results(result_queue, num_actors)
+    successful, failed = save_results(result_queue, num_actors, state, lambda: any(p.is_alive() for p in processes))
+    exporter.stop()
     
     # Wait for all processes to complete
     for p in processes:
         p.join()
+
+    remaining = state.remaining()
+    if remaining == 0:
+        state.finish_run()
+    else:
+        logger.warning(f"{remaining} actors are unfinished, rerun to resume the crawl")
     
     total_time = (datetime.now() - start_time).total_seconds()
     logger.info(f"Processing complete in {total_time/60:.1f} minutes:")
@@ -227,9 +590,46 @@ def main():
     logger.info(f"- Total: {num_actors}")
     if failed > 0:
         logger.warning(f"Failed to process {failed} actors")
+    return remaining == 0
+
+def profile_follows_counts(dids):
+    """(did, handle, follows_count) for each actor that still exists"""
+    for profile in get_profiles(dids):
+        yield profile["did"], profile["handle"], profile.get("followsCount", 0)
+
+def expand_second_hop(state):
+    """Crawl the follows of the accounts that follow most of the roots' follows, within the request budget"""
+    if not state.start_run("follows_dlt_expand", root_key):
+        seen = BloomFilter.load("follows_dlt_expand.bloom")
+        if delta_snapshots:
+            graph = FollowGraph.load_duckdb(EDGE_STORE_PATH, *SNAPSHOT_LISTS)
+        else:
+            graph = FollowGraph.load_duckdb(pipeline_name + ".duckdb", f"{dataset_name}.follows", f"{dataset_name}.followers")
+        dids = {}
+
+        def lookup(batch):
+            for did, handle, follows_count in profile_follows_counts(batch):
+                dids[handle] = did
+                yield did, handle, follows_count
+
+        plan = plan_expansion(rank_roots(graph, roots), lookup, seen, expand_budget, expand_max_pages)
+        state.add_actors(plan, sides=("follows",), max_pages=plan, dids=dids)
+        seen.save("follows_dlt_expand.bloom")
+    return run_crawl(state)
+
+def main():
+    state = CrawlState()
+    # An unfinished second hop is resumed before starting a fresh first hop
+    if not (expand_budget and state.resumable("follows_dlt_expand", root_key)):
+        # A crawl that died part way keeps its frontier, so only a fresh run asks the API for it
+        if not state.start_run("follows_dlt", root_key):
+            plan_first_hop(state)
+        if not run_crawl(state):
+            state.close()
+            return
+    if expand_budget:
+        expand_second_hop(state)
+    state.close()
 
 if __name__ == '__main__':
     main()
-
-# TODO: it would be good to find who the followers of people I follow are also following
-# and add that data to the follows table, but it is likely to be a lot of data and a huge number of API calls
\ No newline at end of file
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import duckdb
+import websockets
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Configuration
+jetstream_url = os.getenv("bsky_jetstream_url", "wss://jetstream2.us-east.bsky.network/subscribe")
+# Filtered by Jetstream itself, so unwanted commits never cross the wire
+wanted_collections = [c for c in os.getenv("bsky_jetstream_collections", "app.bsky.graph.follow").split(",") if c]
+# Events are appended to DuckDB once this many have arrived or the oldest has waited this long
+batch_size = int(os.getenv("bsky_jetstream_batch_size", "5000"))
+batch_seconds = float(os.getenv("bsky_jetstream_batch_seconds", "5"))
+database = os.getenv("bsky_jetstream_database", "bluesky.duckdb")
+
+# The event columns of bluesky.jetstream.jetstream; year, month, day and hour are derived from time_us
+EVENT_COLUMNS = {
+    "did": "VARCHAR",
+    "kind": "VARCHAR",
+    "time_us": "BIGINT",
+    "commit": "STRUCT(cid VARCHAR, collection VARCHAR, operation VARCHAR, record MAP(VARCHAR, JSON), rev VARCHAR, rkey VARCHAR)",
+    "identity": "STRUCT(did VARCHAR, handle VARCHAR, seq BIGINT, \"time\" VARCHAR)",
+    "account": "STRUCT(active BOOLEAN, did VARCHAR, seq BIGINT, \"time\" VARCHAR, status VARCHAR)",
+}
+
+COLUMNS_SQL = "{" + ", ".join(f"'{name}': '{type_}'" for name, type_ in EVENT_COLUMNS.items()) + "}"
+
+SETUP_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS jetstream;
+CREATE TABLE IF NOT EXISTS jetstream.jetstream (
+    {", ".join(f'"{name}" {type_}' for name, type_ in EVENT_COLUMNS.items())},
+    day BIGINT, hour BIGINT, month BIGINT, year BIGINT
+);
+CREATE TABLE IF NOT EXISTS jetstream.consumer_cursors (
+    consumer VARCHAR PRIMARY KEY,
+    time_us BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+"""
+
+NEW_EVENTS_SQL = """
+CREATE OR REPLACE TEMP TABLE new_events AS
+SELECT
+    *,
+    day(MAKE_TIMESTAMP(time_us)) AS day,
+    hour(MAKE_TIMESTAMP(time_us)) AS hour,
+    month(MAKE_TIMESTAMP(time_us)) AS month,
+    year(MAKE_TIMESTAMP(time_us)) AS year
+FROM jetstream_batch AS e
+WHERE time_us > $cursor
+  -- update_jetstream.sql can have imported events past the cursor from the catalog, and an event is unique by (did, time_us)
+  AND NOT EXISTS (
+      SELECT 1 FROM jetstream.jetstream AS j
+      WHERE j.time_us > $cursor AND j.did = e.did AND j.time_us = e.time_us
+  )
+-- A batch retried after a failed append can hold replayed copies of the same event
+QUALIFY ROW_NUMBER() OVER (PARTITION BY did, time_us) = 1
+"""
+
+# Shared with update_jetstream.sql: parses new_events into the typed per-collection tables
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "jetstream_tables.sql")) as f:
+    TYPED_TABLES_SQL = f.read()
+
+class JetstreamConsumer:
+    """Streams Jetstream events into bluesky.jetstream.jetstream and the typed per-collection tables in batches
+
+    Messages are kept as the raw JSON text they arrive in and parsed by
+    DuckDB's read_json when a batch is appended, so the receive loop does
+    almost no work per event. Each append and the consumer's cursor, the
+    largest time_us stored, are committed in one transaction. Reconnects
+    replay from that cursor and drop events at or before it, so there are
+    no gaps or duplicates across restarts. Events update_jetstream.sql has
+    already imported from the catalog are dropped too.
+    """
+
+    def __init__(self, url: str = jetstream_url, collections: Optional[List[str]] = None,
+                 database: str = database, batch_size: int = batch_size, batch_seconds: float = batch_seconds):
+        self.url = url
+        self.collections = sorted(collections if collections is not None else wanted_collections)
+        self.database = database
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.consumer = ",".join(self.collections) or "*"
+        self.cursor: Optional[int] = None
+        self.events_written = 0
+        self._buffer: List[str] = []
+        self._buffer_started = 0.0
+        self._flushing: Optional[asyncio.Task] = None
+
+    def connect_url(self) -> str:
+        params = [("wantedCollections", collection) for collection in self.collections]
+        if self.cursor is not None:
+            params.append(("cursor", str(self.cursor)))
+        return f"{self.url}?{urlencode(params)}" if params else self.url
+
+    def load_cursor(self):
+        con = duckdb.connect(self.database)
+        try:
+            con.execute(SETUP_SQL)
+            row = con.execute(
+                "SELECT time_us FROM jetstream.consumer_cursors WHERE consumer = ?", [self.consumer]
+            ).fetchone()
+        finally:
+            con.close()
+        self.cursor = row[0] if row else None
+        logger.info(f"Resuming {self.consumer} from time_us {self.cursor}" if row else f"Starting {self.consumer} live")
+
+    def _append(self, messages: List[str]) -> Optional[int]:
+        """Append one batch and advance the cursor in a single transaction, returning the new cursor"""
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as f:
+            f.write("\n".join(messages))
+            path = f.name
+        try:
+            con = duckdb.connect(self.database)
+            try:
+                # Lines that are not valid events are skipped rather than failing the whole batch
+                con.execute(
+                    f"CREATE TEMP TABLE jetstream_batch AS SELECT * FROM read_json('{path}', "
+                    f"format = 'newline_delimited', columns = {COLUMNS_SQL}, ignore_errors = true)"
+                )
+                previous = self.cursor if self.cursor is not None else -1
+                con.execute(NEW_EVENTS_SQL, {"cursor": previous})
+                con.execute("BEGIN TRANSACTION")
+                written = con.execute("INSERT INTO jetstream.jetstream BY NAME SELECT * FROM new_events").fetchone()[0]
+                con.execute("""
+                    INSERT OR REPLACE INTO jetstream.consumer_cursors
+                    SELECT ?, GREATEST(MAX(time_us), ?), now() FROM jetstream_batch
+                    HAVING MAX(time_us) IS NOT NULL
+                """, [self.consumer, previous])
+                cursor = con.execute(
+                    "SELECT time_us FROM jetstream.consumer_cursors WHERE consumer = ?", [self.consumer]
+                ).fetchone()
+                con.execute(TYPED_TABLES_SQL)
+                con.execute("COMMIT")
+            finally:
+                con.close()
+        finally:
+            os.remove(path)
+        self.events_written += written
+        return cursor[0] if cursor else self.cursor
+
+    async def flush(self):
+        """Start appending the buffered events once the previous append has finished"""
+        await self.wait_flushed()
+        if not self._buffer:
+            return
+        messages, self._buffer = self._buffer, []
+        self._flushing = asyncio.create_task(self._flush(messages))
+
+    async def _flush(self, messages: List[str]):
+        start_time = time.monotonic()
+        try:
+            self.cursor = await asyncio.to_thread(self._append, messages)
+        except duckdb.Error as e:
+            # The database is probably locked by another process; keep the events for the next append
+            logger.warning(f"Could not append {len(messages)} events, retrying with the next batch: {str(e)}")
+            self._buffer[:0] = messages
+            return
+        logger.info(f"Appended {len(messages)} events in {time.monotonic() - start_time:.2f}s, "
+                    f"{self.events_written} in total, cursor {self.cursor}")
+
+    async def wait_flushed(self):
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+
+    async def run(self):
+        """Consume forever, reconnecting with exponential backoff"""
+        await asyncio.to_thread(self.load_cursor)
+        backoff = 1.0
+        while True:
+            # Everything received so far is stored before asking for a replay from the cursor
+            await self.flush()
+            await self.wait_flushed()
+            url = self.connect_url()
+            try:
+                async with websockets.connect(url, max_size=None, ping_interval=20) as websocket:
+                    logger.info(f"Connected to {url}")
+                    backoff = 1.0
+                    await self._receive(websocket)
+            except (websockets.ConnectionClosed, OSError, asyncio.TimeoutError) as e:
+                logger.warning(f"Jetstream connection lost: {str(e)}, reconnecting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(60.0, backoff * 2)
+
+    async def _receive(self, websocket):
+        while True:
+            timeout = None
+            if self._buffer:
+                timeout = max(0.0, self._buffer_started + self.batch_seconds - time.monotonic())
+            try:
+                message = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.flush()
+                continue
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+            self._buffer.append(message if isinstance(message, str) else message.decode())
+            if len(self._buffer) >= self.batch_size:
+                await self.flush()
+
+def replay_server(path: str, host: str = "localhost", port: int = 6008):
+    """Serve the events in an ndjson file like Jetstream's /subscribe endpoint
+
+    Honours wantedCollections and cursor, then keeps the connection open like
+    a quiet live stream. Point bsky_jetstream_url at ws://localhost:6008/subscribe
+    to run the consumer against it. A file can be exported from the table with
+    COPY (SELECT * EXCLUDE (year, month, day, hour) FROM jetstream.jetstream) TO 'events.ndjson' (FORMAT JSON).
+    """
+    with open(path) as f:
+        events = [(json.loads(line), line.rstrip("\n")) for line in f if line.strip()]
+    logger.info(f"Replaying {len(events)} events from {path} on ws://{host}:{port}/subscribe")
+
+    async def handler(websocket, request_path=None):
+        request_path = request_path or getattr(websocket, "path", None) or websocket.request.path
+        query = parse_qs(urlparse(request_path).query)
+        collections = set(query.get("wantedCollections", []))
+        cursor = int(query["cursor"][0]) if "cursor" in query else None
+        sent = 0
+        for event, line in events:
+            if cursor is not None and event["time_us"] < cursor:
+                continue
+            if collections and event.get("kind") == "commit" and event["commit"]["collection"] not in collections:
+                continue
+            await websocket.send(line)
+            sent += 1
+        logger.info(f"Sent {sent} events from cursor {cursor}")
+        await websocket.wait_closed()
+
+    async def serve():
+        async with websockets.serve(handler, host, port, max_size=None):
+            await asyncio.Future()
+
+    asyncio.run(serve())
+
+def main():
+    """Consume Jetstream into bluesky.duckdb, or pass "replay <file.ndjson> [port]" to serve a recording"""
+    args = sys.argv[1:]
+    if args and args[0] == "replay":
+        replay_server(args[1], port=int(args[2]) if len(args) > 2 else 6008)
+        return
+    consumer = JetstreamConsumer()
+    try:
+        asyncio.run(consumer.run())
+    except KeyboardInterrupt:
+        logger.info(f"Stopped after appending {consumer.events_written} events, cursor {consumer.cursor}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+/* Parses the commits in the temp table new_events into typed per-collection tables.
+Run in the transaction that appends new_events to jetstream.jetstream, by update_jetstream.sql
+and by jetstream_consumer.py, so the typed tables always hold exactly the raw table's commits.
+Each record is parsed once here instead of on every model run. Rows are inserted in time_us
+order, which keeps the year/month/day/hour and ts zonemaps tight for pruning.
+
+To backfill the typed tables from the whole raw table once:
+duckdb bluesky.duckdb -c "create temp table new_events as select * from jetstream.jetstream" -c ".read jetstream_tables.sql" */
+
+create schema if not exists jetstream;
+
+create table if not exists jetstream.follows (
+    did varchar, time_us bigint, ts timestamp, operation varchar, rkey varchar, cid varchar,
+    created_at timestamp, subject_did varchar, bsky_subject_url varchar,
+    year bigint, month bigint, day bigint, hour bigint
+);
+create table if not exists jetstream.likes (
+    did varchar, time_us bigint, ts timestamp, operation varchar, rkey varchar, cid varchar,
+    created_at timestamp, subject_uri varchar, subject_did varchar, subject_collection varchar,
+    subject_rkey varchar, bsky_subject_url varchar,
+    year bigint, month bigint, day bigint, hour bigint
+);
+create table if not exists jetstream.reposts (
+    did varchar, time_us bigint, ts timestamp, operation varchar, rkey varchar, cid varchar,
+    created_at timestamp, subject_uri varchar, subject_did varchar, subject_collection varchar,
+    subject_rkey varchar, bsky_subject_url varchar,
+    year bigint, month bigint, day bigint, hour bigint
+);
+-- A post's subject is the post it replies to, if any
+create table if not exists jetstream.posts (
+    did varchar, time_us bigint, ts timestamp, operation varchar, rkey varchar, cid varchar,
+    created_at timestamp, text varchar, bsky_url varchar, reply_root_uri varchar, subject_uri varchar,
+    subject_did varchar, subject_collection varchar, subject_rkey varchar, bsky_subject_url varchar,
+    year bigint, month bigint, day bigint, hour bigint
+);
+
+-- at://<did>/<collection>/<rkey> -> https://bsky.app/profile/<did>/<post|like|...>/<rkey>
+create or replace temp macro bsky_url(uri) as
+    'https://bsky.app/profile/' || split_part(uri, '/', 3) || '/'
+    || split_part(split_part(uri, '/', 4), '.', -1) || '/' || split_part(uri, '/', 5);
+
+-- map_extract returns a list on every DuckDB version; deletes have no record, so their fields are null
+create or replace temp table new_commits as
+select
+    did,
+    time_us,
+    make_timestamp(time_us) as ts,
+    "commit".collection as collection,
+    "commit".operation as operation,
+    "commit".rkey as rkey,
+    "commit".cid as cid,
+    try_strptime(map_extract("commit".record, 'createdAt')[1] ->> '$', '%Y-%m-%dT%H:%M:%S.%gZ') as created_at,
+    map_extract("commit".record, 'subject')[1] as subject,
+    year, month, day, hour,
+    "commit".record as record
+from new_events
+where kind = 'commit'
+  and "commit".collection in ('app.bsky.graph.follow', 'app.bsky.feed.like', 'app.bsky.feed.repost', 'app.bsky.feed.post')
+order by time_us;
+
+insert into jetstream.follows by name
+select
+    * exclude (collection, subject, record),
+    subject ->> '$' as subject_did,
+    'https://bsky.app/profile/' || (subject ->> '$') as bsky_subject_url
+from new_commits
+where collection = 'app.bsky.graph.follow';
+
+insert into jetstream.likes by name
+select
+    * exclude (collection, subject, record),
+    split_part(subject_uri, '/', 3) as subject_did,
+    split_part(subject_uri, '/', 4) as subject_collection,
+    split_part(subject_uri, '/', 5) as subject_rkey,
+    bsky_url(subject_uri) as bsky_subject_url
+from (select *, subject ->> '$.uri' as subject_uri from new_commits where collection = 'app.bsky.feed.like');
+
+insert into jetstream.reposts by name
+select
+    * exclude (collection, subject, record),
+    split_part(subject_uri, '/', 3) as subject_did,
+    split_part(subject_uri, '/', 4) as subject_collection,
+    split_part(subject_uri, '/', 5) as subject_rkey,
+    bsky_url(subject_uri) as bsky_subject_url
+from (select *, subject ->> '$.uri' as subject_uri from new_commits where collection = 'app.bsky.feed.repost');
+
+insert into jetstream.posts by name
+select
+    * exclude (collection, subject, record, reply),
+    map_extract(record, 'text')[1] ->> '$' as text,
+    bsky_url('at://' || did || '/app.bsky.feed.post/' || rkey) as bsky_url,
+    reply ->> '$.root.uri' as reply_root_uri,
+    split_part(subject_uri, '/', 3) as subject_did,
+    split_part(subject_uri, '/', 4) as subject_collection,
+    split_part(subject_uri, '/', 5) as subject_rkey,
+    bsky_url(subject_uri) as bsky_subject_url
+from (
+    select *, map_extract(record, 'reply')[1] as reply, map_extract(record, 'reply')[1] ->> '$.parent.uri' as subject_uri
+    from new_commits
+    where collection = 'app.bsky.feed.post'
+);
+
+drop table new_commits;
@@ -0,0 +1,171 @@
+import glob
+import logging
+import os
+import sys
+import time
+from typing import List
+
+import duckdb
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+POND = "pond"
+DATABASE = "bluesky.duckdb"
+SIDES = ("follows", "followers")
+# dlt names its schema after the pipeline, and the models only read loads of that schema's tables
+SCHEMA_NAME = "bluesky"
+
+SETUP_SQL = """
+CREATE SCHEMA IF NOT EXISTS raw_http;
+CREATE TABLE IF NOT EXISTS raw_http._dlt_loads (
+    load_id VARCHAR NOT NULL,
+    schema_name VARCHAR,
+    status BIGINT NOT NULL,
+    inserted_at TIMESTAMPTZ NOT NULL,
+    schema_version_hash VARCHAR
+);
+-- Every pond file that has been loaded, so reruns only load new files
+CREATE TABLE IF NOT EXISTS raw_http._pond_files (
+    side VARCHAR NOT NULL,
+    filename VARCHAR NOT NULL,
+    rows BIGINT NOT NULL,
+    load_id VARCHAR NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (side, filename)
+);
+-- The latest crawl run loaded for each actor, which compacted files are checked against
+CREATE TABLE IF NOT EXISTS raw_http._pond_actor_runs (
+    side VARCHAR NOT NULL,
+    actor VARCHAR NOT NULL,
+    crawl_run BIGINT NOT NULL,
+    PRIMARY KEY (side, actor)
+);
+"""
+
+# The columns external_models.yaml declares for raw_http.follows and raw_http.followers
+RAW_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS raw_http.{side} (
+    did VARCHAR,
+    handle VARCHAR,
+    display_name VARCHAR,
+    avatar VARCHAR,
+    created_at TIMESTAMPTZ,
+    description VARCHAR,
+    indexed_at TIMESTAMPTZ,
+    actor VARCHAR,
+    _dlt_load_id VARCHAR NOT NULL,
+    _dlt_id VARCHAR NOT NULL,
+    associated__chat__allow_incoming VARCHAR,
+    associated__labeler BOOLEAN,
+    change_type VARCHAR
+);
+-- Tables dlt created before loads had a change_type lack it
+ALTER TABLE raw_http.{side} ADD COLUMN IF NOT EXISTS change_type VARCHAR
+"""
+
+# Compacted files copy rows from part files, so only the actors whose latest crawl run was
+# compacted before it was loaded are taken from them
+BATCH_SQL = """
+CREATE OR REPLACE TEMP TABLE pond_batch AS
+SELECT p.*
+FROM read_parquet([{files}], hive_partitioning = true, filename = true) AS p
+LEFT JOIN raw_http._pond_actor_runs AS r
+    ON r.side = '{side}' AND r.actor = p.actor
+WHERE p.filename NOT LIKE '%/compacted-%'
+    OR p.crawl_run > COALESCE(r.crawl_run, -1)
+"""
+
+INSERT_SQL = """
+INSERT INTO raw_http.{side} (
+    did, handle, display_name, avatar, created_at, description, indexed_at, actor, _dlt_load_id, _dlt_id,
+    associated__chat__allow_incoming, associated__labeler, change_type
+)
+SELECT
+    did,
+    handle,
+    display_name,
+    avatar,
+    TRY_CAST(created_at AS TIMESTAMPTZ),
+    description,
+    TRY_CAST(indexed_at AS TIMESTAMPTZ),
+    actor,
+    $load_id,
+    -- dlt's row ids are random too; nothing joins on them
+    GEN_RANDOM_UUID()::VARCHAR,
+    associated__chat__allow_incoming,
+    associated__labeler,
+    'snapshot'
+FROM pond_batch
+"""
+
+ACTOR_RUNS_SQL = """
+INSERT INTO raw_http._pond_actor_runs
+SELECT $side, actor, MAX(crawl_run) FROM pond_batch GROUP BY actor
+ON CONFLICT (side, actor) DO UPDATE SET crawl_run = GREATEST(crawl_run, excluded.crawl_run)
+"""
+
+def new_files(con, pond: str, side: str) -> List[str]:
+    """Pond files of a side that are not in the manifest; files still being written end in .inprogress"""
+    loaded = {row[0] for row in con.execute("SELECT filename FROM raw_http._pond_files WHERE side = ?", [side]).fetchall()}
+    return [path for path in sorted(glob.glob(os.path.join(pond, side, "*", "*", "*.parquet"))) if path not in loaded]
+
+def load_side(con, pond: str, side: str, load_id: str) -> int:
+    """Load the new files of one side of the pond into raw_http.<side>, returning the rows loaded"""
+    files = new_files(con, pond, side)
+    if not files:
+        logger.info(f"No new files in {os.path.join(pond, side)}")
+        return 0
+    start_time = time.monotonic()
+    file_list = ", ".join("'" + path.replace("'", "''") + "'" for path in files)
+    con.execute(RAW_TABLE_SQL.format(side=side))
+    con.execute(BATCH_SQL.format(files=file_list, side=side))
+    try:
+        con.execute(INSERT_SQL.format(side=side), {"load_id": load_id})
+        con.execute(ACTOR_RUNS_SQL, {"side": side})
+        rows_by_file = dict(con.execute("SELECT filename, COUNT(*) FROM pond_batch GROUP BY filename").fetchall())
+        con.executemany(
+            "INSERT INTO raw_http._pond_files VALUES (?, ?, ?, ?, now())",
+            [(side, path, rows_by_file.get(path, 0), load_id) for path in files],
+        )
+    finally:
+        con.execute("DROP TABLE pond_batch")
+    rows = sum(rows_by_file.values())
+    logger.info(f"Loaded {rows} rows from {len(files)} files into raw_http.{side} in {time.monotonic() - start_time:.1f}s")
+    return rows
+
+def load_pond(con, pond: str = POND, sides=SIDES) -> int:
+    """Load every side's new pond files in one transaction under one load id, recorded like a dlt load"""
+    con.execute(SETUP_SQL)
+    # Load ids are unix timestamps, which the incremental models turn into their time column
+    load_id = f"{time.time():.7f}"
+    con.execute("BEGIN TRANSACTION")
+    try:
+        rows = sum(load_side(con, pond, side, load_id) for side in sides)
+        if rows:
+            con.execute(
+                "INSERT INTO raw_http._dlt_loads VALUES (?, ?, 0, now(), "
+                "(SELECT schema_version_hash FROM raw_http._dlt_loads ORDER BY inserted_at DESC LIMIT 1))",
+                [load_id, SCHEMA_NAME],
+            )
+        con.execute("COMMIT")
+    except duckdb.Error:
+        con.execute("ROLLBACK")
+        raise
+    return rows
+
+def main():
+    """Load the pond files follows.py wrote since the last load into bluesky.duckdb for the SQLMesh models"""
+    sides = sys.argv[1:] or SIDES
+    con = duckdb.connect(DATABASE)
+    try:
+        rows = load_pond(con, POND, sides)
+    finally:
+        con.close()
+    logger.info(f"Loaded {rows} rows in total")
+
+if __name__ == '__main__':
+    main()
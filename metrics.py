@@ -0,0 +1,251 @@
+import json
+import logging
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = (
+    "app.bsky.graph.getFollows",
+    "app.bsky.graph.getFollowers",
+    "app.bsky.actor.getProfiles",
+    "other",
+)
+OUTCOMES = ("ok", "throttled", "client_error", "server_error", "network_error")
+# Upper bounds in seconds of the latency histogram buckets, the last one catching everything
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+COUNTERS = ("pages", "records", "retries", "cache_hits")
+
+# Where and how often the crawlers publish their metrics; a port of 0 disables the Prometheus endpoint
+METRICS_FILE = os.getenv("bsky_metrics_file", "crawl_metrics.json")
+METRICS_PORT = int(os.getenv("bsky_metrics_port", "0"))
+METRICS_INTERVAL = float(os.getenv("bsky_metrics_interval", "30"))
+
+def outcome(status: Optional[int]) -> str:
+    if status is None:
+        return "network_error"
+    if status == 429:
+        return "throttled"
+    if status >= 500:
+        return "server_error"
+    if status >= 400:
+        return "client_error"
+    return "ok"
+
+class Metrics:
+    """Crawl counters, per-endpoint latency histograms and worker heartbeats
+
+    Like RateLimiter, everything lives in shared memory guarded by one lock,
+    so a single instance created by the main process is updated by every
+    worker process, thread and asyncio task. Workers heartbeat in their own
+    slot every time they start an actor or store a page, so a worker whose
+    heartbeat is old is stuck rather than busy.
+    """
+
+    def __init__(self, num_workers: int = 1):
+        self.num_workers = num_workers
+        self._lock = mp.Lock()
+        self._started_at = mp.Value('d', time.time(), lock=False)
+        self._requests = mp.Array('q', len(ENDPOINTS) * len(OUTCOMES), lock=False)
+        self._buckets = mp.Array('q', len(ENDPOINTS) * len(LATENCY_BUCKETS), lock=False)
+        self._latency_sum = mp.Array('d', len(ENDPOINTS), lock=False)
+        self._counters = mp.Array('q', len(COUNTERS), lock=False)
+        self._heartbeats = mp.Array('d', [time.time()] * max(1, num_workers), lock=False)
+
+    def observe_request(self, endpoint: str, seconds: float, status: Optional[int]):
+        """Record one HTTP request: its latency and how it ended"""
+        e = ENDPOINTS.index(endpoint) if endpoint in ENDPOINTS else len(ENDPOINTS) - 1
+        bucket = next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+        with self._lock:
+            self._requests[e * len(OUTCOMES) + OUTCOMES.index(outcome(status))] += 1
+            self._buckets[e * len(LATENCY_BUCKETS) + bucket] += 1
+            self._latency_sum[e] += seconds
+
+    def increment(self, counter: str, value: int = 1):
+        with self._lock:
+            self._counters[COUNTERS.index(counter)] += value
+
+    def record_page(self, records: int, worker: Optional[int] = None):
+        """Count a fetched page and heartbeat for the worker that fetched it"""
+        with self._lock:
+            self._counters[COUNTERS.index("pages")] += 1
+            self._counters[COUNTERS.index("records")] += records
+        if worker is not None:
+            self.heartbeat(worker)
+
+    def heartbeat(self, worker: int):
+        self._heartbeats[worker % len(self._heartbeats)] = time.time()
+
+    def last_heartbeat(self, worker: int) -> float:
+        return self._heartbeats[worker % len(self._heartbeats)]
+
+    @staticmethod
+    def _quantile(buckets, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding quantile q"""
+        total = sum(buckets)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(LATENCY_BUCKETS, buckets):
+            running += count
+            if running >= q * total:
+                return bound if bound != math.inf else LATENCY_BUCKETS[-2]
+        return None
+
+    def snapshot(self, gauges: Optional[Dict[str, float]] = None) -> Dict:
+        """Consistent copy of every metric, with rates since the crawl started"""
+        with self._lock:
+            requests = list(self._requests)
+            buckets = list(self._buckets)
+            latency_sum = list(self._latency_sum)
+            counters = dict(zip(COUNTERS, self._counters))
+            heartbeats = list(self._heartbeats)
+        now = time.time()
+        elapsed = max(1e-9, now - self._started_at.value)
+
+        endpoints = {}
+        for e, endpoint in enumerate(ENDPOINTS):
+            by_outcome = dict(zip(OUTCOMES, requests[e * len(OUTCOMES):(e + 1) * len(OUTCOMES)]))
+            endpoint_buckets = buckets[e * len(LATENCY_BUCKETS):(e + 1) * len(LATENCY_BUCKETS)]
+            count = sum(by_outcome.values())
+            if not count:
+                continue
+            endpoints[endpoint] = {
+                "requests": count,
+                **by_outcome,
+                "latency_mean": latency_sum[e] / count,
+                "latency_p50": self._quantile(endpoint_buckets, 0.5),
+                "latency_p90": self._quantile(endpoint_buckets, 0.9),
+                "latency_p99": self._quantile(endpoint_buckets, 0.99),
+                "latency_buckets": dict(zip(map(str, LATENCY_BUCKETS), endpoint_buckets)),
+            }
+
+        return {
+            "time": now,
+            "elapsed_seconds": elapsed,
+            **counters,
+            "pages_per_second": counters["pages"] / elapsed,
+            "records_per_second": counters["records"] / elapsed,
+            "endpoints": endpoints,
+            "heartbeat_age_seconds": [now - beat for beat in heartbeats],
+            **(gauges or {}),
+        }
+
+    def prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """The snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot(gauges)
+        lines = []
+        for counter in COUNTERS:
+            lines.append(f"# TYPE bsky_crawl_{counter}_total counter")
+            lines.append(f"bsky_crawl_{counter}_total {snapshot[counter]}")
+        lines.append("# TYPE bsky_crawl_requests_total counter")
+        for endpoint, stats in snapshot["endpoints"].items():
+            for name in OUTCOMES:
+                lines.append(f'bsky_crawl_requests_total{{endpoint="{endpoint}",outcome="{name}"}} {stats[name]}')
+        lines.append("# TYPE bsky_crawl_request_seconds histogram")
+        for endpoint, stats in snapshot["endpoints"].items():
+            running = 0
+            for bound, count in stats["latency_buckets"].items():
+                running += count
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'bsky_crawl_request_seconds_bucket{{endpoint="{endpoint}",le="{le}"}} {running}')
+            lines.append(f'bsky_crawl_request_seconds_sum{{endpoint="{endpoint}"}} {stats["latency_mean"] * stats["requests"]}')
+            lines.append(f'bsky_crawl_request_seconds_count{{endpoint="{endpoint}"}} {stats["requests"]}')
+        lines.append("# TYPE bsky_crawl_heartbeat_age_seconds gauge")
+        for worker, age in enumerate(snapshot["heartbeat_age_seconds"]):
+            lines.append(f'bsky_crawl_heartbeat_age_seconds{{worker="{worker + 1}"}} {age:.3f}')
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE bsky_crawl_{name} gauge")
+            lines.append(f"bsky_crawl_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One log line with the rates and the latency of the busiest endpoints"""
+        snapshot = self.snapshot()
+        parts = [f"{snapshot['pages_per_second']:.1f} pages/s", f"{snapshot['records_per_second']:.0f} records/s"]
+        for endpoint, stats in snapshot["endpoints"].items():
+            parts.append(f"{endpoint.rsplit('.', 1)[-1]} {stats['requests']} requests "
+                         f"p50 {stats['latency_p50']}s p99 {stats['latency_p99']}s "
+                         f"{stats['throttled']} throttled {stats['server_error'] + stats['network_error']} failed")
+        return ", ".join(parts)
+
+class MetricsExporter:
+    """Publishes a Metrics instance from the main process
+
+    Every interval seconds the snapshot is written to path as JSON, if a path
+    is given. With a port, /metrics serves it in the Prometheus text format.
+    gauges are sampled at export time, e.g. queue depths.
+    """
+
+    def __init__(self, metrics: Metrics, path: Optional[str] = METRICS_FILE, port: int = METRICS_PORT,
+                 interval: float = METRICS_INTERVAL,
+                 gauges: Optional[Dict[str, Callable[[], float]]] = None):
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.gauges = gauges or {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def sample_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, read in self.gauges.items():
+            try:
+                values[name] = read()
+            except (NotImplementedError, OSError):
+                # Queue.qsize() is not available on every platform
+                pass
+        return values
+
+    def write(self):
+        if not self.path:
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.metrics.snapshot(self.sample_gauges()), f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+            logger.info(f"Metrics: {self.metrics.summary()}")
+
+    def start(self) -> "MetricsExporter":
+        if self.port:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = exporter.metrics.prometheus(exporter.sample_gauges()).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("0.0.0.0", self.port), Handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            logger.info(f"Serving Prometheus metrics on port {self.port}")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Write a final snapshot and stop exporting"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self.write()
+        logger.info(f"Metrics: {self.metrics.summary()}")
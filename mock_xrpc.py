@@ -0,0 +1,236 @@
+import argparse
+import bisect
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class SyntheticGraph:
+    """Deterministic follow graph with Zipf-skewed popularity and follow counts
+
+    Account 0 is the root and follows root_follows accounts. Whom an account
+    follows is drawn with probability proportional to 1 / (rank + 1) ** skew,
+    so a few accounts collect most of the followers, and how many it follows
+    is skewed the same way around mean_follows.
+    """
+
+    def __init__(self, accounts: int = 2000, mean_follows: int = 50, skew: float = 1.1,
+                 max_follows: int = 5000, root_follows: int = 200, seed: int = 42):
+        rng = random.Random(seed)
+        self.accounts = accounts
+        weights = [1.0 / (rank + 1) ** skew for rank in range(accounts)]
+        # Shuffle popularity so the root is not automatically the most followed account
+        rng.shuffle(weights)
+        cumulative = list(itertools.accumulate(weights))
+        scale = mean_follows / (sum(weights) / accounts)
+
+        self.follows: List[List[int]] = []
+        for account in range(accounts):
+            if account == 0:
+                count = min(root_follows, accounts - 1)
+            else:
+                count = min(max_follows, accounts - 1, max(1, int(rng.expovariate(1.0) * weights[account] * scale)))
+            chosen = set()
+            attempts = 0
+            while len(chosen) < count:
+                # Sampling rare accounts by weight stalls, so top up with uniform picks
+                if attempts < 4 * count:
+                    target = bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+                else:
+                    target = rng.randrange(accounts)
+                attempts += 1
+                if target != account:
+                    chosen.add(target)
+            self.follows.append(sorted(chosen))
+
+        self.followers: List[List[int]] = [[] for _ in range(accounts)]
+        for account, targets in enumerate(self.follows):
+            for target in targets:
+                self.followers[target].append(account)
+
+        epoch = datetime(2023, 2, 1)
+        self.created_at = [(epoch + timedelta(minutes=rng.randrange(800_000))).isoformat() + ".000Z"
+                           for _ in range(accounts)]
+        self.num_edges = sum(len(targets) for targets in self.follows)
+
+    @staticmethod
+    def did(account: int) -> str:
+        return f"did:plc:bench{account:019d}"
+
+    @staticmethod
+    def handle(account: int) -> str:
+        return f"user{account}.bench.test"
+
+    def lookup(self, actor: str) -> Optional[int]:
+        """Account for a handle or DID, or None when it does not exist"""
+        try:
+            if actor.startswith("did:plc:bench"):
+                account = int(actor[len("did:plc:bench"):])
+            elif actor.startswith("user") and actor.endswith(".bench.test"):
+                account = int(actor[len("user"):-len(".bench.test")])
+            else:
+                return None
+        except ValueError:
+            return None
+        return account if 0 <= account < self.accounts else None
+
+    def profile(self, account: int, detailed: bool = False) -> Dict:
+        profile = {
+            "did": self.did(account),
+            "handle": self.handle(account),
+            "displayName": f"User {account}",
+            "avatar": f"https://cdn.bench.test/avatar/{account}.jpg",
+            "description": f"Synthetic account {account}",
+            "createdAt": self.created_at[account],
+            "indexedAt": self.created_at[account],
+            "labels": [],
+        }
+        if account % 7 == 0:
+            profile["associated"] = {"chat": {"allowIncoming": "following"}, "labeler": False}
+        if detailed:
+            profile["followersCount"] = len(self.followers[account])
+            profile["followsCount"] = len(self.follows[account])
+            profile["postsCount"] = 0
+        return profile
+
+class MockXrpcServer(ThreadingHTTPServer):
+    """Serves getFollows, getFollowers and getProfiles for a SyntheticGraph
+
+    Every request sleeps for latency_ms (exponentially distributed around
+    it) and a fraction error_rate of requests is answered with a 429 and a
+    Retry-After header. Counters for pages and records served can be read
+    and reset between benchmark runs.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, graph: SyntheticGraph, host: str = "127.0.0.1", port: int = 0,
+                 latency_ms: float = 0.0, error_rate: float = 0.0, retry_after: float = 1.0, seed: int = 42):
+        super().__init__((host, port), MockXrpcHandler)
+        self.graph = graph
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = {"requests": 0, "pages": 0, "records": 0, "profiles": 0, "throttled": 0}
+
+    def count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def draw(self):
+        """(latency in seconds, whether to throttle) for one request"""
+        with self._lock:
+            latency = self._rng.expovariate(1000.0 / self.latency_ms) if self.latency_ms > 0 else 0.0
+            return latency, self._rng.random() < self.error_rate
+
+class MockXrpcHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients pool connections like they do against the real API
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        server: MockXrpcServer = self.server
+        url = urlparse(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params = parse_qs(url.query)
+        server.count(requests=1)
+
+        latency, throttle = server.draw()
+        if latency:
+            time.sleep(latency)
+        if throttle:
+            server.count(throttled=1)
+            reset = int(time.time() + server.retry_after)
+            self._send(429, {"error": "RateLimitExceeded", "message": "Rate Limit Exceeded"}, {
+                "Retry-After": str(server.retry_after),
+                "ratelimit-remaining": "0",
+                "ratelimit-reset": str(reset),
+            })
+            return
+
+        graph = server.graph
+        if method in ("app.bsky.graph.getFollows", "app.bsky.graph.getFollowers"):
+            account = graph.lookup(params.get("actor", [""])[0])
+            if account is None:
+                self._send(400, {"error": "InvalidRequest", "message": "Profile not found"})
+                return
+            limit = min(100, int(params.get("limit", ["50"])[0]))
+            start = int(params.get("cursor", ["0"])[0])
+            key = "follows" if method.endswith("getFollows") else "followers"
+            neighbours = (graph.follows if key == "follows" else graph.followers)[account]
+            page = neighbours[start:start + limit]
+            body = {"subject": graph.profile(account), key: [graph.profile(n) for n in page]}
+            if start + limit < len(neighbours):
+                body["cursor"] = str(start + limit)
+            server.count(pages=1, records=len(page))
+            self._send(200, body)
+        elif method == "app.bsky.actor.getProfiles":
+            accounts = [graph.lookup(actor) for actor in params.get("actors", [])[:25]]
+            profiles = [graph.profile(account, detailed=True) for account in accounts if account is not None]
+            server.count(profiles=len(profiles))
+            self._send(200, {"profiles": profiles})
+        else:
+            self._send(501, {"error": "MethodNotImplemented", "message": f"{method} is not mocked"})
+
+def main():
+    """Serve a synthetic graph; crawl it with bsky_api_url=<printed url> bsky_actor=user0.bench.test"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--accounts", type=int, default=2000)
+    parser.add_argument("--mean-follows", type=int, default=50)
+    parser.add_argument("--root-follows", type=int, default=200)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(args.accounts, args.mean_follows, args.skew, root_follows=args.root_follows, seed=args.seed)
+    server = MockXrpcServer(graph, port=args.port, latency_ms=args.latency_ms, error_rate=args.error_rate, seed=args.seed)
+    logger.info(f"Serving {graph.accounts} accounts and {graph.num_edges} follows on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
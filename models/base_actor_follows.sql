@@ -6,10 +6,16 @@ MODEL (
   )
 );
 
+/* The follows of every base actor in the comma separated @bsky_actors, tagged with that root */
 SELECT DISTINCT
+  actor AS root,
   did,
   handle,
   display_name
 FROM raw_http_sqlmesh.incremental_follows
 WHERE
-  actor = @bsky_actor
\ No newline at end of file
+  actor IN (
+    SELECT
+      TRIM(UNNEST(STRING_SPLIT(@bsky_actors, ',')))
+  )
+  AND is_active
\ No newline at end of file
@@ -0,0 +1,93 @@
+MODEL (
+  name raw_http_sqlmesh.candidate_scores,
+  kind FULL,
+  grain (root, did),
+  references (
+    raw_http_sqlmesh.base_actor_follows,
+    raw_http_sqlmesh.base_actor_followers,
+    raw_http_sqlmesh.incremental_follows,
+    raw_http_sqlmesh.incremental_followers
+  ),
+  audits (UNIQUE_COMBINATION_OF_COLUMNS(columns := (root, did)))
+);
+
+WITH base AS (
+  /* Every handle in a base actor's follows or followers, flagged by the list it is in */
+  SELECT
+    root,
+    handle,
+    BOOL_OR(in_follows) AS in_follows,
+    BOOL_OR(NOT in_follows) AS in_followers
+  FROM (
+    SELECT
+      root,
+      handle,
+      TRUE AS in_follows
+    FROM raw_http_sqlmesh.base_actor_follows
+    UNION ALL
+    SELECT
+      root,
+      handle,
+      FALSE AS in_follows
+    FROM raw_http_sqlmesh.base_actor_followers
+  )
+  GROUP BY
+    root,
+    handle
+), edges AS (
+  /* One scan of each table finds the accounts followed by or following anyone in either list of any root;
+  an actor shared by several roots' neighbourhoods is read once and counted for each of them */
+  SELECT
+    b.root,
+    f.did,
+    f.handle,
+    f.display_name,
+    f.actor,
+    'follows' AS side,
+    b.in_follows,
+    b.in_followers
+  FROM raw_http_sqlmesh.incremental_follows AS f
+  INNER JOIN base AS b
+    ON b.handle = f.actor
+  WHERE
+    f.is_active
+  UNION ALL
+  SELECT
+    b.root,
+    f.did,
+    f.handle,
+    f.display_name,
+    f.actor,
+    'followers' AS side,
+    b.in_follows,
+    b.in_followers
+  FROM raw_http_sqlmesh.incremental_followers AS f
+  INNER JOIN base AS b
+    ON b.handle = f.actor
+  WHERE
+    f.is_active
+), already_followed AS (
+  SELECT DISTINCT
+    root,
+    did
+  FROM raw_http_sqlmesh.base_actor_follows
+)
+/* Count, per root and candidate, how many accounts in each of the root's lists point at it */
+SELECT
+  e.root,
+  e.did,
+  ANY_VALUE(e.handle) AS handle,
+  ANY_VALUE(e.display_name) AS display_name,
+  COUNT(DISTINCT e.actor) FILTER (WHERE e.side = 'follows' AND e.in_follows) AS follows_of_follows,
+  COUNT(DISTINCT e.actor) FILTER (WHERE e.side = 'followers' AND e.in_follows) AS followers_of_follows,
+  COUNT(DISTINCT e.actor) FILTER (WHERE e.side = 'follows' AND e.in_followers) AS follows_of_followers,
+  COUNT(DISTINCT e.actor) FILTER (WHERE e.side = 'followers' AND e.in_followers) AS followers_of_followers
+FROM edges AS e
+/* Hash anti-join on root and did excludes accounts each root already follows, and the root itself */
+LEFT JOIN already_followed AS a
+  ON a.root = e.root AND a.did = e.did
+WHERE
+  a.did IS NULL AND e.handle <> e.root
+GROUP BY
+  e.root,
+  e.did
\ No newline at end of file
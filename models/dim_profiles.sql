@@ -1,29 +1,87 @@
 MODEL (
   name raw_http_sqlmesh.dim_profiles,
-  kind VIEW,
-  references (raw_http_sqlmesh.incremental_followers, raw_http_sqlmesh.incremental_follows)
+  kind INCREMENTAL_BY_UNIQUE_KEY (
+    unique_key did
+  ),
+  grain did,
+  columns (
+    did TEXT,
+    handle TEXT,
+    display_name TEXT,
+    avatar TEXT,
+    description TEXT,
+    indexed_at TIMESTAMP,
+    content_hash TEXT
+  ),
+  references (raw_http_sqlmesh.incremental_followers, raw_http_sqlmesh.incremental_follows),
+  audits (UNIQUE_VALUES(columns := (did)))
 );
 
-SELECT DISTINCT
-  did,
-  handle,
-  display_name,
-  avatar,
-  description
-FROM (
+WITH loaded AS (
+  /* Profiles seen in edges loaded during this interval */
   SELECT
     did,
     handle,
     display_name,
     avatar,
-    description
+    description,
+    indexed_at,
+    _dlt_load_time
   FROM raw_http_sqlmesh.incremental_followers
+  WHERE
+    _dlt_load_time BETWEEN @start_ts AND @end_ts
+    /* Unfollows only carry the did and handle */
+    AND change_type IS DISTINCT FROM 'removed'
   UNION ALL
   SELECT
     did,
     handle,
     display_name,
     avatar,
-    description
+    description,
+    indexed_at,
+    _dlt_load_time
   FROM raw_http_sqlmesh.incremental_follows
-)
\ No newline at end of file
+  WHERE
+    _dlt_load_time BETWEEN @start_ts AND @end_ts
+    /* Unfollows only carry the did and handle */
+    AND change_type IS DISTINCT FROM 'removed'
+), latest AS (
+  /* One row per person with their most recently indexed attributes */
+  SELECT
+    did,
+    handle,
+    display_name,
+    avatar,
+    description,
+    indexed_at,
+    MD5(
+      CONCAT_WS(
+        CHR(31),
+        COALESCE(handle, ''),
+        COALESCE(display_name, ''),
+        COALESCE(avatar, ''),
+        COALESCE(description, '')
+      )
+    ) AS content_hash
+  FROM loaded
+  QUALIFY
+    ROW_NUMBER() OVER (PARTITION BY did ORDER BY indexed_at DESC, _dlt_load_time DESC) = 1
+)
+/* Only new people and changed, newer profiles are merged into the table */
+SELECT
+  l.did::TEXT AS did,
+  l.handle::TEXT AS handle,
+  l.display_name::TEXT AS display_name,
+  l.avatar::TEXT AS avatar,
+  l.description::TEXT AS description,
+  l.indexed_at::TIMESTAMP AS indexed_at,
+  l.content_hash::TEXT AS content_hash
+FROM latest AS l
+LEFT JOIN raw_http_sqlmesh.dim_profiles AS p
+  ON p.did = l.did
+WHERE
+  p.did IS NULL
+  OR (
+    p.content_hash <> l.content_hash AND l.indexed_at >= p.indexed_at
+  )
\ No newline at end of file
@@ -19,6 +19,9 @@ SELECT
   _dlt_id::TEXT AS _dlt_id,
   associated__chat__allow_incoming::TEXT AS associated__chat__allow_incoming,
   associated__labeler::BOOLEAN AS associated__labeler,
+  change_type::TEXT AS change_type,
+  /* Whole-list loads have change_type 'snapshot'; with delta snapshots an unfollow arrives as 'removed' */
+  change_type IS DISTINCT FROM 'removed' AS is_active,
   TO_TIMESTAMP(_dlt_load_id::DOUBLE) AS _dlt_load_time
 FROM raw_http.followers
 WHERE
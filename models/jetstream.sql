@@ -7,16 +7,41 @@ MODEL (
   cron '@hourly'
 );
 
+/* Records are parsed once at ingest by jetstream_tables.sql. The typed tables are stored in time order,
+so the filter on ts skips every row group outside the interval */
+WITH commits AS (
+  SELECT
+    'app.bsky.graph.follow' AS collection,
+    *
+  FROM bluesky.jetstream.follows
+  UNION ALL BY NAME
+  SELECT
+    'app.bsky.feed.like' AS collection,
+    *
+  FROM bluesky.jetstream.likes
+  UNION ALL BY NAME
+  SELECT
+    'app.bsky.feed.repost' AS collection,
+    *
+  FROM bluesky.jetstream.reposts
+  UNION ALL BY NAME
+  SELECT
+    'app.bsky.feed.post' AS collection,
+    *
+  FROM bluesky.jetstream.posts
+)
 SELECT
   did,
-  kind,
-  MAKE_TIMESTAMP(time_us) AS ts,
-  commit.collection,
-  commit.record,
-  TRY_STRPTIME(REPLACE(commit.record['createdAt'][1], '"', ''), '%Y-%m-%dT%H:%M:%S.%gZ') AS createdAt,
-  commit.record['subject'],
-  commit.record['subject'][1].uri AS uri,
-  'https://bsky.app/profile/' || SPLIT_PART(SPLIT_PART(uri, '/app.bsky', 1), 'at://', 2) || '/' || SPLIT_PART(SPLIT_PART(uri, '/', 4), '.', -1) || '/' || SPLIT_PART(uri, '/', -1) AS bsky_subject_url
-FROM bluesky.jetstream.jetstream
+  'commit' AS kind,
+  ts,
+  collection,
+  operation,
+  rkey,
+  created_at AS createdAt,
+  subject_did,
+  subject_rkey,
+  subject_uri AS uri,
+  bsky_subject_url
+FROM commits
 WHERE
   ts BETWEEN @start_ts AND @end_ts
\ No newline at end of file
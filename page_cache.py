@@ -0,0 +1,122 @@
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# SQLite file holding cached pages; caching is off unless it is set
+CACHE_PATH = os.getenv("bsky_page_cache", "")
+CACHE_TTL_HOURS = float(os.getenv("bsky_page_cache_ttl_hours", "24"))
+CACHE_MAX_MB = float(os.getenv("bsky_page_cache_max_mb", "1024"))
+
+# Only list pages are cached; getProfiles answers must be fresh for incremental crawls
+CACHEABLE_ENDPOINTS = ("app.bsky.graph.getFollows", "app.bsky.graph.getFollowers")
+
+# Each process checks the cache size after this many writes
+EVICT_EVERY = 100
+
+class PageCache:
+    """On-disk cache of XRPC list pages keyed by endpoint, actor, cursor and limit
+
+    Payloads are zlib compressed into a SQLite table in WAL mode, so every
+    worker process can read and write the same file. Pages older than the
+    TTL are misses. Once the cache grows past max_mb, the least recently
+    read pages are evicted until it is back under 90% of that.
+
+    Errors reading or writing the cache are logged and treated as misses,
+    so a broken cache slows a crawl down but never fails it.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl_hours: float = CACHE_TTL_HOURS, max_mb: float = CACHE_MAX_MB):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._con: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Clients are created before the workers fork, and SQLite connections must not cross a fork
+        if self._con is None or self._pid != os.getpid():
+            con = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+            """)
+            self._con, self._pid = con, os.getpid()
+        return self._con
+
+    @staticmethod
+    def key(endpoint: str, actor: str, cursor: Optional[str], limit: int) -> str:
+        return f"{endpoint}\t{actor}\t{cursor or ''}\t{limit}"
+
+    def get(self, endpoint: str, actor: str, cursor: Optional[str], limit: int) -> Optional[bytes]:
+        """The cached page, or None if it is missing or older than the TTL"""
+        key = self.key(endpoint, actor, cursor, limit)
+        now = time.time()
+        try:
+            con = self._connection()
+            row = con.execute("SELECT payload, stored_at FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                con.execute("DELETE FROM pages WHERE key = ?", (key,))
+                return None
+            con.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (now, key))
+            return zlib.decompress(row[0])
+        except (sqlite3.Error, zlib.error) as e:
+            logger.warning(f"Page cache read failed for {key!r}: {str(e)}")
+            return None
+
+    def put(self, endpoint: str, actor: str, cursor: Optional[str], limit: int, payload: bytes):
+        """Store a page fetched from the API"""
+        key = self.key(endpoint, actor, cursor, limit)
+        # The fastest level still shrinks JSON pages several times over
+        compressed = zlib.compress(payload, 1)
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (key, compressed, len(compressed), now, now),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Page cache write failed for {key!r}: {str(e)}")
+            return
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired pages, then the least recently read ones while the cache is over its size"""
+        try:
+            con = self._connection()
+            con.execute("DELETE FROM pages WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            total = con.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            excess = total - int(self.max_bytes * 0.9)
+            keys, freed = [], 0
+            for key, size in con.execute("SELECT key, size FROM pages ORDER BY accessed_at"):
+                keys.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            con.executemany("DELETE FROM pages WHERE key = ?", keys)
+            logger.debug(f"Evicted {len(keys)} pages ({freed / 1024 / 1024:.1f} MB) from the page cache")
+        except sqlite3.Error as e:
+            logger.warning(f"Page cache eviction failed: {str(e)}")
+
+def open_cache() -> Optional[PageCache]:
+    """The page cache configured by bsky_page_cache, or None when caching is disabled"""
+    return PageCache() if CACHE_PATH else None
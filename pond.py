@@ -0,0 +1,227 @@
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Columns written to pond/follows and pond/followers, named like the raw_http tables dlt builds
+POND_SCHEMA = pa.schema([
+    ("did", pa.string()),
+    ("handle", pa.string()),
+    ("display_name", pa.string()),
+    ("avatar", pa.string()),
+    ("description", pa.string()),
+    ("created_at", pa.string()),
+    ("indexed_at", pa.string()),
+    ("actor", pa.string()),
+    ("associated__chat__allow_incoming", pa.string()),
+    ("associated__labeler", pa.bool_()),
+])
+
+# Columns in the parquet files: the pond columns plus the crawl run that wrote them,
+# which tells compaction which rows are an actor's latest snapshot
+FILE_SCHEMA = POND_SCHEMA.append(pa.field("crawl_run", pa.int64()))
+
+# Every bucket keeps its own row group buffer, so these are per bucket
+ROW_GROUP_SIZE = 16_384
+MAX_FILE_BYTES = 256 * 1024 * 1024
+MAX_FILE_SECONDS = 600
+
+def empty_columns() -> Dict[str, List[Any]]:
+    return {name: [] for name in POND_SCHEMA.names}
+
+def columns_from_views(views, actor: str, indexed_at: str) -> Dict[str, List[Any]]:
+    """Project atproto ProfileView models straight into pond columns, skipping model_dump()"""
+    columns = empty_columns()
+    for view in views:
+        associated = view.associated
+        chat = associated.chat if associated else None
+        columns["did"].append(view.did)
+        columns["handle"].append(view.handle)
+        columns["display_name"].append(view.display_name)
+        columns["avatar"].append(view.avatar)
+        columns["description"].append(view.description)
+        columns["created_at"].append(view.created_at)
+        columns["indexed_at"].append(indexed_at)
+        columns["actor"].append(actor)
+        columns["associated__chat__allow_incoming"].append(chat.allow_incoming if chat else None)
+        columns["associated__labeler"].append(associated.labeler if associated else None)
+    return columns
+
+def columns_from_json(items: Iterable[Dict[str, Any]], actor: str, indexed_at: str) -> Dict[str, List[Any]]:
+    """Project raw XRPC profile JSON straight into pond columns"""
+    columns = empty_columns()
+    for item in items:
+        associated = item.get("associated") or {}
+        chat = associated.get("chat") or {}
+        columns["did"].append(item.get("did"))
+        columns["handle"].append(item.get("handle"))
+        columns["display_name"].append(item.get("displayName"))
+        columns["avatar"].append(item.get("avatar"))
+        columns["description"].append(item.get("description"))
+        columns["created_at"].append(item.get("createdAt"))
+        columns["indexed_at"].append(indexed_at)
+        columns["actor"].append(actor)
+        columns["associated__chat__allow_incoming"].append(chat.get("allowIncoming"))
+        columns["associated__labeler"].append(associated.get("labeler"))
+    return columns
+
+def to_batch(columns: Dict[str, List[Any]]) -> pa.RecordBatch:
+    return pa.RecordBatch.from_pydict(columns, schema=POND_SCHEMA)
+
+def serialize_batches(batches: List[pa.RecordBatch], schema: pa.Schema = POND_SCHEMA) -> bytes:
+    """Pack record batches into one Arrow IPC stream for sending between processes"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+def deserialize_batches(payload: bytes) -> pa.Table:
+    return pa.ipc.open_stream(payload).read_all()
+
+def actor_bucket(actor: str) -> int:
+    """Bucket an actor by the first hex digit of its md5
+
+    DuckDB can compute the same bucket, so queries for one actor can prune on
+    it: strpos('0123456789abcdef', md5(actor)[1]) - 1
+    """
+    return int(hashlib.md5(actor.encode()).hexdigest()[0], 16)
+
+class PondWriter:
+    """Streams Arrow data into rotating parquet files with a fixed schema
+
+    Tables are buffered only until a row group is full, then sorted by actor
+    and appended to the open file with pq.ParquetWriter, so memory stays flat
+    however large the crawl and row group statistics let readers skip actors.
+    A file is closed once the bytes actually written reach max_file_bytes or
+    it has been open for max_file_seconds; on_file_closed is called after
+    each close, when everything written so far is durable.
+
+    Files are written as <name>.parquet.inprogress and renamed once their
+    footer is written, so readers globbing *.parquet never see a partial
+    file, even after a crash.
+    """
+
+    def __init__(self, directory: str, prefix: str, run_id: int,
+                 row_group_size: int = ROW_GROUP_SIZE, max_file_bytes: int = MAX_FILE_BYTES,
+                 max_file_seconds: float = MAX_FILE_SECONDS,
+                 on_file_closed: Optional[Callable[[], None]] = None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.run_id = run_id
+        self.schema = FILE_SCHEMA
+        self.row_group_size = row_group_size
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.on_file_closed = on_file_closed
+
+        self.file_count = 0
+        self.rows_written = 0
+        self._pending: List[pa.Table] = []
+        self._buffered = 0
+        self._file_rows = 0
+        self._opened_at = 0.0
+        self._sink = None
+        self._writer = None
+
+    def write_table(self, table: pa.Table):
+        """Add rows, writing a row group each time one fills up"""
+        self._pending.append(table)
+        self._buffered += table.num_rows
+        while self._buffered >= self.row_group_size:
+            self._write_row_group(self.row_group_size)
+        if self._writer is not None and time.monotonic() - self._opened_at >= self.max_file_seconds:
+            self.flush()
+
+    def _write_row_group(self, num_rows: int):
+        if not self._buffered:
+            return
+        if self._writer is None:
+            self.file_count += 1
+            self._path = os.path.join(self.directory, f"{self.prefix}-{self.file_count:04d}.parquet")
+            self._sink = pa.OSFile(self._path + ".inprogress", "wb")
+            self._writer = pq.ParquetWriter(self._sink, self.schema)
+            self._opened_at = time.monotonic()
+
+        buffered = pa.concat_tables(self._pending)
+        row_group = buffered.slice(0, num_rows).sort_by("actor")
+        row_group = row_group.append_column("crawl_run", pa.array([self.run_id] * row_group.num_rows, pa.int64()))
+        self._writer.write_table(row_group, row_group_size=self.row_group_size)
+        rest = buffered.slice(num_rows)
+        self._pending = [rest] if rest.num_rows else []
+        self._file_rows += row_group.num_rows
+        self.rows_written += row_group.num_rows
+        self._buffered = rest.num_rows
+
+        if self._sink.tell() >= self.max_file_bytes:
+            self._close_file()
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            size = self._sink.tell()
+            self._sink.close()
+            os.replace(self._path + ".inprogress", self._path)
+            logger.info(f"Wrote {self._path} ({self._file_rows} records, {size/1024/1024:.1f}MB)")
+            self._writer = None
+            self._sink = None
+            self._file_rows = 0
+        if self.on_file_closed:
+            self.on_file_closed()
+
+    def flush(self):
+        """Write any buffered rows and close the current file"""
+        self._write_row_group(self._buffered)
+        self._close_file()
+
+    def close(self):
+        self.flush()
+
+class PartitionedPondWriter:
+    """Writes one side of the pond as crawl_date=/actor_bucket= hive partitions
+
+    Each actor always lands in the same bucket and every file name carries the
+    session start time, so repeated and resumed runs never overwrite each
+    other. on_file_closed is called with the bucket whose file was closed.
+    """
+
+    def __init__(self, directory: str, run_id: int,
+                 on_file_closed: Optional[Callable[[int], None]] = None, **writer_options):
+        now = datetime.utcnow()
+        self.directory = directory
+        self.run_id = run_id
+        self.crawl_date = now.date().isoformat()
+        self.session = now.strftime("%Y%m%dT%H%M%S")
+        self.on_file_closed = on_file_closed
+        self.writer_options = writer_options
+        self._writers: Dict[int, PondWriter] = {}
+
+    def write_table(self, actor: str, table: pa.Table):
+        """Add one actor's rows to its bucket"""
+        bucket = actor_bucket(actor)
+        writer = self._writers.get(bucket)
+        if writer is None:
+            writer = self._writers[bucket] = PondWriter(
+                os.path.join(self.directory, f"crawl_date={self.crawl_date}", f"actor_bucket={bucket}"),
+                f"part-{self.session}",
+                self.run_id,
+                on_file_closed=(lambda bucket=bucket: self.on_file_closed(bucket)) if self.on_file_closed else None,
+                **self.writer_options,
+            )
+        writer.write_table(table)
+
+    @property
+    def rows_written(self) -> int:
+        return sum(writer.rows_written for writer in self._writers.values())
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
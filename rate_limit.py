@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Mapping, Optional
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error, ReadTimeoutError
+
+from page_cache import CACHEABLE_ENDPOINTS, PageCache
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting, timeouts and server side failures
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Seconds a single page may take before it is abandoned and retried, so one slow response can't stall a worker
+PAGE_TIMEOUT = float(os.getenv("bsky_page_timeout", "30"))
+# Bytes read from the socket at a time while checking a page's deadline
+READ_CHUNK_SIZE = 64 * 1024
+
+def get_header(headers: Optional[Mapping[str, Any]], name: str) -> Optional[str]:
+    """Case-insensitive header lookup that works for plain dicts too"""
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        for key, item in headers.items():
+            if key.lower() == name:
+                return item
+    return value
+
+def parse_retry_after(headers: Optional[Mapping[str, Any]], now: float) -> Optional[float]:
+    """Seconds to wait according to Retry-After or the ratelimit-reset header"""
+    retry_after = get_header(headers, "retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+    # Bluesky sends ratelimit-reset as a unix timestamp
+    reset = get_header(headers, "ratelimit-reset")
+    if reset:
+        try:
+            return max(0.0, float(reset) - now)
+        except ValueError:
+            pass
+    return None
+
+def read_page(response: requests.Response, deadline: float) -> requests.Response:
+    """Read the body of a response sent with stream=True, raising requests.Timeout past the time.monotonic() deadline
+
+    requests' timeout only bounds each socket read, so a server trickling a
+    page out could hold a worker far longer than PAGE_TIMEOUT. Here every read
+    waits at most for the time left, and the body is abandoned once it's up.
+    """
+    connection = response.raw.connection
+    chunks = []
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise requests.Timeout(f"{response.url} was not received within its page timeout")
+            if connection is not None and connection.sock is not None:
+                connection.sock.settimeout(remaining)
+            chunk = response.raw.read1(READ_CHUNK_SIZE, decode_content=True)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except ReadTimeoutError as e:
+        response.close()
+        raise requests.ReadTimeout(str(e))
+    except Urllib3Error as e:
+        response.close()
+        raise requests.ConnectionError(str(e))
+    except requests.Timeout:
+        response.close()
+        raise
+    response._content = b"".join(chunks)
+    response._content_consumed = True
+    response.raw.release_conn()
+    return response
+
+class RateLimiter:
+    """Token bucket whose rate and concurrency window adapt AIMD style
+
+    All state lives in shared memory guarded by one lock, so a single instance
+    can be passed to worker processes, threads and asyncio tasks alike. Every
+    request takes a token and a concurrency slot with acquire() and hands them
+    back with release(), reporting the response status and headers.
+    """
+
+    def __init__(self, rate: float = 50.0, min_rate: float = 1.0, max_rate: float = 500.0,
+                 max_concurrency: int = 200, increase: float = 1.0, decrease: float = 0.5,
+                 safety: float = 0.9):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.safety = safety
+
+        self._lock = mp.Lock()
+        self._rate = mp.Value('d', rate, lock=False)
+        self._tokens = mp.Value('d', rate, lock=False)
+        self._updated_at = mp.Value('d', time.time(), lock=False)
+        self._blocked_until = mp.Value('d', 0.0, lock=False)
+        self._window = mp.Value('d', float(max_concurrency), lock=False)
+        self._in_flight = mp.Value('i', 0, lock=False)
+
+    @property
+    def rate(self) -> float:
+        return self._rate.value
+
+    @property
+    def window(self) -> int:
+        return int(self._window.value)
+
+    def _try_acquire(self) -> float:
+        """Take a token and a slot, or return how long to wait before trying again"""
+        with self._lock:
+            now = time.time()
+            rate = self._rate.value
+            # Refill, allowing at most one second worth of burst
+            elapsed = now - self._updated_at.value
+            self._tokens.value = min(max(rate, 1.0), self._tokens.value + elapsed * rate)
+            self._updated_at.value = now
+
+            if now < self._blocked_until.value:
+                return self._blocked_until.value - now
+            if self._in_flight.value >= max(1, int(self._window.value)):
+                return 0.01
+            if self._tokens.value < 1.0:
+                return (1.0 - self._tokens.value) / rate
+
+            self._tokens.value -= 1.0
+            self._in_flight.value += 1
+            return 0.0
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent"""
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait on the event loop until a request may be sent"""
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, status: Optional[int] = None, headers: Optional[Mapping[str, Any]] = None):
+        """Return the slot taken by acquire() and adapt to the response"""
+        with self._lock:
+            now = time.time()
+            self._in_flight.value = max(0, self._in_flight.value - 1)
+
+            if status == 429:
+                # Multiplicative decrease, then pause everyone until the server allows more
+                self._rate.value = max(self.min_rate, self._rate.value * self.decrease)
+                self._window.value = max(1.0, self._window.value * self.decrease)
+                self._tokens.value = 0.0
+                retry_after = parse_retry_after(headers, now)
+                if retry_after is None:
+                    retry_after = 1.0
+                self._blocked_until.value = max(self._blocked_until.value, now + retry_after)
+                logger.warning(f"Rate limited, backing off {retry_after:.1f}s "
+                               f"(rate {self._rate.value:.1f}/s, window {int(self._window.value)})")
+            elif status is None or status >= 500:
+                # Connection failures and server errors are congestion too, but only 429s pause everyone
+                self._rate.value = max(self.min_rate, self._rate.value * self.decrease)
+                self._window.value = max(1.0, self._window.value * self.decrease)
+            elif status < 400:
+                # Additive increase: about one more request per second each second
+                self._rate.value = min(self.max_rate, self._rate.value + self.increase / self._rate.value)
+                self._window.value = min(float(self.max_concurrency), self._window.value + 1.0 / self._window.value)
+
+            self._apply_server_limits(headers, now)
+
+    def _apply_server_limits(self, headers: Optional[Mapping[str, Any]], now: float):
+        """Keep the rate just under what the ratelimit-* headers say is left"""
+        remaining = get_header(headers, "ratelimit-remaining")
+        reset = get_header(headers, "ratelimit-reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = float(remaining)
+            seconds_left = max(1.0, float(reset) - now)
+        except ValueError:
+            return
+        if remaining <= 0:
+            self._blocked_until.value = max(self._blocked_until.value, now + seconds_left)
+            return
+        server_rate = self.safety * remaining / seconds_left
+        if server_rate < self._rate.value:
+            self._rate.value = max(self.min_rate, server_rate)
+
+class RateLimitedSession(requests.Session):
+    """requests session that sends every request through a RateLimiter and retries throttled ones"""
+
+    def __init__(self, rate_limiter: Optional[RateLimiter] = None, max_retries: int = 8,
+                 cache: Optional[PageCache] = None, timeout: float = PAGE_TIMEOUT):
+        super().__init__()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        # A metrics.Metrics set by the crawler to record request latencies and outcomes
+        self.metrics = None
+        # List pages are answered from here without touching the rate limiter
+        self.cache = cache
+
+    def _cached_response(self, request, page_key) -> Optional[requests.Response]:
+        payload = self.cache.get(*page_key)
+        if payload is None:
+            return None
+        if self.metrics:
+            self.metrics.increment("cache_hits")
+        response = requests.Response()
+        response.status_code = 200
+        response._content = payload
+        response.headers["Content-Type"] = "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        endpoint = url.path.rsplit("/", 1)[-1]
+        page_key = None
+        if self.cache and request.method == "GET" and endpoint in CACHEABLE_ENDPOINTS:
+            query = parse_qs(url.query)
+            page_key = (endpoint, query.get("actor", [""])[0], query.get("cursor", [None])[0],
+                        int(query.get("limit", ["50"])[0]))
+            cached = self._cached_response(request, page_key)
+            if cached is not None:
+                return cached
+        # requests waits forever unless a timeout is given, and then only bounds each socket read
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        stream = kwargs.get("stream", False)
+        kwargs["stream"] = True
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            response = None
+            start_time = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+                if not stream:
+                    read_page(response, start_time + self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A response whose body didn't arrive in time counts as a network error
+                response = None
+                if attempt == self.max_retries:
+                    raise
+                logger.debug(f"{type(e).__name__} for {request.url}, retrying")
+            finally:
+                status = response.status_code if response is not None else None
+                self.rate_limiter.release(status, response.headers if response is not None else None)
+                if self.metrics:
+                    self.metrics.observe_request(endpoint, time.monotonic() - start_time, status)
+            if response is not None:
+                if response.status_code not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    if page_key and response.status_code == 200:
+                        self.cache.put(*page_key, response.content)
+                    return response
+                logger.debug(f"Retrying {request.url} after HTTP {response.status_code}")
+            if self.metrics:
+                self.metrics.increment("retries")
+            if response is None or response.status_code != 429:
+                # 429s already hold everyone back for the Retry-After period
+                time.sleep(min(30.0, 0.5 * 2 ** attempt))
@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+# The modules are top-level scripts, so make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import FollowGraph
+from mock_xrpc import MockXrpcServer, SyntheticGraph
+
+@pytest.fixture(scope="session")
+def synthetic():
+    """A small synthetic follow graph whose root, account 0, follows 40 accounts"""
+    return SyntheticGraph(accounts=300, mean_follows=20, root_follows=40, seed=7)
+
+@pytest.fixture
+def server(synthetic):
+    """mock_xrpc.py serving the synthetic graph on a free port, without latency or 429s"""
+    server = MockXrpcServer(synthetic)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(scope="session")
+def follow_graph(synthetic):
+    """The synthetic graph as a FollowGraph, with node i being account i"""
+    src = np.array([account for account, targets in enumerate(synthetic.follows) for _ in targets], dtype=np.int32)
+    dst = np.array([target for targets in synthetic.follows for target in targets], dtype=np.int32)
+    accounts = range(synthetic.accounts)
+    return FollowGraph.from_edges(src, dst, [synthetic.did(a) for a in accounts], [synthetic.handle(a) for a in accounts])
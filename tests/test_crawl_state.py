@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+
+from crawl_state import CrawlState
+
+def test_unfinished_run_resumes_from_checkpoints(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    state = CrawlState(path)
+    assert not state.start_run("follows", "root")
+    run_id = state.run_id
+    state.add_actors(["alice", "bob"])
+    state.checkpoint([("alice", "follows", "cursor-3", False), ("bob", "follows", None, True), ("bob", "followers", None, True)])
+    state.close()
+
+    state = CrawlState(path)
+    assert state.resumable("follows", "root")
+    assert state.start_run("follows", "root")
+    assert state.run_id == run_id
+    assert state.pending_actors() == [("alice", {"follows": ("cursor-3", False), "followers": (None, False)}, None)]
+    assert state.remaining() == 1
+
+    state.checkpoint([("alice", "follows", None, True), ("alice", "followers", None, True)])
+    assert state.remaining() == 0
+    state.finish_run()
+    assert not state.resumable("follows", "root")
+    assert not state.start_run("follows", "root")
+    assert state.run_id != run_id
+    state.close()
+
+def test_state_can_be_used_from_the_writer_thread(tmp_path):
+    # The async crawler checkpoints from a worker thread while the event loop owns the state
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.start_run("follows", "root")
+    state.add_actors([f"actor{i}" for i in range(50)])
+    errors = []
+
+    def checkpoint(first):
+        try:
+            for i in range(first, 50, 2):
+                state.actor_dids()
+                state.checkpoint([(f"actor{i}", side, None, True) for side in ("follows", "followers")])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=checkpoint, args=(first,)) for first in (0, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert state.remaining() == 0
+    state.close()
+
+def test_largest_actors_are_dispatched_first(tmp_path):
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.start_run("follows", "root")
+    state.record_profiles({
+        "small": ("did:plc:small", 10, 10),
+        "huge": ("did:plc:huge", 50_000, 100),
+        "medium": ("did:plc:medium", 800, 900),
+    })
+    state.add_actors(["small", "huge", "medium"])
+    # Without counts an actor is sized by its page limit
+    state.add_actors(["limited"], sides=("follows",), max_pages={"limited": 30}, dids={"limited": "did:plc:limited"})
+    assert [actor for actor, _, _ in state.pending_actors()] == ["huge", "limited", "medium", "small"]
+    assert state.actor_dids()["limited"] == "did:plc:limited"
+    assert state.actor_dids()["huge"] == "did:plc:huge"
+    state.close()
+
+
+def test_only_changed_or_stale_actors_are_recrawled(tmp_path):
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.start_run("follows", "root")
+    profiles = {"alice": ("did:plc:alice", 5, 7), "bob": ("did:plc:bob", 1, 2)}
+    state.record_profiles(profiles)
+    state.add_actors(profiles)
+    # Only actors with both sides stored get a snapshot
+    state.checkpoint([("alice", "follows", None, True), ("alice", "followers", None, True), ("bob", "follows", None, True)])
+    assert state.select_changed(profiles, ttl_hours=24) == ["bob"]
+    assert state.select_changed({"alice": ("did:plc:alice", 6, 7)}, ttl_hours=24) == ["alice"]
+    assert state.select_changed({"alice": ("did:plc:alice", 5, 7)}, ttl_hours=0) == ["alice"]
+    state.close()
+
+
+def test_snapshots_are_kept_per_crawler_by_did(tmp_path):
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.start_run("follows", "root")
+    profiles = {"alice": ("did:plc:alice", 5, 7)}
+    state.record_profiles(profiles)
+    state.add_actors(profiles)
+    state.checkpoint([("alice", "follows", None, True), ("alice", "followers", None, True)])
+    state.finish_run()
+    # A rename keeps the snapshot
+    assert state.select_changed({"alice2": ("did:plc:alice", 5, 7)}, ttl_hours=24) == []
+
+    # follows_dlt.py stores its lists elsewhere, so follows.py's snapshot doesn't cover it
+    state.start_run("follows_dlt", "root")
+    assert state.select_changed(profiles, ttl_hours=24) == ["alice"]
+    state.close()
+
+def test_handle_keyed_snapshots_are_dropped(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE profile_snapshots (actor TEXT PRIMARY KEY, did TEXT, followers_count INTEGER, "
+                "follows_count INTEGER, crawled_at TEXT NOT NULL)")
+    con.execute("INSERT INTO profile_snapshots VALUES ('alice', 'did:plc:alice', 5, 7, '2100-01-01')")
+    con.commit()
+    con.close()
+
+    state = CrawlState(path)
+    state.start_run("follows", "root")
+    assert state.select_changed({"alice": ("did:plc:alice", 5, 7)}, ttl_hours=24) == ["alice"]
+    state.close()
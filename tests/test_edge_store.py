@@ -0,0 +1,82 @@
+import duckdb
+import pyarrow as pa
+
+from edge_store import EdgeStore
+from pond import columns_from_json, to_batch
+
+ACTOR_DIDS = {"alice.test": "did:plc:alice", "bob.test": "did:plc:bob"}
+
+def profiles(actor, *names):
+    """A table of pond columns listing the named accounts on one side of actor"""
+    return pa.Table.from_batches([to_batch(columns_from_json(
+        [{"did": f"did:plc:{name}", "handle": f"{name}.test", "createdAt": "2024-01-01T00:00:00.000Z"} for name in names],
+        actor, "2024-12-04T00:00:00",
+    ))])
+
+def query(path, sql):
+    con = duckdb.connect(path, read_only=True)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+def test_a_follow_seen_from_both_ends_is_stored_once(tmp_path):
+    path = str(tmp_path / "edges.duckdb")
+    store = EdgeStore(path, ACTOR_DIDS)
+    store.write("follows", profiles("alice.test", "bob", "carol"))
+    store.write("followers", profiles("bob.test", "alice", "dave"))
+    store.finish_side("alice.test", "follows")
+    # Rows of actors whose DID is unknown are skipped
+    store.write("follows", profiles("stranger.test", "bob"))
+    assert store.edges_written == 5
+    store.close()
+
+    assert query(path, "SELECT src_did, dst_did FROM graph.edges ORDER BY ALL") == [
+        ("did:plc:alice", "did:plc:bob"),
+        ("did:plc:alice", "did:plc:carol"),
+        ("did:plc:dave", "did:plc:bob"),
+    ]
+    assert query(path, "SELECT COUNT(*), COUNT(DISTINCT did) FROM graph.profiles") == [(4, 4)]
+    assert query(path, "SELECT did, side FROM graph.side_crawls") == [("did:plc:alice", "follows")]
+
+def changes(store, run_id, *finished):
+    """{(change_type, did)} of each side diffed for the finished (actor, side, complete) lists"""
+    found = store.snapshot_changes(list(finished), run_id)
+    return {
+        side: {(row["change_type"], row["did"]) for row in table.to_pylist()}
+        for side, table in found.items() if table.num_rows
+    }
+
+def test_snapshots_yield_only_follows_and_unfollows(tmp_path):
+    store = EdgeStore(str(tmp_path / "edges.duckdb"), ACTOR_DIDS)
+    store.stage("follows", profiles("alice.test", "bob", "carol"), 1)
+    assert changes(store, 1, ("alice.test", "follows", True)) == {
+        "follows": {("added", "did:plc:bob"), ("added", "did:plc:carol")},
+    }
+    store.commit_snapshots()
+
+    store.stage("follows", profiles("alice.test", "carol", "dave"), 2)
+    assert changes(store, 2, ("alice.test", "follows", True)) == {
+        "follows": {("added", "did:plc:dave"), ("removed", "did:plc:bob")},
+    }
+    store.commit_snapshots()
+
+    # An unchanged list matches its snapshot's hash and is not compared member by member
+    store.stage("follows", profiles("alice.test", "dave", "carol"), 3)
+    assert changes(store, 3, ("alice.test", "follows", True)) == {}
+    store.commit_snapshots()
+
+    # A list cut short by a page limit only adds follows
+    store.stage("follows", profiles("alice.test", "erin"), 4)
+    assert changes(store, 4, ("alice.test", "follows", False)) == {"follows": {("added", "did:plc:erin")}}
+    store.commit_snapshots()
+    store.close()
+
+def test_uncommitted_snapshots_are_diffed_again(tmp_path):
+    store = EdgeStore(str(tmp_path / "edges.duckdb"), ACTOR_DIDS)
+    store.stage("followers", profiles("bob.test", "alice"), 1)
+    assert changes(store, 1, ("bob.test", "followers", True)) == {"followers": {("added", "did:plc:alice")}}
+    # The load failed, so the next run finds the same change
+    store.stage("followers", profiles("bob.test", "alice"), 2)
+    assert changes(store, 2, ("bob.test", "followers", True)) == {"followers": {("added", "did:plc:alice")}}
+    store.close()
@@ -0,0 +1,66 @@
+import math
+
+from expand import BloomFilter, plan_expansion, rank_candidates, rank_roots
+
+def test_bloom_filter_has_no_false_negatives_and_survives_a_reload(tmp_path):
+    seen = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        seen.add(f"did:plc:{i}")
+    assert all(f"did:plc:{i}" in seen for i in range(1000))
+    false_positives = sum(f"did:web:{i}" in seen for i in range(10_000))
+    assert false_positives < 300
+
+    seen.save(str(tmp_path / "seen.bloom"))
+    loaded = BloomFilter.load(str(tmp_path / "seen.bloom"))
+    assert (loaded.capacity, loaded.error_rate, loaded.num_hashes) == (1000, 0.01, seen.num_hashes)
+    assert all(f"did:plc:{i}" in loaded for i in range(1000))
+    assert "did:plc:new" not in BloomFilter.load(str(tmp_path / "missing.bloom"))
+
+def test_candidates_are_ranked_by_the_root_follows_they_follow(synthetic, follow_graph):
+    root_follows = set(synthetic.follows[0])
+    first_hop = root_follows | set(synthetic.followers[0]) | {0}
+    candidates = list(rank_candidates(follow_graph, synthetic.handle(0)))
+    assert candidates
+    scores = [score for _, score in candidates]
+    assert scores == sorted(scores, reverse=True)
+    for did, score in candidates:
+        account = follow_graph.node(did)
+        assert account not in first_hop
+        assert score == len(root_follows & set(synthetic.follows[account])) > 0
+
+def test_several_roots_share_one_ranking_without_their_first_hops(synthetic, follow_graph):
+    roots = [synthetic.handle(0), synthetic.handle(1)]
+    first_hop = {0, 1}
+    for root in (0, 1):
+        first_hop |= set(synthetic.follows[root]) | set(synthetic.followers[root])
+    candidates = list(rank_roots(follow_graph, roots))
+    dids = [did for did, _ in candidates]
+    assert len(dids) == len(set(dids))
+    assert not {follow_graph.node(did) for did in dids} & first_hop
+    scores = [score for _, score in candidates]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_expansion_fits_the_budget_and_skips_what_was_seen(synthetic, follow_graph):
+    candidates = list(rank_candidates(follow_graph, synthetic.handle(0)))
+    lookups = []
+
+    def lookup(dids):
+        lookups.append(list(dids))
+        for did in dids:
+            account = follow_graph.node(did)
+            yield did, synthetic.handle(account), len(synthetic.follows[account])
+
+    seen = BloomFilter(capacity=1000)
+    plan = plan_expansion(candidates, lookup, seen, budget=30, max_pages=1)
+    assert plan
+    assert all(len(batch) <= 25 for batch in lookups)
+    assert len(lookups) + sum(plan.values()) <= 30
+    for handle, pages in plan.items():
+        account = follow_graph.node(handle)
+        assert pages == max(1, math.ceil(len(synthetic.follows[account]) / 100)) == 1
+        assert synthetic.did(account) in seen
+
+    # A later expansion moves on to accounts that were not considered yet
+    again = plan_expansion(candidates, lookup, seen, budget=30, max_pages=1)
+    assert not set(again) & set(plan)
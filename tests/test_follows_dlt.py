@@ -0,0 +1,76 @@
+import queue
+
+import pytest
+import requests
+
+dlt = pytest.importorskip("dlt")
+
+import follows_dlt
+from crawl_state import CrawlState
+from dlt.sources.helpers.rest_client import RESTClient
+from mock_xrpc import SyntheticGraph
+from rate_limit import RateLimitedSession, RateLimiter
+
+@pytest.fixture
+def client(server, monkeypatch):
+    """follows_dlt's shared client pointed at the mock server"""
+    client = RESTClient(base_url=server.url + "/xrpc/", session=RateLimitedSession(RateLimiter(rate=500.0)))
+    monkeypatch.setattr(follows_dlt, "bluesky_client", client)
+    yield client
+    client.session.close()
+
+def test_get_pages_walks_every_page(client, synthetic):
+    pages = list(follows_dlt.get_pages("app.bsky.graph.getFollowers", SyntheticGraph.handle(0)))
+    assert [record["did"] for records, _ in pages for record in records] == \
+        [synthetic.did(follower) for follower in synthetic.followers[0]]
+    assert pages[-1][1] is None
+
+def test_unknown_actor_is_finished_as_an_empty_list(client):
+    assert list(follows_dlt.get_pages("app.bsky.graph.getFollows", "deleted.bsky.social")) == []
+
+    results = queue.Queue()
+    resume = {"follows": (None, False), "followers": (None, False)}
+    assert follows_dlt.collect_data("deleted.bsky.social", resume, 0, results)[2]
+    chunks = [results.get_nowait() for _ in range(results.qsize())]
+    assert [(side, cursor, done) for _, _, side, _, cursor, done in chunks] == \
+        [("follows", None, True), ("followers", None, True)]
+
+def test_failure_after_the_first_page_is_not_an_empty_list(client):
+    # A resumed side failing must not be checkpointed as finished
+    with pytest.raises(requests.HTTPError):
+        list(follows_dlt.get_pages("app.bsky.graph.getFollows", "deleted.bsky.social", cursor="100"))
+
+class FailingPipeline:
+    def run(self, data):
+        raise RuntimeError("destination is locked")
+
+def test_a_side_that_failed_to_load_is_never_checkpointed(synthetic, tmp_path, monkeypatch):
+    monkeypatch.setattr(follows_dlt, "EDGE_STORE_PATH", "")
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    state.start_run("follows_dlt", "root")
+    state.add_actors(["alice", "bob"])
+    loader = follows_dlt.BatchLoader(state)
+
+    def chunk(actor, accounts):
+        records = [synthetic.profile(account) for account in accounts]
+        return follows_dlt.pack_chunk([follows_dlt.page_to_batch(records, actor)])
+
+    monkeypatch.setattr(follows_dlt, "pipeline", FailingPipeline())
+    loader.add("alice", "follows", chunk("alice", range(10)), "10", False)
+    loader.flush()
+    assert loader.loads == 0
+
+    monkeypatch.setattr(follows_dlt, "pipeline", dlt.pipeline(
+        pipeline_name="test_batch_loader", pipelines_dir=str(tmp_path / "pipelines"),
+        destination=dlt.destinations.duckdb(str(tmp_path / "bluesky.duckdb")), dataset_name="raw_http",
+    ))
+    # The rest of alice's follows load, but without the first page her list would be resumed short
+    loader.add("alice", "follows", chunk("alice", range(10, 15)), None, True)
+    loader.add("alice", "followers", chunk("alice", range(3)), None, True)
+    loader.add("bob", "follows", chunk("bob", range(4)), None, True)
+    loader.add("bob", "followers", chunk("bob", range(2)), None, True)
+    loader.flush()
+    assert loader.loads == 1
+    assert loader.rows_loaded == 14
+    assert state.pending_actors() == [("alice", {"follows": (None, False), "followers": (None, True)}, None)]
+    state.close()
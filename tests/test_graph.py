@@ -0,0 +1,80 @@
+import numpy as np
+import pyarrow as pa
+
+from client import BlueskyClient
+from graph import SIGNALS, FollowGraph
+from mock_xrpc import SyntheticGraph
+from pond import PartitionedPondWriter
+
+def brute_force_scores(synthetic, root):
+    """Each signal counted by walking the adjacency lists directly"""
+    follows = synthetic.follows
+    followers = synthetic.followers
+    scores = {signal: np.zeros(synthetic.accounts, dtype=np.int64) for signal in SIGNALS}
+    for seed in follows[root]:
+        for target in follows[seed]:
+            scores["follows_of_follows"][target] += 1
+        for target in followers[seed]:
+            scores["followers_of_follows"][target] += 1
+    for seed in followers[root]:
+        for target in follows[seed]:
+            scores["follows_of_followers"][target] += 1
+        for target in followers[seed]:
+            scores["followers_of_followers"][target] += 1
+    for values in scores.values():
+        values[follows[root] + [root]] = 0
+    return scores
+
+def test_candidate_scores_match_a_brute_force_count(synthetic, follow_graph):
+    for root in (0, 5):
+        scores = follow_graph.candidate_scores(root)
+        expected = brute_force_scores(synthetic, root)
+        for signal in SIGNALS:
+            np.testing.assert_array_equal(scores[signal], expected[signal])
+        assert scores["jaccard"][root] == 0
+        assert 0 <= scores["jaccard"].max() <= 1
+
+def test_recommendations_come_best_first_without_followed_accounts(synthetic, follow_graph):
+    recommendations = follow_graph.recommend(0, "followers_of_follows", top=10)
+    assert len(recommendations) == 10
+    values = [score for _, _, score in recommendations]
+    assert values == sorted(values, reverse=True)
+    for did, handle, _ in recommendations:
+        account = follow_graph.node(did)
+        assert handle == synthetic.handle(account)
+        assert account != 0 and account not in synthetic.follows[0]
+
+def test_saved_graph_memory_maps_back_unchanged(follow_graph, tmp_path):
+    path = str(tmp_path / "bluesky.graph")
+    follow_graph.save(path)
+    loaded = FollowGraph.load(path)
+    assert (loaded.num_nodes, loaded.num_edges) == (follow_graph.num_nodes, follow_graph.num_edges)
+    np.testing.assert_array_equal(loaded.out_indices, follow_graph.out_indices)
+    np.testing.assert_array_equal(loaded.in_indptr, follow_graph.in_indptr)
+    assert loaded.did(17) == follow_graph.did(17) and loaded.handle(17) == follow_graph.handle(17)
+    assert loaded.recommend(0) == follow_graph.recommend(0)
+
+def test_graph_built_from_a_crawled_pond(server, synthetic, tmp_path):
+    client = BlueskyClient(base_url=server.url, raw=True)
+    writers = {side: PartitionedPondWriter(str(tmp_path / "pond" / side), 1) for side in ("follows", "followers")}
+    actors = [0] + synthetic.follows[0]
+    for account in actors:
+        actor = SyntheticGraph.handle(account)
+        for batch, _ in client.get_follows_batches(actor):
+            writers["follows"].write_table(actor, pa.Table.from_batches([batch]))
+    root = SyntheticGraph.handle(0)
+    for batch, _ in client.get_followers_batches(root):
+        writers["followers"].write_table(root, pa.Table.from_batches([batch]))
+    for writer in writers.values():
+        writer.close()
+    client.close()
+
+    graph = FollowGraph.load_pond(str(tmp_path / "pond"))
+    node = graph.node(root)
+    assert graph.did(node) == synthetic.did(0)
+    assert sorted(graph.did(n) for n in graph.follows(node)) == sorted(synthetic.did(a) for a in synthetic.follows[0])
+    assert sorted(graph.did(n) for n in graph.followers(node)) == sorted(synthetic.did(a) for a in synthetic.followers[0])
+    # Every crawled follows list is in the graph, keyed by DID
+    for account in synthetic.follows[0][:5]:
+        follows = graph.follows(graph.node(synthetic.did(account)))
+        assert sorted(graph.did(n) for n in follows) == sorted(synthetic.did(a) for a in synthetic.follows[account])
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import duckdb
+import pytest
+
+from jetstream_consumer import COLUMNS_SQL, JetstreamConsumer, replay_server
+
+COLLECTION = "app.bsky.graph.follow"
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def follow_event(n):
+    """The nth follow commit, n seconds into 2024-12-04"""
+    return {
+        "did": f"did:plc:user{n % 3}",
+        "time_us": 1733270400_000000 + n * 1_000_000,
+        "kind": "commit",
+        "commit": {
+            "rev": f"rev{n}", "operation": "create", "collection": COLLECTION, "rkey": f"rkey{n}", "cid": f"cid{n}",
+            "record": {"$type": COLLECTION, "subject": f"did:plc:subject{n}", "createdAt": "2024-12-04T00:00:00Z"},
+        },
+    }
+
+def serve(tmp_path, events):
+    """Start jetstream_consumer.py's replay server for events on a free port and return its URL"""
+    path = tmp_path / f"events{len(events)}.ndjson"
+    path.write_text("".join(json.dumps(event) + "\n" for event in events))
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    threading.Thread(target=replay_server, args=(str(path), "localhost", port), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return f"ws://localhost:{port}/subscribe"
+
+def consume(url, database, until_cursor):
+    """Run a consumer until it has stored everything up to until_cursor, then stop it like a crash would"""
+    consumer = JetstreamConsumer(url, [COLLECTION], database, batch_size=4, batch_seconds=0.1)
+
+    async def run():
+        task = asyncio.create_task(consumer.run())
+        deadline = time.monotonic() + 20
+        while consumer.cursor != until_cursor and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    return consumer
+
+def stored(database):
+    con = duckdb.connect(database)
+    try:
+        return con.execute("SELECT did, time_us FROM jetstream.jetstream ORDER BY time_us").fetchall(), \
+            con.execute("SELECT COUNT(*) FROM jetstream.follows").fetchone()[0]
+    finally:
+        con.close()
+
+def test_restart_resumes_from_the_cursor_without_duplicates(tmp_path):
+    database = str(tmp_path / "bluesky.duckdb")
+    events = [follow_event(n) for n in range(10)]
+
+    first = consume(serve(tmp_path, events[:6]), database, events[5]["time_us"])
+    assert first.events_written == 6
+
+    # The replay starts at the cursor, so the last stored event arrives again and is dropped
+    second = consume(serve(tmp_path, events), database, events[9]["time_us"])
+    assert second.connect_url().endswith(f"cursor={events[9]['time_us']}")
+    assert second.events_written == 4
+
+    rows, follows = stored(database)
+    assert rows == [(event["did"], event["time_us"]) for event in events]
+    assert follows == 10
+
+@pytest.mark.skipif(shutil.which("duckdb") is None, reason="update_jetstream.sql needs the duckdb CLI")
+def test_consumer_skips_events_the_catalog_import_stored(tmp_path):
+    database = str(tmp_path / "bluesky.duckdb")
+    events = [follow_event(n) for n in range(10)]
+    consume(serve(tmp_path, events[:4]), database, events[3]["time_us"])
+
+    # A local stand-in for the hive partitioned catalog, holding events the consumer has not seen yet
+    (tmp_path / "catalog.ndjson").write_text("".join(json.dumps(event) + "\n" for event in events[:8]))
+    con = duckdb.connect(str(tmp_path / "catalog.duckdb"))
+    con.execute(f"""
+        CREATE TABLE jetstream AS
+        SELECT *, day(make_timestamp(time_us)) AS day, hour(make_timestamp(time_us)) AS hour,
+            month(make_timestamp(time_us)) AS month, year(make_timestamp(time_us)) AS year
+        FROM read_json('{tmp_path}/catalog.ndjson', format = 'newline_delimited', columns = {COLUMNS_SQL})
+    """)
+    con.close()
+    with open(os.path.join(REPO, "update_jetstream.sql")) as f:
+        sql = f.read().replace("https://hive.buz.dev/bluesky/catalog", "catalog.duckdb")
+    shutil.copy(os.path.join(REPO, "jetstream_tables.sql"), tmp_path)
+    subprocess.run(["duckdb"], input=sql, text=True, cwd=tmp_path, check=True, capture_output=True)
+    rows, _ = stored(database)
+    assert len(rows) == 8
+
+    # The consumer resumes from its own cursor, so the replay repeats what the import stored
+    consumer = consume(serve(tmp_path, events), database, events[9]["time_us"])
+    assert consumer.events_written == 2
+
+    rows, follows = stored(database)
+    assert rows == [(event["did"], event["time_us"]) for event in events]
+    assert follows == 10
@@ -0,0 +1,73 @@
+import json
+import multiprocessing as mp
+import socket
+import urllib.request
+
+from metrics import Metrics, MetricsExporter, outcome
+
+def test_statuses_map_to_outcomes():
+    assert [outcome(status) for status in (None, 200, 404, 429, 503)] == \
+        ["network_error", "ok", "client_error", "throttled", "server_error"]
+
+def test_snapshot_counts_requests_and_latency_per_endpoint():
+    metrics = Metrics()
+    for seconds in (0.005, 0.02, 0.02, 0.3):
+        metrics.observe_request("app.bsky.graph.getFollows", seconds, 200)
+    metrics.observe_request("app.bsky.graph.getFollows", 12.0, 429)
+    metrics.observe_request("com.example.unknown", 0.5, None)
+    metrics.record_page(100)
+    metrics.record_page(40)
+    metrics.increment("retries", 2)
+
+    snapshot = metrics.snapshot({"task_queue": 3})
+    assert (snapshot["pages"], snapshot["records"], snapshot["retries"], snapshot["task_queue"]) == (2, 140, 2, 3)
+    follows = snapshot["endpoints"]["app.bsky.graph.getFollows"]
+    assert (follows["requests"], follows["ok"], follows["throttled"]) == (5, 4, 1)
+    assert follows["latency_mean"] == (0.005 + 0.02 + 0.02 + 0.3 + 12.0) / 5
+    assert (follows["latency_p50"], follows["latency_p90"]) == (0.025, 10.0)
+    assert follows["latency_buckets"]["inf"] == 1
+    # Unknown endpoints are counted together, and endpoints without requests are left out
+    assert snapshot["endpoints"]["other"]["network_error"] == 1
+    assert set(snapshot["endpoints"]) == {"app.bsky.graph.getFollows", "other"}
+
+def record(metrics):
+    metrics.record_page(10, worker=1)
+
+def test_workers_update_the_same_metrics_and_heartbeat_their_own_slot():
+    metrics = Metrics(num_workers=2)
+    before = metrics.last_heartbeat(1)
+    process = mp.get_context("fork").Process(target=record, args=(metrics,))
+    process.start()
+    process.join()
+    assert metrics.snapshot()["records"] == 10
+    assert metrics.last_heartbeat(1) > before
+    assert metrics.last_heartbeat(0) == before
+
+def test_prometheus_histograms_are_cumulative():
+    metrics = Metrics()
+    metrics.observe_request("app.bsky.actor.getProfiles", 0.03, 200)
+    metrics.observe_request("app.bsky.actor.getProfiles", 0.2, 200)
+    lines = metrics.prometheus().splitlines()
+    bucket = 'bsky_crawl_request_seconds_bucket{endpoint="app.bsky.actor.getProfiles",le="%s"} %d'
+    assert bucket % ("0.025", 0) in lines
+    assert bucket % ("0.05", 1) in lines
+    assert bucket % ("0.25", 2) in lines
+    assert bucket % ("+Inf", 2) in lines
+    assert 'bsky_crawl_requests_total{endpoint="app.bsky.actor.getProfiles",outcome="ok"} 2' in lines
+
+def test_exporter_writes_json_and_serves_prometheus(tmp_path):
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        port = s.getsockname()[1]
+    metrics = Metrics()
+    metrics.record_page(7)
+    path = str(tmp_path / "crawl_metrics.json")
+    exporter = MetricsExporter(metrics, path, port, interval=60, gauges={"result_queue": lambda: 5}).start()
+    with urllib.request.urlopen(f"http://localhost:{port}/metrics") as response:
+        body = response.read().decode()
+    assert "bsky_crawl_records_total 7" in body
+    assert "bsky_crawl_result_queue 5" in body
+    exporter.stop()
+    with open(path) as f:
+        snapshot = json.load(f)
+    assert (snapshot["records"], snapshot["result_queue"]) == (7, 5)
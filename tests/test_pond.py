@@ -0,0 +1,123 @@
+import glob
+import os
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import compact_pond
+from client import BlueskyClient
+from mock_xrpc import SyntheticGraph
+from pond import (
+    POND_SCHEMA, PartitionedPondWriter, PondWriter, actor_bucket, columns_from_json, deserialize_batches,
+    serialize_batches, to_batch,
+)
+
+def profile_table(synthetic, actor, accounts):
+    return pa.Table.from_batches([to_batch(columns_from_json(
+        [synthetic.profile(account) for account in accounts], actor, "2024-12-04T00:00:00"
+    ))])
+
+def test_batches_round_trip_through_ipc(synthetic):
+    batch = to_batch(columns_from_json([synthetic.profile(account) for account in range(14)], "root", None))
+    table = deserialize_batches(serialize_batches([batch, batch]))
+    assert table.schema == POND_SCHEMA
+    assert table.num_rows == 28
+    assert table.column("did").to_pylist()[:2] == [synthetic.did(0), synthetic.did(1)]
+    # Every seventh synthetic profile has associated fields
+    assert table.column("associated__chat__allow_incoming").to_pylist()[:8] == ["following"] + [None] * 6 + ["following"]
+
+def test_writer_rotates_files_and_reports_each_close(synthetic, tmp_path):
+    closed = []
+    writer = PondWriter(str(tmp_path), "part", 3, row_group_size=10, max_file_bytes=1,
+                        on_file_closed=lambda: closed.append(writer.file_count))
+    writer.write_table(profile_table(synthetic, "zed", range(15)))
+    writer.write_table(profile_table(synthetic, "amy", range(15, 25)))
+    assert closed == [1, 2]
+    writer.close()
+    # Closing always reports that everything written is durable, even with no file left open
+    assert closed[:3] == [1, 2, 3] and set(closed) == {1, 2, 3}
+
+    files = sorted(glob.glob(str(tmp_path / "part-*.parquet")))
+    assert len(files) == 3
+    table = pa.concat_tables(pq.read_table(path) for path in files)
+    assert table.num_rows == 25
+    assert set(table.column("crawl_run").to_pylist()) == {3}
+    # Row groups are sorted by actor so readers can skip actors by their statistics
+    second = pq.read_table(files[1]).column("actor").to_pylist()
+    assert second == sorted(second)
+
+def test_client_pages_lists_into_the_pond(server, synthetic, tmp_path):
+    client = BlueskyClient(base_url=server.url, raw=True)
+    # The most followed account needs several pages of followers
+    popular = max(range(synthetic.accounts), key=lambda account: len(synthetic.followers[account]))
+    assert len(synthetic.followers[popular]) > 100
+    actor = SyntheticGraph.handle(popular)
+    writer = PartitionedPondWriter(str(tmp_path / "followers"), 1)
+    cursors = []
+    for batch, cursor in client.get_followers_batches(actor):
+        writer.write_table(actor, pa.Table.from_batches([batch]))
+        cursors.append(cursor)
+    writer.close()
+    client.close()
+
+    assert cursors[-1] is None and all(cursors[:-1])
+    table = pq.read_table(os.path.join(tmp_path, "followers"))
+    assert sorted(table.column("did").to_pylist()) == sorted(synthetic.did(a) for a in synthetic.followers[popular])
+    assert set(table.column("actor").to_pylist()) == {actor}
+
+def test_partitioned_writer_buckets_actors_like_duckdb(synthetic, tmp_path):
+    writer = PartitionedPondWriter(str(tmp_path / "follows"), 1)
+    actors = [SyntheticGraph.handle(account) for account in range(20)]
+    for account, actor in enumerate(actors):
+        writer.write_table(actor, profile_table(synthetic, actor, synthetic.follows[account]))
+    writer.close()
+    assert writer.rows_written == sum(len(synthetic.follows[account]) for account in range(20))
+
+    rows = duckdb.sql(f"""
+        SELECT DISTINCT actor, actor_bucket, strpos('0123456789abcdef', md5(actor)[1]) - 1 AS computed
+        FROM read_parquet('{tmp_path}/follows/*/*/*.parquet', hive_partitioning = true)
+    """).fetchall()
+    assert len(rows) == 20
+    for actor, bucket, computed in rows:
+        assert bucket == actor_bucket(actor) == computed
+
+
+def test_files_only_appear_once_complete(synthetic, tmp_path):
+    writer = PondWriter(str(tmp_path), "part", 1, row_group_size=10)
+    writer.write_table(profile_table(synthetic, "amy", range(25)))
+    # Like a crawl that crashed here, the open file has row groups but no footer
+    assert glob.glob(str(tmp_path / "*.parquet")) == []
+    assert len(glob.glob(str(tmp_path / "*.parquet.inprogress"))) == 1
+    writer.close()
+    assert glob.glob(str(tmp_path / "*.inprogress")) == []
+    assert pq.read_table(str(tmp_path / "part-0001.parquet")).num_rows == 25
+
+def test_compaction_keeps_each_actors_latest_crawl(synthetic, tmp_path, monkeypatch):
+    monkeypatch.setattr(compact_pond, "POND", str(tmp_path))
+    for run_id, actors in ((1, ["amy", "bob"]), (2, ["amy"])):
+        writer = PartitionedPondWriter(str(tmp_path / "follows"), run_id)
+        writer.session = f"run{run_id}"
+        for actor in actors:
+            # amy followed 10 accounts in the first crawl and 5 others in the second
+            accounts = range(10) if run_id == 1 else range(20, 25)
+            writer.write_table(actor, profile_table(synthetic, actor, accounts))
+        writer.close()
+    # A page refetched after a crash is stored twice within the same crawl
+    writer = PartitionedPondWriter(str(tmp_path / "follows"), 2)
+    writer.session = "run2-resumed"
+    writer.write_table("amy", profile_table(synthetic, "amy", range(20, 22)))
+    writer.close()
+
+    con = duckdb.connect()
+    compact_pond.compact_side(con, "follows")
+    rows = con.execute(f"""
+        SELECT actor, crawl_run, did, filename
+        FROM read_parquet('{tmp_path}/follows/*/*/*.parquet', hive_partitioning = true, filename = true)
+    """).fetchall()
+    con.close()
+    assert sorted((actor, run, did) for actor, run, did, _ in rows) == sorted(
+        [("amy", 2, synthetic.did(a)) for a in range(20, 25)] + [("bob", 1, synthetic.did(a)) for a in range(10)]
+    )
+    assert all(os.path.basename(filename).startswith("compacted-") for *_, filename in rows)
+    assert not os.path.exists(tmp_path / "follows.previous")
@@ -0,0 +1,139 @@
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import client
+from client import BlueskyClient
+from mock_xrpc import SyntheticGraph
+from rate_limit import RateLimitedSession, RateLimiter, parse_retry_after
+
+def test_parse_retry_after():
+    now = time.time()
+    assert parse_retry_after({"Retry-After": "2.5"}, now) == 2.5
+    assert 9 <= parse_retry_after({"retry-after": formatdate(now + 10, usegmt=True)}, now) <= 10
+    assert parse_retry_after({"ratelimit-reset": str(now + 4)}, now) == 4
+    assert parse_retry_after({"Retry-After": "soon"}, now) is None
+    assert parse_retry_after(None, now) is None
+
+def test_successes_increase_rate_and_window():
+    limiter = RateLimiter(rate=10.0, max_concurrency=4)
+    limiter._window.value = 2.0
+    limiter.acquire()
+    limiter.release(200)
+    assert limiter.rate == 10.0 + 1.0 / 10.0
+    assert limiter._window.value == 2.5
+
+def test_429_halves_rate_and_window_and_pauses_everyone():
+    limiter = RateLimiter(rate=100.0, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(429, {"Retry-After": "0.3"})
+    assert limiter.rate == 50.0
+    assert limiter.window == 4
+    start_time = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start_time >= 0.25
+
+def test_server_and_network_errors_shrink_rate_and_window():
+    limiter = RateLimiter(rate=20.0, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(503)
+    assert limiter.rate == 10.0
+    assert limiter.window == 4
+    limiter.acquire()
+    limiter.release(None)
+    assert limiter.rate == 5.0
+    assert limiter.window == 2
+    # Unlike a 429 neither pauses the other workers
+    assert limiter._try_acquire() == 0
+
+def test_window_caps_requests_in_flight():
+    limiter = RateLimiter(rate=100.0, max_concurrency=2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter._try_acquire() > 0
+    limiter.release(200)
+    assert limiter._try_acquire() == 0
+
+def test_ratelimit_headers_cap_rate():
+    limiter = RateLimiter(rate=50.0)
+    limiter.acquire()
+    limiter.release(200, {"ratelimit-remaining": "100", "ratelimit-reset": str(time.time() + 10)})
+    assert limiter.rate == pytest.approx(9.0, rel=0.01)
+
+def test_session_retries_throttled_requests(server, synthetic):
+    server.error_rate = 0.5
+    server.retry_after = 0.01
+    session = RateLimitedSession(RateLimiter(rate=500.0))
+    for account in range(4):
+        response = session.get(f"{server.url}/xrpc/app.bsky.graph.getFollows",
+                               params={"actor": SyntheticGraph.handle(account), "limit": 100})
+        assert response.status_code == 200
+        assert [follow["did"] for follow in response.json()["follows"]] == \
+            [synthetic.did(target) for target in synthetic.follows[account][:100]]
+    assert server.counters["throttled"] > 0
+    assert server.counters["pages"] == 4
+    session.close()
+
+def test_session_backs_off_on_network_errors(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    # Nothing listens on port 9 of localhost, so every attempt is refused
+    session = RateLimitedSession(RateLimiter(rate=500.0), max_retries=3)
+    with pytest.raises(requests.ConnectionError):
+        session.get("http://127.0.0.1:9/xrpc/app.bsky.graph.getFollows", params={"actor": "alice"})
+    assert sleeps == [0.5, 1.0, 2.0]
+    assert session.rate_limiter.rate < 500.0
+    session.close()
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """Sends a page one byte every 50ms, so no single socket read ever times out"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        body = b'{"follows": []}' * 10
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for byte in range(len(body)):
+                self.wfile.write(body[byte:byte + 1])
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def trickle_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TrickleHandler)
+    server.daemon_threads = True
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_page_timeout_bounds_the_whole_page(trickle_server, monkeypatch):
+    url = "http://127.0.0.1:%d/xrpc/app.bsky.graph.getFollows" % trickle_server.server_address[1]
+    session = RateLimitedSession(RateLimiter(rate=500.0), max_retries=1, timeout=0.3)
+    start_time = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        session.get(url, params={"actor": "alice"})
+    # Two attempts of 0.3s and the 0.5s backoff between them, rather than 7.5s per attempt
+    assert time.monotonic() - start_time < 2.0
+    assert trickle_server.requests == 2
+    session.close()
+
+    monkeypatch.setattr(client, "PAGE_TIMEOUT", 0.3)
+    bluesky = BlueskyClient(base_url="http://127.0.0.1:%d" % trickle_server.server_address[1], raw=True, max_retries=0)
+    with pytest.raises(requests.Timeout):
+        bluesky.get_follows_batches("alice").__next__()
+    bluesky.close()
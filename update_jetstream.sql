@@ -1,9 +1,52 @@
-/* attach 'https://hive.buz.dev/bluesky/catalog' as jetstream;
-attach 'bluesky.duckdb' as bluesky;
-create schema if not exists bluesky.jetstream;
-create table if not exists bluesky.jetstream.jetstream as select * from jetstream.jetstream;
-insert into bluesky.jetstream.jetstream select * from jetstream.jetstream; */
+/* Incremental import of the hive partitioned jetstream catalog into bluesky.duckdb.
+Only partitions at or after the hour of the last imported event are read, and only
+events newer than it are inserted, so each run transfers just the new data. Events that
+jetstream_consumer.py already stored are skipped. The new events are also parsed into the
+typed per-collection tables by jetstream_tables.sql. */
 
 attach 'https://hive.buz.dev/bluesky/catalog' as jetstream;
 attach 'bluesky.duckdb' as bluesky;
-insert into bluesky.jetstream.jetstream select * from jetstream.jetstream;
\ No newline at end of file
+
+create schema if not exists bluesky.jetstream;
+create table if not exists bluesky.jetstream.jetstream as select * from jetstream.jetstream limit 0;
+create table if not exists bluesky.jetstream.consumer_cursors (
+    consumer varchar primary key,
+    time_us bigint not null,
+    updated_at timestamp not null
+);
+
+-- jetstream_consumer.py writes to the same table with its own cursor, so the catalog keeps a
+-- separate watermark; before the first incremental run it is the newest event in the table
+set variable watermark = coalesce(
+    (select time_us from bluesky.jetstream.consumer_cursors where consumer = 'catalog'),
+    (select max(time_us) from bluesky.jetstream.jetstream),
+    -1
+);
+set variable watermark_hour = date_trunc('hour', make_timestamp(getvariable('watermark')));
+
+-- The filters on year, month, day and hour only touch partition columns, so older partitions are pruned.
+-- The consumer's events past the watermark are already in the table, and an event is unique by (did, time_us)
+create or replace temp table new_events as
+select * from jetstream.jetstream as c
+where year >= year(getvariable('watermark_hour'))
+  and make_timestamp(year, month, day, hour, 0, 0) >= getvariable('watermark_hour')
+  and time_us > getvariable('watermark')
+  and not exists (
+      select 1 from bluesky.jetstream.jetstream as s
+      where s.time_us > getvariable('watermark')
+        and s.did = c.did
+        and s.time_us = c.time_us
+  );
+
+-- The typed tables are written through the bluesky catalog, where jetstream is a schema rather than the remote catalog
+detach jetstream;
+use bluesky;
+
+begin transaction;
+insert into bluesky.jetstream.jetstream by name select * from new_events;
+insert or replace into bluesky.jetstream.consumer_cursors
+select 'catalog', max(time_us), now() from new_events having max(time_us) is not null;
+.read jetstream_tables.sql
+commit;
+
+select count(*) as imported, getvariable('watermark') as previous_watermark, max(time_us) as watermark from new_events;